@@ -1,47 +1,136 @@
 import os
 import logging
+import importlib
 from flask import Flask
+from flask.cli import AppGroup
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
+from .db_routing import RoutingSession, replica_binds
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
 
 class Base(DeclarativeBase):
     pass
 
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={'class_': RoutingSession})
 
-# Create the app
+# Create the app. Importing this module only builds the bare objects that the
+# other modules register themselves on; create_app() configures the app and
+# imports them, so scripts, migrations and tests that only need `db` or the
+# models don't load the routes
 app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", "cricket-community-secret-key-2024")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
-# Configure the database
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///cricket_community.db")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
-
-# Initialize extensions
-db.init_app(app)
 login_manager = LoginManager()
-login_manager.init_app(app)
 login_manager.login_view = 'login'
 login_manager.login_message = 'Please log in to access this page.'
 
+# Per-environment defaults, picked with APP_ENV; LOG_LEVEL can also be set on its own
+ENVIRONMENTS = {
+    'production': {'LOG_LEVEL': 'INFO'},
+    'development': {'LOG_LEVEL': 'DEBUG'},
+    'testing': {'LOG_LEVEL': 'WARNING', 'TESTING': True},
+}
+
+DEFAULT_SECRET_KEY = 'cricket-community-secret-key-2024'
+
+# Modules that register routes, CLI commands, error handlers and database
+# event listeners on `app`; routes imports the rest of the features
+FEATURE_MODULES = ('sqlite_profile', 'models', 'schema', 'routes')
+
+
+class _FeatureCommands(AppGroup):
+    """CLI group that loads the feature modules first, so `flask --app GameConnect.app <command>` finds their commands"""
+
+    def get_command(self, ctx, name):
+        create_app()
+        return super().get_command(ctx, name)
+
+    def list_commands(self, ctx):
+        create_app()
+        return super().list_commands(ctx)
+
+
+app.cli = _FeatureCommands()
+
+
+def _configure(config):
+    env = os.environ.get('APP_ENV', 'production')
+    if env not in ENVIRONMENTS:
+        raise RuntimeError(f"Unknown APP_ENV {env!r}; expected one of {', '.join(ENVIRONMENTS)}")
+    app.config.update(ENVIRONMENTS[env])
+    app.config['APP_ENV'] = env
+    app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', app.config['LOG_LEVEL']).upper()
+    app.secret_key = os.environ.get("SESSION_SECRET", DEFAULT_SECRET_KEY)
+
+    # Configure the database
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///cricket_community.db")
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_recycle": 300,
+        "pool_pre_ping": True,
+    }
+    # Optional read replicas (comma-separated URLs); reads of GET requests are routed there, see db_routing.py
+    app.config["SQLALCHEMY_BINDS"] = replica_binds(os.environ.get("DATABASE_REPLICA_URLS"))
+    # How long a visitor keeps reading from the primary after their own write
+    app.config["DB_REPLICA_STICKY_SECONDS"] = float(os.environ.get("DB_REPLICA_STICKY_SECONDS", 5))
+
+    if config:
+        app.config.update(config)
+
+
+def _configure_logging(level):
+    # Only sets up the root logger if nothing else (e.g. gunicorn) has
+    logging.basicConfig(level=level)
+    logging.getLogger().setLevel(level)
+
+
+def create_app(config=None):
+    """Configure the app from the environment (plus `config`) and register everything on it.
+
+    There is one app per process, so later calls return it unchanged and
+    raise if they pass `config`, which could no longer be applied. Nothing
+    here connects to the database; the schema is managed by
+    `flask migrate-database` (see schema.py).
+    """
+    if 'sqlalchemy' in app.extensions:
+        if config:
+            raise RuntimeError('create_app() was already called; config can only be passed to the first call')
+        return app
+
+    _configure(config)
+    _configure_logging(app.config['LOG_LEVEL'])
+    if app.config['APP_ENV'] == 'production' and app.secret_key == DEFAULT_SECRET_KEY:
+        logger.warning('SESSION_SECRET is not set; sessions are signed with the built-in development key')
+
+    # Initialize extensions (engines are created here, connections on first use)
+    db.init_app(app)
+    login_manager.init_app(app)
+
+    for name in FEATURE_MODULES:
+        importlib.import_module(f'.{name}', __package__)
+    return app
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    from .models import User
-    return User.query.get(int(user_id))
+    # Served from a per-process identity cache; see user_cache.py
+    from .user_cache import load_cached_user
+    return load_cached_user(int(user_id))
+
+
+def _reset_after_fork():
+    # gunicorn --preload forks the workers from a master that has loaded the
+    # app: drop pooled connections inherited from it without closing the
+    # master's sockets. The per-process pools and threads (password hashing,
+    # profile view writer, live match feed) notice the new pid and start
+    # again on first use; stats.py and follow_graph.py reset their own state.
+    if 'sqlalchemy' not in app.extensions:
+        return
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
 
-with app.app_context():
-    # Import models to ensure tables are created
-    from . import models
-    db.create_all()
 
-# Import routes
-from . import routes
\ No newline at end of file
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,353 @@
+import datetime
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from .app import app, db
+from .exports import gzip_chunks
+
+logger = logging.getLogger(__name__)
+
+# Pages copied per backup step; the source is only read-locked for one step at a time
+app.config.setdefault('BACKUP_PAGES_PER_STEP', int(os.environ.get('BACKUP_PAGES_PER_STEP', 256)))
+# Pause between steps so writers can get in
+app.config.setdefault('BACKUP_STEP_SLEEP', float(os.environ.get('BACKUP_STEP_SLEEP', 0.005)))
+# 'backup' (page-stepped backup API) or 'vacuum' (VACUUM INTO, compacted copy)
+app.config.setdefault('BACKUP_METHOD', os.environ.get('BACKUP_METHOD', 'backup'))
+
+BACKUP_DIR = os.path.join(app.root_path, 'backups')
+LAST_BACKUP_FILE = os.path.join(BACKUP_DIR, 'last_backup.txt')
+LAST_BACKUP_INFO_FILE = os.path.join(BACKUP_DIR, 'last_backup.json')
+# Present while a backup started from the web is running, and kept if it failed
+BACKUP_STATUS_FILE = os.path.join(BACKUP_DIR, 'backup_status.json')
+BACKUP_FILE_RE = re.compile(r'^database_backup_\d{8}_\d{6}\.db$')
+
+# Size of the pieces streamed to the client
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Touched after every restore so all worker processes notice it; every
+# request stats it (a microsecond or two)
+RESTORE_MARKER_FILE = os.path.join(BACKUP_DIR, 'restore_generation')
+
+SQLITE_HEADER = b'SQLite format 3\x00'
+# Tables every backup has, from before the first migration; anything newer is
+# added by migrate_database() after the restore
+BASELINE_TABLES = ('user', 'admin', 'coaching_ad', 'live_match', 'store_product', 'follow', 'profile_view')
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+class RestoreError(ValueError):
+    """The uploaded file can't be restored; the message says why"""
+
+
+def database_path():
+    """Filesystem path of the SQLite database the app is bound to, or None for other backends"""
+    url = db.engine.url
+    if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+        return None
+    return url.database
+
+
+def online_backup(dest_path, method=None):
+    """Write a consistent snapshot of the live database to dest_path.
+
+    The backup API copies BACKUP_PAGES_PER_STEP pages at a time and starts
+    over by itself if another connection writes in between, so the result is
+    always a point-in-time copy while writers are only held off for a single
+    step. Returns a dict with the snapshot's size, page count and duration.
+    """
+    source_path = database_path()
+    if source_path is None:
+        raise RuntimeError('Online backups are only supported for SQLite databases')
+
+    method = method or app.config['BACKUP_METHOD']
+    started = time.perf_counter()
+    source = sqlite3.connect(source_path)
+    try:
+        if method == 'vacuum':
+            if os.path.exists(dest_path):
+                os.remove(dest_path)
+            source.execute('VACUUM INTO ?', (dest_path,))
+            pages = None
+        else:
+            target = sqlite3.connect(dest_path)
+            try:
+                source.backup(target, pages=app.config['BACKUP_PAGES_PER_STEP'],
+                              sleep=app.config['BACKUP_STEP_SLEEP'])
+                pages = target.execute('PRAGMA page_count').fetchone()[0]
+            finally:
+                target.close()
+    finally:
+        source.close()
+
+    return {
+        'file': os.path.basename(dest_path),
+        'method': method,
+        'size_bytes': os.path.getsize(dest_path),
+        'pages': pages,
+        'duration_ms': round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def stream_file(path, compress=False):
+    """Yield a file in chunks, gzip-compressing them as they are read if asked to"""
+    def read_chunks():
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+    return gzip_chunks(read_chunks()) if compress else read_chunks()
+
+
+def record_backup(info):
+    """Remember when the last backup was taken and how big and slow it was"""
+    now = datetime.datetime.now()
+    with open(LAST_BACKUP_FILE, 'w') as f:
+        f.write(now.strftime('%Y-%m-%d %H:%M:%S'))
+    with open(LAST_BACKUP_INFO_FILE, 'w') as f:
+        json.dump(dict(info, created_at=now.isoformat(timespec='seconds')), f)
+
+
+def last_backup_info():
+    """Details of the last backup (see record_backup), or None"""
+    try:
+        with open(LAST_BACKUP_INFO_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def create_backup():
+    """Snapshot the database into the backups directory and record it"""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    info = online_backup(os.path.join(BACKUP_DIR, f'database_backup_{timestamp}.db'))
+    record_backup(info)
+    logger.info('Backup %s written: %d bytes in %.1f ms', info['file'], info['size_bytes'], info['duration_ms'])
+    return info
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def backup_status():
+    """State of the last backup started with start_backup(): None once it succeeded,
+    else a dict with 'state' ('running' or 'failed'), 'started_at' and 'error'."""
+    try:
+        with open(BACKUP_STATUS_FILE) as f:
+            status = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if status.get('state') == 'running' and not _pid_alive(status.get('pid', 0)):
+        # The worker that ran it exited (restart, crash) before it finished
+        status = dict(status, state='failed', error='The backup was interrupted.')
+    return status
+
+
+def _write_status(status, exclusive=False):
+    flags = os.O_WRONLY | os.O_CREAT | (os.O_EXCL if exclusive else os.O_TRUNC)
+    with os.fdopen(os.open(BACKUP_STATUS_FILE, flags), 'w') as f:
+        json.dump(status, f)
+
+
+def start_backup():
+    """Take a backup on a background thread, so no request waits for it.
+
+    Returns False if one is already running in any process. The result shows
+    up in last_backup_info() (or backup_status() if it failed).
+    """
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    status = backup_status()
+    if status is not None:
+        if status['state'] == 'running':
+            return False
+        os.remove(BACKUP_STATUS_FILE)
+    status = {'state': 'running', 'pid': os.getpid(),
+              'started_at': datetime.datetime.now().isoformat(timespec='seconds')}
+    try:
+        _write_status(status, exclusive=True)
+    except FileExistsError:
+        # Another worker started one at the same moment
+        return False
+    threading.Thread(target=_run_backup, args=(status,), name='database-backup', daemon=True).start()
+    return True
+
+
+def _run_backup(status):
+    try:
+        with app.app_context():
+            create_backup()
+    except Exception as e:
+        logger.exception('Backup failed')
+        _write_status(dict(status, state='failed', error=str(e)))
+    else:
+        os.remove(BACKUP_STATUS_FILE)
+
+
+def backup_file_path(name):
+    """Path of a finished backup in the backups directory, or None for anything else"""
+    if not BACKUP_FILE_RE.match(name):
+        return None
+    path = os.path.join(BACKUP_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+def save_upload(stream, dest_path):
+    """Copy an uploaded backup to dest_path chunk by chunk, un-gzipping it on the way if needed"""
+    chunk = stream.read(STREAM_CHUNK_SIZE)
+    decompressor = zlib.decompressobj(31) if chunk[:2] == GZIP_MAGIC else None
+    with open(dest_path, 'wb') as f:
+        try:
+            while chunk:
+                f.write(decompressor.decompress(chunk) if decompressor else chunk)
+                chunk = stream.read(STREAM_CHUNK_SIZE)
+            if decompressor:
+                f.write(decompressor.flush())
+        except zlib.error:
+            raise RestoreError('The uploaded file is not a valid gzip archive.')
+    return os.path.getsize(dest_path)
+
+
+def verify_backup(path):
+    """Raise RestoreError unless path is an intact SQLite database with the baseline tables.
+
+    Older backups may lack later tables and columns; migrate_database()
+    brings them up to date once they are restored.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(SQLITE_HEADER)) != SQLITE_HEADER:
+            raise RestoreError('The uploaded file is not a valid SQLite database.')
+
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        problems = [row[0] for row in conn.execute('PRAGMA integrity_check').fetchall()]
+        if problems != ['ok']:
+            raise RestoreError(f"The uploaded database is damaged: {'; '.join(problems[:5])}")
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    except sqlite3.DatabaseError as e:
+        raise RestoreError(f'The uploaded file is not a valid SQLite database ({e}).')
+    finally:
+        conn.close()
+
+    missing = [table for table in BASELINE_TABLES if table not in tables]
+    if missing:
+        raise RestoreError(f"The backup is missing the {', '.join(missing)} "
+                           f"table{'s' if len(missing) > 1 else ''}; it is not a backup of this application.")
+
+
+def restore_from_file(path):
+    """Replace the live database with the verified database at path.
+
+    The backup API copies it into the live file BACKUP_PAGES_PER_STEP pages
+    at a time within one write transaction: readers keep seeing the previous
+    contents until it commits and then see the new ones on their next
+    transaction, while writers wait for the copy, so no pause is taken
+    between steps.
+    """
+    target_path = database_path()
+    if target_path is None:
+        raise RestoreError('Restoring is only supported for SQLite databases.')
+
+    # Give back this process's pooled connections before taking the lock
+    db.session.remove()
+    db.engine.dispose()
+
+    source = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    target = sqlite3.connect(target_path, timeout=30)
+    started = time.perf_counter()
+    try:
+        source.backup(target, pages=app.config['BACKUP_PAGES_PER_STEP'])
+        pages = target.execute('PRAGMA page_count').fetchone()[0]
+    finally:
+        target.close()
+        source.close()
+    logger.info('Restored %d pages in %.1f ms', pages, (time.perf_counter() - started) * 1000)
+
+    mark_database_replaced()
+
+
+def mark_database_replaced():
+    """Tell every process the database was swapped out (restore, reset) so they drop what they cached"""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    with open(RESTORE_MARKER_FILE, 'w') as f:
+        f.write(datetime.datetime.now().isoformat())
+    _restore_state['generation'] = _restore_generation()
+    reset_process_state()
+
+
+def reset_process_state():
+    """Forget everything this process cached from the database that was replaced"""
+    from .user_cache import user_cache
+    from .follow_graph import follow_graph
+    from .storage import invalidate_storage_report
+    from .result_cache import catalog_results
+
+    db.engine.dispose()
+    user_cache.clear()
+    catalog_results.clear()
+    follow_graph.reset()
+    invalidate_storage_report()
+
+
+def _restore_generation():
+    try:
+        return os.stat(RESTORE_MARKER_FILE).st_mtime_ns
+    except OSError:
+        return None
+
+
+_restore_state = {'generation': _restore_generation()}
+
+
+def restore_generation():
+    """Changes whenever any process restores the database (as seen by this process)"""
+    return _restore_state['generation']
+
+
+@app.before_request
+def _pick_up_restores():
+    # Another worker restored the database: drop pooled connections and
+    # caches before this request can read anything from them
+    generation = _restore_generation()
+    if generation != _restore_state['generation']:
+        _restore_state['generation'] = generation
+        logger.info('Database was restored by another process; resetting connections and caches')
+        reset_process_state()
+
+
+@app.cli.command('backup-database')
+def backup_database_command():
+    """Take an online backup into the backups directory"""
+    info = create_backup()
+    print(f"{info['file']}: {info['size_bytes']} bytes in {info['duration_ms']} ms ({info['method']})")
+
+
+@app.cli.command('refresh-replicas')
+def refresh_replicas_command():
+    """Copy the primary into every SQLite read replica (for local testing of replica routing)"""
+    from .db_routing import REPLICA_BIND_PREFIX
+
+    replicas = {key: engine for key, engine in db.engines.items() if key and key.startswith(REPLICA_BIND_PREFIX)}
+    if not replicas:
+        print('No read replicas configured (DATABASE_REPLICA_URLS)')
+        return
+    for key, engine in replicas.items():
+        url = engine.url
+        if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+            print(f'{key}: skipped, only SQLite replicas can be refreshed from here')
+            continue
+        info = online_backup(url.database, method='backup')
+        print(f"{key}: {url.database} refreshed, {info['size_bytes']} bytes in {info['duration_ms']} ms")
@@ -0,0 +1,253 @@
+import csv
+import datetime
+import io
+import logging
+import math
+import os
+import time
+import click
+from sqlalchemy import Boolean, DateTime, Float, Integer, String, insert
+from .app import app, db
+from .models import CoachingAd, LiveMatch, StoreProduct
+from .locations import LOCATED_MODELS, resolve_location
+from .stats import apply_stat_deltas, count_bulk_inserts
+
+logger = logging.getLogger(__name__)
+
+app.config.setdefault('IMPORT_CHUNK_SIZE', int(os.environ.get('IMPORT_CHUNK_SIZE', 5000)))
+
+# Admin sections (as in /admin/<section>) that accept CSV imports
+IMPORT_MODELS = {
+    'coaching': CoachingAd,
+    'matches': LiveMatch,
+    'store': StoreProduct,
+}
+
+# Filled in by the importer, ignored if present in the file (so a table
+# export can be imported again)
+SYSTEM_COLUMNS = {'id', 'state_id', 'city_id', 'area_id', 'created_at', 'created_by'}
+
+# Only the first errors are kept in the report; the rest are just counted
+MAX_REPORTED_ERRORS = 1000
+
+_TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+_FALSE_VALUES = {'0', 'false', 'no', 'n', 'f'}
+
+# Extra per-column rules on top of the column types
+_RANGES = {
+    'price': (0, None),
+    'discount_percentage': (0, 100),
+}
+
+
+def import_columns(section_or_model):
+    """Columns a CSV for the section (or model) may contain"""
+    model = IMPORT_MODELS.get(section_or_model, section_or_model)
+    return [column for column in model.__table__.columns if column.name not in SYSTEM_COLUMNS]
+
+
+app.add_template_global(lambda section: [column.name for column in import_columns(section)],
+                        'import_columns')
+
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.rows = 0
+        self.chunks = 0
+        self.error_count = 0
+        self.errors = []
+        self.seconds = 0.0
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def to_dict(self):
+        return {
+            'rows': self.rows,
+            'inserted': self.inserted,
+            'failed': self.error_count,
+            'chunks': self.chunks,
+            'seconds': round(self.seconds, 2),
+            'errors': self.errors,
+        }
+
+
+def _convert(column, raw):
+    """Turn one CSV cell into a column value; raises ValueError with a readable message"""
+    value = (raw or '').strip()
+    if not value:
+        if column.default is not None and column.default.is_scalar:
+            return column.default.arg
+        if not column.nullable:
+            raise ValueError(f'{column.name} is required')
+        return None
+
+    column_type = column.type
+    if isinstance(column_type, Boolean):
+        lowered = value.lower()
+        if lowered in _TRUE_VALUES:
+            return True
+        if lowered in _FALSE_VALUES:
+            return False
+        raise ValueError(f'{column.name}: expected true/false, got {value!r}')
+    if isinstance(column_type, Integer):
+        try:
+            converted = int(value)
+        except ValueError:
+            raise ValueError(f'{column.name}: expected a whole number, got {value!r}')
+    elif isinstance(column_type, Float):
+        try:
+            converted = float(value)
+        except ValueError:
+            raise ValueError(f'{column.name}: expected a number, got {value!r}')
+        if not math.isfinite(converted):
+            raise ValueError(f'{column.name}: expected a number, got {value!r}')
+    elif isinstance(column_type, DateTime):
+        try:
+            return datetime.datetime.fromisoformat(value)
+        except ValueError:
+            raise ValueError(f'{column.name}: expected a date like 2024-05-01 14:30, got {value!r}')
+    else:
+        if isinstance(column_type, String) and column_type.length and len(value) > column_type.length:
+            raise ValueError(f'{column.name} is longer than {column_type.length} characters')
+        return value
+
+    low, high = _RANGES.get(column.name, (None, None))
+    if (low is not None and converted < low) or (high is not None and converted > high):
+        bounds = f'between {low} and {high}' if high is not None else f'at least {low}'
+        raise ValueError(f'{column.name} must be {bounds}')
+    return converted
+
+
+class CatalogImporter:
+    """Validate and insert CSV rows for one catalog model, chunk by chunk.
+
+    Each chunk is inserted with a single executemany and committed on its
+    own, so a bad row can only roll back its chunk; that chunk is then
+    retried row by row to find the offending rows.
+    """
+
+    def __init__(self, model, admin_id=None, chunk_size=None):
+        self.model = model
+        self.admin_id = admin_id
+        self.chunk_size = chunk_size or app.config['IMPORT_CHUNK_SIZE']
+        self.columns = import_columns(model)
+        self.report = ImportReport()
+        self._locations = {}
+
+    def _check_header(self, fieldnames):
+        if not fieldnames:
+            raise ValueError('The file is empty')
+        known = {column.name for column in self.columns} | SYSTEM_COLUMNS
+        unknown = [name for name in fieldnames if name not in known]
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+        missing = [column.name for column in self.columns if not column.nullable and
+                   column.default is None and column.name not in fieldnames]
+        if missing:
+            raise ValueError(f"Missing required columns: {', '.join(missing)}")
+
+    def _validate(self, row):
+        values = {column.name: _convert(column, row.get(column.name)) for column in self.columns}
+        values['created_by'] = self.admin_id
+        values['created_at'] = datetime.datetime.utcnow()
+        return values
+
+    def _assign_locations(self, rows):
+        # Each distinct (state, city, area) is resolved once per import
+        for values in rows:
+            triple = (values['state'], values['city'], values['area'])
+            if triple not in self._locations:
+                self._locations[triple] = resolve_location(*triple)
+            values['state_id'], values['city_id'], values['area_id'] = self._locations[triple]
+
+    def _insert(self, rows):
+        if self.model in LOCATED_MODELS:
+            self._assign_locations(rows)
+        db.session.execute(insert(self.model), rows)
+        apply_stat_deltas(db.session.connection(), count_bulk_inserts(self.model, rows))
+
+    def _flush_chunk(self, chunk):
+        self.report.chunks += 1
+        rows = [values for _, values in chunk]
+        try:
+            self._insert(rows)
+            db.session.commit()
+            self.report.inserted += len(rows)
+            return
+        except Exception as e:
+            db.session.rollback()
+            # Lookup rows created in the rolled back transaction are gone
+            self._locations.clear()
+            logger.info('Import chunk %d failed (%s); retrying row by row', self.report.chunks, getattr(e, 'orig', e))
+
+        inserted = 0
+        for line, values in chunk:
+            try:
+                with db.session.begin_nested():
+                    self._insert([values])
+                inserted += 1
+            except Exception as e:
+                self._locations.clear()
+                self.report.add_error(line, str(getattr(e, 'orig', e)))
+        db.session.commit()
+        self.report.inserted += inserted
+
+    def run(self, text_stream):
+        """Import every row of a CSV text stream and return the ImportReport"""
+        started = time.perf_counter()
+        reader = csv.DictReader(text_stream)
+        self._check_header(reader.fieldnames)
+
+        chunk = []
+        for row in reader:
+            self.report.rows += 1
+            if None in row:
+                self.report.add_error(reader.line_num, 'Too many values in this row')
+                continue
+            try:
+                chunk.append((reader.line_num, self._validate(row)))
+            except ValueError as e:
+                self.report.add_error(reader.line_num, str(e))
+                continue
+            if len(chunk) >= self.chunk_size:
+                self._flush_chunk(chunk)
+                chunk = []
+        if chunk:
+            self._flush_chunk(chunk)
+
+        self.report.seconds = time.perf_counter() - started
+        logger.info('Imported %d of %d %s rows in %.2fs', self.report.inserted, self.report.rows,
+                    self.model.__table__.name, self.report.seconds)
+        return self.report
+
+
+def import_csv(model, binary_stream, admin_id=None, chunk_size=None):
+    """Import an uploaded (binary) CSV stream without reading it into memory"""
+    text_stream = io.TextIOWrapper(binary_stream, encoding='utf-8-sig', newline='')
+    try:
+        return CatalogImporter(model, admin_id, chunk_size).run(text_stream)
+    finally:
+        # Don't let the wrapper close the underlying upload
+        text_stream.detach()
+
+
+@app.cli.command('import-catalog')
+@click.argument('section', type=click.Choice(sorted(IMPORT_MODELS)))
+@click.argument('csv_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--admin-id', type=int, default=None, help='Admin recorded as the creator of the rows')
+@click.option('--chunk-size', type=int, default=None, help='Rows per insert batch and transaction')
+def import_catalog_command(section, csv_file, admin_id, chunk_size):
+    """Bulk import coaching ads, live matches or store products from a CSV file"""
+    with open(csv_file, 'rb') as f:
+        try:
+            report = import_csv(IMPORT_MODELS[section], f, admin_id, chunk_size)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    print(f'Inserted {report.inserted} of {report.rows} rows in {report.seconds:.2f}s '
+          f'({report.chunks} chunks, {report.error_count} errors)')
+    for error in report.errors:
+        print(f"  line {error['line']}: {error['error']}")
@@ -0,0 +1,90 @@
+import random
+import time
+from flask import current_app, g, has_request_context, request, session as client_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql.elements import TextClause
+
+# Engines of read replicas are registered as SQLALCHEMY_BINDS with this prefix
+REPLICA_BIND_PREFIX = 'replica_'
+
+# Until this time (stored in the visitor's session cookie) reads stay on the primary
+STICKY_KEY = '_db_primary_until'
+
+_READ_METHODS = ('GET', 'HEAD')
+
+
+def replica_binds(urls):
+    """SQLALCHEMY_BINDS entries for a comma-separated list of replica URLs"""
+    urls = [url.strip() for url in (urls or '').split(',') if url.strip()]
+    return {f'{REPLICA_BIND_PREFIX}{number}': url for number, url in enumerate(urls, 1)}
+
+
+def use_primary(view):
+    """Mark a GET view that reads and then writes, so all of its queries go to the primary"""
+    view.use_primary = True
+    return view
+
+
+def _is_write(clause):
+    if clause is None:
+        return False
+    if getattr(clause, 'is_dml', False) or getattr(clause, '_for_update_arg', None) is not None:
+        return True
+    if isinstance(clause, TextClause):
+        return not clause.text.lstrip().lower().startswith(('select', 'with'))
+    return False
+
+
+class RoutingSession(Session):
+    """Session that sends the reads of read-only requests to a replica.
+
+    A request is read-only when it is a GET/HEAD, its view isn't marked with
+    use_primary, and the visitor hasn't written anything in the last
+    DB_REPLICA_STICKY_SECONDS (so they always read their own writes). One
+    replica is picked per request. Flushes, INSERT/UPDATE/DELETE, SELECT ...
+    FOR UPDATE and non-SELECT text always go to the primary, and any write
+    moves the rest of the request to the primary as well. Outside requests
+    (CLI, background threads) everything uses the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            replica = self._replica_for(clause)
+            if replica is not None:
+                return self._db.engines[replica]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _replica_for(self, clause):
+        if not has_request_context():
+            return None
+        if self._flushing or _is_write(clause):
+            _note_write(self._db.engines)
+            return None
+        if '_db_replica' not in g:
+            g._db_replica = _choose_replica(self._db.engines)
+        return g._db_replica
+
+
+def _replica_keys(engines):
+    return [key for key in engines if key and key.startswith(REPLICA_BIND_PREFIX)]
+
+
+def _choose_replica(engines):
+    replicas = _replica_keys(engines)
+    if not replicas or request.method not in _READ_METHODS:
+        return None
+    view = current_app.view_functions.get(request.endpoint)
+    if getattr(view, 'use_primary', False):
+        return None
+    if client_session.get(STICKY_KEY, 0) > time.time():
+        return None
+    return random.choice(replicas)
+
+
+def _note_write(engines):
+    # The rest of this request and the visitor's next few requests read from the primary
+    g._db_replica = None
+    sticky_seconds = current_app.config['DB_REPLICA_STICKY_SECONDS']
+    if sticky_seconds and not g.get('_db_wrote') and _replica_keys(engines):
+        client_session[STICKY_KEY] = time.time() + sticky_seconds
+    g._db_wrote = True
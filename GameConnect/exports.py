@@ -0,0 +1,84 @@
+import csv
+import datetime
+import io
+import json
+import os
+import zlib
+from sqlalchemy import select
+from .app import app, db
+
+# Rows fetched from the database per round trip while exporting
+app.config.setdefault('EXPORT_BATCH_SIZE', int(os.environ.get('EXPORT_BATCH_SIZE', 2000)))
+
+# Buffered output is flushed to the client once it reaches this many characters
+_FLUSH_SIZE = 64 * 1024
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+
+def iter_rows(model):
+    """Stream a table's rows as plain tuples, BATCH_SIZE at a time.
+
+    Only columns are selected (no ORM instances) and ``yield_per`` switches
+    to a server-side cursor where the driver has one, so memory stays flat
+    however large the table is.
+    """
+    columns = list(model.__table__.columns)
+    result = db.session.execute(
+        select(*columns).order_by(*model.__table__.primary_key.columns)
+        .execution_options(yield_per=app.config['EXPORT_BATCH_SIZE'])
+    )
+    return [column.name for column in columns], result
+
+
+def csv_chunks(model):
+    names, rows = iter_rows(model)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= _FLUSH_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def _json_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+
+def ndjson_chunks(model):
+    names, rows = iter_rows(model)
+    lines, size = [], 0
+    for row in rows:
+        line = json.dumps(dict(zip(names, row)), default=_json_value)
+        lines.append(line)
+        size += len(line) + 1
+        if size >= _FLUSH_SIZE:
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+            lines, size = [], 0
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def gzip_chunks(chunks):
+    """Gzip-compress a stream of byte chunks on the fly"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_chunks(model, export_format='csv', compress=False):
+    """Byte chunks of a full table export in the given format"""
+    chunks = ndjson_chunks(model) if export_format == 'ndjson' else csv_chunks(model)
+    return gzip_chunks(chunks) if compress else chunks
@@ -0,0 +1,343 @@
+import logging
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from sqlalchemy import func, select
+from .app import app, db
+from .models import User, Follow
+
+logger = logging.getLogger(__name__)
+
+app.config.setdefault('FOLLOW_GRAPH_MAX_EDGES', int(os.environ.get('FOLLOW_GRAPH_MAX_EDGES', 5000000)))
+app.config.setdefault('FOLLOW_GRAPH_TTL', int(os.environ.get('FOLLOW_GRAPH_TTL', 900)))
+app.config.setdefault('FOLLOW_GRAPH_REFRESH_INTERVAL', int(os.environ.get('FOLLOW_GRAPH_REFRESH_INTERVAL', 30)))
+
+# Rows fetched per round trip while streaming users and follows
+_STREAM_BATCH = 10000
+
+# Neighbours examined per hop, so hub accounts can't make a query slow
+_FANOUT_LIMIT = 500
+
+
+class FollowGraph:
+    """Compressed sparse row (CSR) snapshot of the Follow table.
+
+    Users are mapped to dense indexes through the sorted ``node_ids`` array;
+    ``out_targets[out_offsets[i]:out_offsets[i + 1]]`` are the users node i
+    follows and the ``in_*`` arrays are the same for followers. Everything is
+    stored in typed arrays (4 bytes per entry), so a million edges cost about
+    8 MB. Follows added or removed after the build live in a small overlay
+    until the next rebuild.
+    """
+
+    def __init__(self, node_ids, node_areas, node_active, out_offsets, out_targets,
+                 in_offsets, in_sources, max_follow_id, build_seconds):
+        self.node_ids = node_ids
+        self.node_areas = node_areas
+        self.node_active = node_active
+        self.out_offsets = out_offsets
+        self.out_targets = out_targets
+        self.in_offsets = in_offsets
+        self.in_sources = in_sources
+        self.max_follow_id = max_follow_id
+        self.build_seconds = build_seconds
+        self.built_at = time.time()
+
+        self._area_members = defaultdict(lambda: array('i'))
+        for index, area_id in enumerate(node_areas):
+            if area_id:
+                self._area_members[area_id].append(index)
+
+        self._added_out = defaultdict(set)
+        self._added_in = defaultdict(set)
+        self._removed = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, max_edges):
+        """Stream users and follows from the database into a new graph, or None if over budget"""
+        started = time.perf_counter()
+
+        edge_count = db.session.query(func.count(Follow.id)).scalar() or 0
+        if edge_count > max_edges:
+            logger.warning('Follow graph not built: %d edges exceeds FOLLOW_GRAPH_MAX_EDGES=%d',
+                           edge_count, max_edges)
+            return None
+
+        node_ids, node_areas, node_active = array('i'), array('i'), bytearray()
+        users = db.session.execute(
+            select(User.id, User.area_id, User.is_active).order_by(User.id)
+            .execution_options(yield_per=_STREAM_BATCH)
+        )
+        for user_id, area_id, is_active in users:
+            node_ids.append(user_id)
+            node_areas.append(area_id or 0)
+            node_active.append(1 if is_active is not False else 0)
+
+        node_count = len(node_ids)
+        # Temporary id -> index map; much faster than a bisect per edge and
+        # released as soon as the build finishes
+        index_of = {user_id: index for index, user_id in enumerate(node_ids)}
+        out_offsets = array('i', [0]) * (node_count + 1)
+        out_targets = array('i')
+        max_follow_id = 0
+
+        # One pass over follow ordered by the unique (follower_id, followed_id)
+        # index: edges arrive grouped by source, which is exactly CSR order
+        edges = db.session.execute(
+            select(Follow.id, Follow.follower_id, Follow.followed_id)
+            .order_by(Follow.follower_id, Follow.followed_id)
+            .execution_options(yield_per=_STREAM_BATCH)
+        )
+        last_follower, source = None, None
+        for follow_id, follower_id, followed_id in edges:
+            max_follow_id = max(max_follow_id, follow_id)
+            if follower_id != last_follower:
+                last_follower, source = follower_id, index_of.get(follower_id)
+            target = index_of.get(followed_id)
+            if source is None or target is None:
+                continue
+            out_targets.append(target)
+            out_offsets[source + 1] += 1
+
+        for index in range(node_count):
+            out_offsets[index + 1] += out_offsets[index]
+
+        # Reverse adjacency by counting sort over the forward edges
+        in_offsets = array('i', [0]) * (node_count + 1)
+        for target in out_targets:
+            in_offsets[target + 1] += 1
+        for index in range(node_count):
+            in_offsets[index + 1] += in_offsets[index]
+        in_sources = array('i', [0]) * len(out_targets)
+        cursor = array('i', in_offsets)
+        for source in range(node_count):
+            for target in out_targets[out_offsets[source]:out_offsets[source + 1]]:
+                in_sources[cursor[target]] = source
+                cursor[target] += 1
+        del index_of
+
+        return cls(node_ids, node_areas, node_active, out_offsets, out_targets,
+                   in_offsets, in_sources, max_follow_id, time.perf_counter() - started)
+
+    # -- incremental updates -------------------------------------------------
+
+    def add_edge(self, follower_id, followed_id):
+        source, target = _find(self.node_ids, follower_id), _find(self.node_ids, followed_id)
+        if source is None or target is None:
+            return
+        with self._lock:
+            self._removed.discard((source, target))
+            self._added_out[source].add(target)
+            self._added_in[target].add(source)
+
+    def remove_edge(self, follower_id, followed_id):
+        source, target = _find(self.node_ids, follower_id), _find(self.node_ids, followed_id)
+        if source is None or target is None:
+            return
+        with self._lock:
+            self._added_out[source].discard(target)
+            self._added_in[target].discard(source)
+            self._removed.add((source, target))
+
+    @property
+    def overlay_size(self):
+        return sum(len(targets) for targets in self._added_out.values()) + len(self._removed)
+
+    # -- adjacency -------------------------------------------------------------
+
+    def _following(self, index):
+        targets = set(self.out_targets[self.out_offsets[index]:self.out_offsets[index + 1]])
+        targets |= self._added_out.get(index, set())
+        return {target for target in targets if (index, target) not in self._removed}
+
+    def _followers(self, index):
+        sources = set(self.in_sources[self.in_offsets[index]:self.in_offsets[index + 1]])
+        sources |= self._added_in.get(index, set())
+        return {source for source in sources if (source, index) not in self._removed}
+
+    # -- queries ---------------------------------------------------------------
+
+    def mutual_follows(self, user_id):
+        """Ids of users who follow user_id and are followed back"""
+        index = _find(self.node_ids, user_id)
+        if index is None:
+            return []
+        return [self.node_ids[other] for other in self._following(index) & self._followers(index)]
+
+    def recommendations(self, user_id, limit=10):
+        """Rank users that user_id does not follow yet.
+
+        Scores: +1 per followed user who follows the candidate (friends of
+        friends), +2 if the candidate already follows user_id, +0.5 for
+        sharing the same area. Returns dicts sorted by score.
+        """
+        index = _find(self.node_ids, user_id)
+        if index is None:
+            return []
+
+        following = self._following(index)
+        scores = defaultdict(float)
+        mutual_counts = defaultdict(int)
+        reasons = defaultdict(set)
+
+        for friend in list(following)[:_FANOUT_LIMIT]:
+            for candidate in list(self._following(friend))[:_FANOUT_LIMIT]:
+                scores[candidate] += 1
+                mutual_counts[candidate] += 1
+                reasons[candidate].add('followed_by_friends')
+
+        for follower in list(self._followers(index))[:_FANOUT_LIMIT]:
+            scores[follower] += 2
+            reasons[follower].add('follows_you')
+
+        area_id = self.node_areas[index]
+        if area_id:
+            for neighbour in self._area_members.get(area_id, ())[:_FANOUT_LIMIT]:
+                scores[neighbour] += 0.5
+                reasons[neighbour].add('same_area')
+
+        candidates = [
+            candidate for candidate in scores
+            if candidate != index and candidate not in following and self.node_active[candidate]
+        ]
+        candidates.sort(key=lambda candidate: (-scores[candidate], self.node_ids[candidate]))
+
+        return [{
+            'user_id': self.node_ids[candidate],
+            'score': scores[candidate],
+            'mutual_connections': mutual_counts[candidate],
+            'reasons': sorted(reasons[candidate]),
+        } for candidate in candidates[:limit]]
+
+    def stats(self):
+        arrays = (self.node_ids, self.node_areas, self.out_offsets, self.out_targets,
+                  self.in_offsets, self.in_sources)
+        size = sum(len(values) * values.itemsize for values in arrays) + len(self.node_active)
+        return {
+            'nodes': len(self.node_ids),
+            'edges': len(self.out_targets),
+            'overlay_edges': self.overlay_size,
+            'size_bytes': size,
+            'build_ms': round(self.build_seconds * 1000, 1),
+            'age_seconds': round(time.time() - self.built_at, 1),
+        }
+
+
+def _find(sorted_ids, user_id):
+    """Dense index of user_id in a sorted id array, or None"""
+    position = bisect_left(sorted_ids, user_id)
+    if position < len(sorted_ids) and sorted_ids[position] == user_id:
+        return position
+    return None
+
+
+class FollowGraphService:
+    """Owns the process-wide graph: lazy first build, incremental refresh and background rebuilds"""
+
+    def __init__(self):
+        self._graph = None
+        self._lock = threading.Lock()
+        self._rebuilding = False
+        self._last_refresh = 0.0
+        self._over_budget_at = None
+
+    def _after_fork(self):
+        # A rebuild thread running in the parent doesn't exist in a forked
+        # worker; the graph itself is inherited and keeps being refreshed
+        self._rebuilding = False
+        self._lock = threading.Lock()
+
+    def get(self, wait=False):
+        """Return a reasonably fresh graph.
+
+        Returns None while the first build is still running in the background
+        (unless ``wait`` is set) or if the follow table exceeds the budget.
+        """
+        if self._graph is None:
+            # Don't re-count an over-budget follow table on every request
+            if self._over_budget_at and time.time() - self._over_budget_at < app.config['FOLLOW_GRAPH_TTL']:
+                return None
+            if wait:
+                with self._lock:
+                    if self._graph is None:
+                        self._install(FollowGraph.build(app.config['FOLLOW_GRAPH_MAX_EDGES']))
+            else:
+                self._rebuild_in_background()
+            return self._graph
+
+        now = time.time()
+        if now - self._graph.built_at > app.config['FOLLOW_GRAPH_TTL']:
+            self._rebuild_in_background()
+        elif now - self._last_refresh > app.config['FOLLOW_GRAPH_REFRESH_INTERVAL']:
+            self._refresh()
+        return self._graph
+
+    def _install(self, graph):
+        self._graph = graph
+        self._last_refresh = time.time()
+        self._over_budget_at = None if graph else self._last_refresh
+
+    def reset(self):
+        """Throw the graph away (e.g. after a restore); the next get() rebuilds it"""
+        self._graph = None
+        self._over_budget_at = None
+
+    def note_follow(self, follower_id, followed_id):
+        if self._graph is not None:
+            self._graph.add_edge(follower_id, followed_id)
+
+    def note_unfollow(self, follower_id, followed_id):
+        if self._graph is not None:
+            self._graph.remove_edge(follower_id, followed_id)
+
+    def _refresh(self):
+        # Pick up follows written by other workers since the last look
+        # (primary-key range scan); removals wait for the next rebuild
+        graph = self._graph
+        self._last_refresh = time.time()
+        new_edges = db.session.execute(
+            select(Follow.id, Follow.follower_id, Follow.followed_id)
+            .where(Follow.id > graph.max_follow_id)
+            .order_by(Follow.id)
+        ).all()
+        for follow_id, follower_id, followed_id in new_edges:
+            graph.add_edge(follower_id, followed_id)
+            graph.max_follow_id = follow_id
+
+    def _rebuild_in_background(self):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+
+        def rebuild():
+            try:
+                with app.app_context():
+                    graph = FollowGraph.build(app.config['FOLLOW_GRAPH_MAX_EDGES'])
+                    db.session.remove()
+                self._install(graph)
+            except Exception:
+                logger.exception('Follow graph rebuild failed')
+            finally:
+                self._rebuilding = False
+
+        threading.Thread(target=rebuild, name='follow-graph-rebuild', daemon=True).start()
+
+
+follow_graph = FollowGraphService()
+os.register_at_fork(after_in_child=follow_graph._after_fork)
+
+
+@app.cli.command('follow-graph-stats')
+def follow_graph_stats_command():
+    """Build the follow graph once and report its size and build time"""
+    graph = FollowGraph.build(app.config['FOLLOW_GRAPH_MAX_EDGES'])
+    if graph is None:
+        print('Follow graph exceeds FOLLOW_GRAPH_MAX_EDGES; not built')
+        return
+    for key, value in graph.stats().items():
+        print(f'{key}: {value}')
@@ -0,0 +1,46 @@
+from sqlalchemy import func, update
+from .app import app, db
+from .models import User, Follow
+
+
+def reset_follow_counts():
+    """Zero every counter, e.g. after the follow table has been emptied. Does not commit."""
+    db.session.execute(update(User).values(followers_count=0, following_count=0))
+
+
+def reconcile_follow_counts():
+    """Recompute User.followers_count/following_count from the Follow table.
+
+    One GROUP BY per direction, then a single bulk UPDATE of only the users
+    whose cached values drifted. Returns the number of users corrected.
+    """
+    followers = dict(
+        db.session.query(Follow.followed_id, func.count()).group_by(Follow.followed_id)
+    )
+    following = dict(
+        db.session.query(Follow.follower_id, func.count()).group_by(Follow.follower_id)
+    )
+
+    corrections = []
+    rows = db.session.query(User.id, User.followers_count, User.following_count).yield_per(5000)
+    for user_id, followers_count, following_count in rows:
+        expected_followers = followers.get(user_id, 0)
+        expected_following = following.get(user_id, 0)
+        if (followers_count, following_count) != (expected_followers, expected_following):
+            corrections.append({
+                'id': user_id,
+                'followers_count': expected_followers,
+                'following_count': expected_following,
+            })
+
+    if corrections:
+        db.session.execute(update(User), corrections)
+    db.session.commit()
+    return len(corrections)
+
+
+@app.cli.command('reconcile-follow-counts')
+def reconcile_follow_counts_command():
+    """Recompute the cached follower/following counts on every user"""
+    corrected = reconcile_follow_counts()
+    print(f'Corrected follow counts for {corrected} users')
@@ -0,0 +1,234 @@
+import logging
+import re
+from sqlalchemy import inspect, or_
+from .app import app, db
+from .models import User, CoachingAd, LiveMatch, StoreProduct
+
+logger = logging.getLogger(__name__)
+
+# Columns that make up the searchable document for each model
+FULLTEXT_COLUMNS = {
+    CoachingAd: ('title', 'description', 'location', 'state', 'city', 'area'),
+    StoreProduct: ('name', 'description', 'category'),
+    LiveMatch: ('title', 'description', 'teams', 'location'),
+}
+
+# Columns the owner's user browser matches as arbitrary substrings
+SUBSTRING_COLUMNS = {
+    User: ('name', 'username', 'email', 'city', 'state'),
+}
+
+# Trigram indexes can only answer substrings of at least three characters
+MIN_SUBSTRING_LENGTH = 3
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Per-process cache of which index tables are usable
+_installed = {}
+
+
+def _table(model):
+    return model.__table__.name
+
+
+def _fts_table(model):
+    return f'{_table(model)}_fts'
+
+
+def _trigram_table(model):
+    return f'{_table(model)}_trigram'
+
+
+def _tokens(text):
+    return [token.lower() for token in _TOKEN_RE.findall(text or '')]
+
+
+def _sqlite_ddl(table, fts, columns, tokenize):
+    column_list = ', '.join(columns)
+    new_values = ', '.join(f'new.{column}' for column in columns)
+    old_values = ', '.join(f'old.{column}' for column in columns)
+    # External-content FTS5 table: the index stores only tokens and the
+    # triggers keep it in step with every insert, delete and update of an
+    # indexed column (counter bumps and the like leave the index alone).
+    # The update trigger is recreated so older, all-column ones are replaced
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{column_list}, content='{table}', content_rowid='id', "
+        f"tokenize='{tokenize}')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {column_list}) VALUES (new.id, {new_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values}); END",
+        f"DROP TRIGGER IF EXISTS {fts}_au",
+        f"CREATE TRIGGER {fts}_au AFTER UPDATE OF {column_list} ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values}); "
+        f"INSERT INTO {fts}(rowid, {column_list}) VALUES (new.id, {new_values}); END",
+    ]
+
+
+def _sqlite_fulltext_ddl(model):
+    return _sqlite_ddl(_table(model), _fts_table(model), FULLTEXT_COLUMNS[model],
+                       'unicode61 remove_diacritics 2')
+
+
+def _sqlite_substring_ddl(model):
+    return _sqlite_ddl(_table(model), _trigram_table(model), SUBSTRING_COLUMNS[model], 'trigram')
+
+
+def _postgresql_substring_ddl(model):
+    # pg_trgm GIN indexes let PostgreSQL answer ILIKE '%term%' from the index,
+    # so the query itself does not change
+    table = _table(model)
+    return ['CREATE EXTENSION IF NOT EXISTS pg_trgm'] + [
+        f'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_{table}_{column}_trgm ON "{table}" USING GIN ({column} gin_trgm_ops)'
+        for column in SUBSTRING_COLUMNS[model]
+    ]
+
+
+def _postgresql_fulltext_ddl(model):
+    table = _table(model)
+    document = " || ' ' || ".join(f"coalesce({column}, '')" for column in FULLTEXT_COLUMNS[model])
+    # A generated tsvector column is maintained by PostgreSQL itself, so
+    # there is nothing to keep in sync from the application
+    return [
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        f"GENERATED ALWAYS AS (to_tsvector('simple', {document})) STORED",
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_{table}_search_vector ON {table} USING GIN (search_vector)",
+    ]
+
+
+def _index_specs():
+    """(index table name, SQLite DDL, PostgreSQL DDL, PostgreSQL reindex statements)"""
+    for model in FULLTEXT_COLUMNS:
+        table = _table(model)
+        yield (_fts_table(model), _sqlite_fulltext_ddl(model), _postgresql_fulltext_ddl(model),
+               [f'REINDEX INDEX CONCURRENTLY ix_{table}_search_vector'])
+    for model in SUBSTRING_COLUMNS:
+        table = _table(model)
+        yield (_trigram_table(model), _sqlite_substring_ddl(model), _postgresql_substring_ddl(model),
+               [f'REINDEX INDEX CONCURRENTLY ix_{table}_{column}_trgm' for column in SUBSTRING_COLUMNS[model]])
+
+
+def install_fulltext_indexes(rebuild=False, strict=False):
+    """Create the full-text and substring indexes and their sync machinery.
+
+    Failures are logged and searches fall back to ILIKE, unless strict is
+    set (migrations), in which case they are raised.
+    """
+    dialect = db.engine.dialect.name
+    _installed.clear()
+    if dialect not in ('sqlite', 'postgresql'):
+        return
+
+    inspector = inspect(db.engine)
+    for name, sqlite_ddl, postgresql_ddl, reindex in _index_specs():
+        try:
+            if dialect == 'sqlite':
+                with db.engine.begin() as conn:
+                    # A freshly created FTS table starts empty even if the
+                    # content table already has rows, so populate it now
+                    created = not inspector.has_table(name)
+                    for statement in sqlite_ddl:
+                        conn.execute(db.text(statement))
+                    if rebuild or created:
+                        conn.execute(db.text(f"INSERT INTO {name}({name}) VALUES ('rebuild')"))
+            else:
+                # CONCURRENTLY keeps the tables writable while the GIN
+                # indexes build, and can't run inside a transaction
+                with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                    for statement in postgresql_ddl:
+                        conn.execute(db.text(statement))
+                    if rebuild:
+                        for statement in reindex:
+                            conn.execute(db.text(statement))
+        except Exception as e:
+            if strict:
+                raise
+            # e.g. SQLite built without FTS5: searches fall back to ILIKE
+            logger.warning('Search index %s unavailable: %s', name, e)
+
+
+def drop_fulltext_indexes(cursor):
+    """Drop the SQLite FTS tables and triggers using a raw DB-API cursor"""
+    for name, _, _, _ in _index_specs():
+        for suffix in ('ai', 'ad', 'au'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}_{suffix}')
+        cursor.execute(f'DROP TABLE IF EXISTS {name}')
+    _installed.clear()
+
+
+def _is_installed(name, model):
+    if name not in _installed:
+        dialect = db.engine.dialect.name
+        inspector = inspect(db.engine)
+        if dialect == 'sqlite':
+            _installed[name] = inspector.has_table(name)
+        elif dialect == 'postgresql':
+            columns = {column['name'] for column in inspector.get_columns(_table(model))}
+            _installed[name] = 'search_vector' in columns
+        else:
+            _installed[name] = False
+    return _installed[name]
+
+
+def search_ranked(query, model, text):
+    """Restrict query to rows of model matching every word of text.
+
+    Returns ``(query, rank)`` where ``rank`` is a relevance expression
+    (higher is better) suitable as the leading keyset pagination column, or
+    None when there is no index to rank with.
+    Each word is matched as a prefix, so "ahmed bat" finds "Ahmedabad bats".
+    """
+    tokens = _tokens(text)
+    if not tokens:
+        return query, None
+
+    if not _is_installed(_fts_table(model), model):
+        # No index available: the old substring match, one word at a time
+        for token in tokens:
+            query = query.filter(or_(*(
+                getattr(model, column).ilike(f'%{token}%') for column in FULLTEXT_COLUMNS[model]
+            )))
+        return query, None
+
+    if db.engine.dialect.name == 'sqlite':
+        fts = _fts_table(model)
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        matches = db.text(
+            f"SELECT rowid AS id, -bm25({fts}) AS rank FROM {fts} WHERE {fts} MATCH :match"
+        ).bindparams(match=match)
+    else:
+        tsquery = ' & '.join(f'{token}:*' for token in tokens)
+        matches = db.text(
+            f"SELECT id, ts_rank_cd(search_vector, q) AS rank "
+            f"FROM {_table(model)}, to_tsquery('simple', :tsquery) AS q "
+            f"WHERE search_vector @@ q"
+        ).bindparams(tsquery=tsquery)
+
+    matches = matches.columns(id=db.Integer, rank=db.Float).subquery()
+    return query.join(matches, matches.c.id == model.id), matches.c.rank
+
+
+def substring_filter(model, text):
+    """Filter matching text as a case-insensitive substring of any SUBSTRING_COLUMNS column.
+
+    On SQLite terms of MIN_SUBSTRING_LENGTH or more are answered by the FTS5
+    trigram table; PostgreSQL answers the ILIKE form from its pg_trgm indexes.
+    """
+    ilike = or_(*(getattr(model, column).ilike(f'%{text}%') for column in SUBSTRING_COLUMNS[model]))
+
+    name = _trigram_table(model)
+    if (db.engine.dialect.name != 'sqlite' or len(text) < MIN_SUBSTRING_LENGTH
+            or not _is_installed(name, model)):
+        return ilike
+
+    phrase = '"' + text.replace('"', '""') + '"'
+    matches = db.text(f"SELECT rowid FROM {name} WHERE {name} MATCH :phrase").bindparams(phrase=phrase)
+    return model.id.in_(matches)
+
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Create (if needed) and rebuild the full-text and user substring search indexes"""
+    install_fulltext_indexes(rebuild=True, strict=True)
+    print('Full-text search indexes rebuilt')
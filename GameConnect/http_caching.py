@@ -0,0 +1,117 @@
+import datetime
+import functools
+import hashlib
+import os
+import threading
+from flask import g, make_response, request, session
+from flask_login import current_user
+from sqlalchemy import select
+from werkzeug.http import is_resource_modified
+from .app import app, db
+from .backup import restore_generation
+from .models import PlatformStat
+from .stats import generation_key
+
+# How long browsers and proxies may reuse an anonymous catalog page without asking again
+app.config.setdefault('CATALOG_CACHE_MAX_AGE', int(os.environ.get('CATALOG_CACHE_MAX_AGE', 30)))
+
+# Remembered Last-Modified times; older tokens are forgotten past this many
+MAX_REMEMBERED_VERSIONS = 1024
+
+
+def _template_version():
+    # Changes when a template is edited, so a deploy doesn't serve stale 304s
+    newest = 0
+    for root, _, files in os.walk(os.path.join(app.root_path, app.template_folder)):
+        for name in files:
+            newest = max(newest, os.stat(os.path.join(root, name)).st_mtime_ns)
+    return str(newest)
+
+
+_TEMPLATE_VERSION = _template_version()
+
+
+def catalog_watermark(models):
+    """Cheap token that changes whenever a row of one of the models is added, edited or removed.
+
+    Made of the restore generation and the models' write generations, which
+    the ORM events in stats.py bump in the same transaction as the change;
+    one primary key lookup per request, whatever the number of models.
+    """
+    keys = [generation_key(model) for model in models]
+    # Computed once per request; the page and its result cache share it
+    memo = g.setdefault('_catalog_watermarks', {})
+    key = tuple(keys)
+    if key in memo:
+        return memo[key]
+    generations = dict(db.session.execute(
+        select(PlatformStat.key, PlatformStat.value).where(PlatformStat.key.in_(keys))
+    ).all())
+    parts = [str(restore_generation())] + [f'{key}:{generations.get(key, 0)}' for key in keys]
+    memo[key] = '|'.join(parts)
+    return memo[key]
+
+
+class _FirstSeen:
+    """Last-Modified for a watermark: when this process first saw it.
+
+    That is never earlier than the change it reflects, so If-Modified-Since
+    can't produce a 304 for content the client hasn't seen; ETags are still
+    preferred since they are exact.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._times = {}
+
+    def get(self, token):
+        with self._lock:
+            if token not in self._times:
+                if len(self._times) >= MAX_REMEMBERED_VERSIONS:
+                    self._times.clear()
+                now = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+                self._times[token] = now
+            return self._times[token]
+
+
+_first_seen = _FirstSeen()
+
+
+def conditional_catalog(*models):
+    """Add ETag/Last-Modified/Cache-Control to a public catalog page and answer revalidations with 304.
+
+    The ETag covers the catalog watermark of the models, the templates and
+    who is looking (the navigation differs per visitor), so a 304 is sent
+    before the view, the ORM or the templates are touched.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped(*args, **kwargs):
+            # Pending flash messages are shown once, so that page can't be reused
+            if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+                return view(*args, **kwargs)
+
+            watermark = catalog_watermark(models)
+            identity = current_user.get_id() if current_user.is_authenticated else 'anonymous'
+            etag = hashlib.sha1(f'{_TEMPLATE_VERSION}|{identity}|{watermark}'.encode()).hexdigest()
+            last_modified = _first_seen.get(watermark)
+
+            if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                response = app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.vary.add('Cookie')
+            if identity == 'anonymous':
+                response.cache_control.public = True
+                response.cache_control.max_age = app.config['CATALOG_CACHE_MAX_AGE']
+            else:
+                response.cache_control.private = True
+                response.cache_control.no_cache = True
+            return response
+        return wrapped
+    return decorator
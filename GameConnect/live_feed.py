@@ -0,0 +1,350 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from flask import render_template
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from .app import app, db
+from .models import LiveMatch
+from .locations import normalize_location
+from .http_caching import catalog_watermark
+
+logger = logging.getLogger(__name__)
+
+# How often the broadcaster checks the live_match watermark for changes made
+# by other workers, imports and restores (seconds); this process's own
+# commits are picked up immediately
+app.config.setdefault('LIVE_FEED_POLL_INTERVAL', float(os.environ.get('LIVE_FEED_POLL_INTERVAL', 1.0)))
+# Events kept for clients that reconnect with Last-Event-ID
+app.config.setdefault('LIVE_FEED_BACKLOG', int(os.environ.get('LIVE_FEED_BACKLOG', 512)))
+# Open streams allowed per process; more get 503 and retry later
+app.config.setdefault('LIVE_FEED_MAX_CLIENTS', int(os.environ.get('LIVE_FEED_MAX_CLIENTS', 5000)))
+# Comment line sent on idle streams so proxies keep them open and dead
+# clients are noticed (seconds)
+app.config.setdefault('LIVE_FEED_HEARTBEAT', float(os.environ.get('LIVE_FEED_HEARTBEAT', 20.0)))
+# Streams are closed after this long and the browser reconnects (seconds)
+app.config.setdefault('LIVE_FEED_STREAM_SECONDS', float(os.environ.get('LIVE_FEED_STREAM_SECONDS', 600)))
+# "auto" keeps streams open only under gevent (the live feed service, see
+# gunicorn.conf.py), where an idle stream is a greenlet rather than a worker
+# thread; "on" always does, "off" never does. When off (the sync web workers,
+# `flask run`), each request sends what changed since Last-Event-ID and
+# closes, and the browser asks again after LIVE_FEED_RETRY_MS
+app.config.setdefault('LIVE_FEED_STREAMING', os.environ.get('LIVE_FEED_STREAMING', 'auto'))
+app.config.setdefault('LIVE_FEED_RETRY_MS', int(os.environ.get('LIVE_FEED_RETRY_MS', 10000)))
+# Matches sent in a snapshot when a client's Last-Event-ID can't be replayed
+app.config.setdefault('LIVE_FEED_SNAPSHOT_LIMIT', int(os.environ.get('LIVE_FEED_SNAPSHOT_LIMIT', 200)))
+# Base URL of the live feed service (e.g. https://events.example.com) that
+# pages open /matches/stream on; empty means the page's own origin
+app.config.setdefault('LIVE_FEED_URL', os.environ.get('LIVE_FEED_URL', '').rstrip('/'))
+# The broadcaster stops polling this long after its last stream closed or
+# its last short request was served (seconds)
+app.config.setdefault('LIVE_FEED_IDLE_SECONDS', float(os.environ.get('LIVE_FEED_IDLE_SECONDS', 60)))
+
+_LOCATION_COLUMNS = ('state', 'city', 'area')
+
+
+class LiveFeedFull(RuntimeError):
+    """LIVE_FEED_MAX_CLIENTS streams are already open in this process"""
+
+
+def streaming_enabled():
+    mode = app.config['LIVE_FEED_STREAMING']
+    if mode == 'auto':
+        try:
+            from gevent import monkey
+        except ImportError:
+            return False
+        return monkey.is_module_patched('socket')
+    return mode == 'on'
+
+
+def location_key(state='', city='', area=''):
+    return tuple(normalize_location(value) for value in (state, city, area))
+
+
+def _visible(location, key):
+    # Same prefix semantics as locations.location_filters
+    return all(value.startswith(prefix) for value, prefix in zip(location, key))
+
+
+class Subscriber:
+    """One open stream: a location filter and the events waiting to be sent"""
+
+    def __init__(self, key):
+        self.key = key
+        self.events = deque()
+        self.ready = threading.Event()
+
+    def push(self, item):
+        self.events.append(item)
+        self.ready.set()
+
+    def drain(self, timeout):
+        """Events queued for this stream, waiting up to timeout seconds for one"""
+        if not self.events:
+            self.ready.wait(timeout)
+        self.ready.clear()
+        items = []
+        while self.events:
+            items.append(self.events.popleft())
+        return items
+
+
+class MatchBroadcaster:
+    """Per-process fan-out of live match changes to server-sent event streams.
+
+    While streams are open, a single background thread keeps the set of
+    live matches in memory and re-reads it when the live_match watermark
+    moves (an insert, edit or delete by any worker, CSV import, truncate or
+    restore) or as soon as this process commits a LiveMatch change.
+    Each change is rendered once and pushed onto the queue of every stream
+    whose state/city/area filter it matches, so an idle stream costs a queue
+    and an event, not a query. The thread exits LIVE_FEED_IDLE_SECONDS after
+    the last stream closed and starts again with the next one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._backlog = deque()
+        self._matches = None
+        self._seq = 0
+        self._boot = uuid.uuid4().hex[:8]
+        self._wake = threading.Event()
+        self._ready = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._last_used = 0.0
+
+    def cursor(self):
+        """Event id of the latest change, for pages to resume the feed from.
+
+        Doesn't start the poller: if it isn't running, the id is from an
+        earlier run and the page's stream starts with a snapshot.
+        """
+        with self._lock:
+            return f'{self._boot}-{self._seq}'
+
+    def subscribe(self, key):
+        self._ensure_worker()
+        with self._lock:
+            if len(self._subscribers) >= app.config['LIVE_FEED_MAX_CLIENTS']:
+                raise LiveFeedFull('Too many live match streams open')
+            subscriber = Subscriber(key)
+            self._subscribers.add(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def since(self, key, last_event_id):
+        """Events after last_event_id for this filter, or None if they can't be replayed"""
+        self._ensure_worker()
+        boot, _, seq = (last_event_id or '').partition('-')
+        if boot != self._boot or not seq.isdigit():
+            return None
+        seq = int(seq)
+        with self._lock:
+            if seq > self._seq or (self._backlog and self._backlog[0][0] > seq + 1):
+                return None
+            return [item for item in self._backlog if item[0] > seq and _visible(item[1], key)]
+
+    def snapshot(self, key, timeout=5.0):
+        """Current live matches visible through this filter as one event, or None before the first read"""
+        self._ensure_worker()
+        if not self._ready.wait(timeout):
+            return None
+        with self._lock:
+            seq = self._seq
+            matches = sorted((match_id, entry) for match_id, entry in self._matches.items()
+                             if _visible(entry[0], key))
+        limit = app.config['LIVE_FEED_SNAPSHOT_LIMIT']
+        payload = {'matches': [{'id': match_id, 'html': entry[2]} for match_id, entry in matches[-limit:]],
+                   'complete': len(matches) <= limit}
+        return seq, 'snapshot', payload
+
+    def notify(self):
+        """Re-read the live matches now (called after this process commits a change)"""
+        self._wake.set()
+
+    def stats(self):
+        with self._lock:
+            return {'clients': len(self._subscribers), 'live_matches': len(self._matches or {}),
+                    'last_event': self._seq}
+
+    def format_id(self, seq):
+        return f'{self._boot}-{seq}'
+
+    def _ensure_worker(self):
+        # The thread runs while it is used and does not survive a fork
+        self._last_used = time.monotonic()
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                # Subscribers belong to the parent process, and the events are
+                # recreated in case gevent patched threading after the app was
+                # imported
+                self._subscribers = set()
+                self._wake = threading.Event()
+                self._ready = threading.Event()
+            # Changes made while nobody was polling can't be replayed: new
+            # event ids send reconnecting clients a snapshot instead
+            self._boot = uuid.uuid4().hex[:8]
+            self._backlog.clear()
+            self._matches = None
+            self._seq = 0
+            self._ready.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='live-match-feed', daemon=True)
+            self._thread.start()
+
+    def _idle(self):
+        return (not self._subscribers
+                and time.monotonic() - self._last_used > app.config['LIVE_FEED_IDLE_SECONDS'])
+
+    def _run(self):
+        watermark = None
+        while True:
+            with self._lock:
+                if self._idle():
+                    self._thread = None
+                    return
+            try:
+                with app.app_context():
+                    current = catalog_watermark((LiveMatch,))
+                    woken = self._wake.is_set()
+                    self._wake.clear()
+                    if current != watermark or woken:
+                        self._refresh()
+                        watermark = current
+                    db.session.remove()
+            except Exception:
+                logger.exception('Live match feed refresh failed')
+            self._wake.wait(app.config['LIVE_FEED_POLL_INTERVAL'])
+
+    def _refresh(self):
+        rows = db.session.execute(select(LiveMatch).where(LiveMatch.is_live.is_(True))).scalars().all()
+        current = {}
+        for match in rows:
+            columns = tuple(getattr(match, column.key) for column in LiveMatch.__table__.columns)
+            location = location_key(*(getattr(match, name) for name in _LOCATION_COLUMNS))
+            current[match.id] = (location, columns, None, match)
+
+        previous = self._matches
+        if previous is None:
+            # First read: the baseline that later changes are compared with
+            changed = list(current)
+            removed = []
+        else:
+            changed = [match_id for match_id, entry in current.items()
+                       if match_id not in previous or previous[match_id][1] != entry[1]]
+            removed = [match_id for match_id in previous if match_id not in current]
+
+        # Render each changed card once, outside the lock
+        for match_id in changed:
+            location, columns, _, match = current[match_id]
+            current[match_id] = (location, columns, render_template('_match_card.html', match=match), None)
+        for match_id in current:
+            if match_id not in changed:
+                current[match_id] = previous[match_id]
+
+        with self._lock:
+            self._matches = current
+            self._ready.set()
+            if previous is None:
+                return
+            events = [('match', match_id, current[match_id][0], {'id': match_id, 'html': current[match_id][2]})
+                      for match_id in changed]
+            events += [('removed', match_id, previous[match_id][0], {'id': match_id}) for match_id in removed]
+            for name, match_id, location, payload in sorted(events, key=lambda item: item[1]):
+                self._seq += 1
+                item = (self._seq, location, name, payload)
+                self._backlog.append(item)
+                for subscriber in self._subscribers:
+                    if _visible(location, subscriber.key):
+                        subscriber.push(item)
+            while len(self._backlog) > app.config['LIVE_FEED_BACKLOG']:
+                self._backlog.popleft()
+
+
+match_broadcaster = MatchBroadcaster()
+
+
+def format_event(event_id, name, payload):
+    return f'id: {event_id}\nevent: {name}\ndata: {json.dumps(payload, separators=(",", ":"))}\n\n'
+
+
+def event_stream(key, last_event_id):
+    """Body of a text/event-stream response for one client.
+
+    Starts with whatever the client missed since last_event_id (or a
+    snapshot when that is too old or came from another process), then, when
+    streaming is enabled, keeps the connection open and forwards changes as
+    they happen.
+    """
+    streaming = streaming_enabled()
+    # Registered before the backlog is read so nothing falls in between
+    subscriber = match_broadcaster.subscribe(key) if streaming else None
+    retry = 5000 if streaming else app.config['LIVE_FEED_RETRY_MS']
+
+    def generate():
+        try:
+            yield f'retry: {retry}\n\n'
+            missed = match_broadcaster.since(key, last_event_id)
+            sent = 0
+            if missed is None:
+                snapshot = match_broadcaster.snapshot(key)
+                if snapshot is not None:
+                    sent, name, payload = snapshot
+                    yield format_event(match_broadcaster.format_id(sent), name, payload)
+            else:
+                for seq, _, name, payload in missed:
+                    sent = seq
+                    yield format_event(match_broadcaster.format_id(seq), name, payload)
+                if not missed and last_event_id:
+                    # Nothing new: echo the id so the browser keeps sending it
+                    yield f'id: {last_event_id}\n\n'
+            if subscriber is None:
+                return
+
+            deadline = time.monotonic() + app.config['LIVE_FEED_STREAM_SECONDS']
+            while time.monotonic() < deadline:
+                items = subscriber.drain(app.config['LIVE_FEED_HEARTBEAT'])
+                if not items:
+                    yield ': ping\n\n'
+                for seq, _, name, payload in items:
+                    if seq > sent:
+                        sent = seq
+                        yield format_event(match_broadcaster.format_id(seq), name, payload)
+        finally:
+            if subscriber is not None:
+                match_broadcaster.unsubscribe(subscriber)
+
+    return generate()
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_live_match_changes(session, flush_context):
+    for instance in list(session.new) + list(session.deleted) + list(session.dirty):
+        if isinstance(instance, LiveMatch):
+            session.info['live_match_changed'] = True
+            return
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_broadcaster(session):
+    if session.info.pop('live_match_changed', None):
+        match_broadcaster.notify()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_live_match_changes(session):
+    session.info.pop('live_match_changed', None)
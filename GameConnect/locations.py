@@ -0,0 +1,171 @@
+from sqlalchemy import or_, select
+from sqlalchemy.exc import IntegrityError
+from .app import app, db
+from .models import State, City, Area, User, CoachingAd, LiveMatch
+from .stats import bump_generations
+
+# Models that carry both the free-text location columns and the
+# state_id/city_id/area_id foreign keys into the lookup tables
+LOCATED_MODELS = (User, CoachingAd, LiveMatch)
+
+# Upper bound appended to a prefix so "name >= prefix AND name < prefix + MAX"
+# becomes an index range scan (unlike ILIKE '%...%'); the highest code point
+# also sorts last in SQLite's byte-wise BINARY collation
+_PREFIX_UPPER_BOUND = '\U0010ffff'
+
+
+def normalize_location(value):
+    """Case-fold a location name and collapse internal whitespace"""
+    if not value:
+        return ''
+    return ' '.join(value.split()).casefold()
+
+
+def _prefix_range(column, prefix):
+    if db.engine.dialect.name == 'postgresql':
+        # Range bounds there follow the column's collation, which needn't sort
+        # the bound last; LIKE uses the text_pattern_ops index instead
+        escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return [column.like(f'{escaped}%', escape='\\')]
+    return [column >= prefix, column < prefix + _PREFIX_UPPER_BOUND]
+
+
+def _get_or_create(model, parent_column, parent_id, name):
+    normalized = normalize_location(name)
+    if not normalized:
+        return None
+
+    query = model.query.filter_by(normalized_name=normalized)
+    if parent_column is not None:
+        query = query.filter(parent_column == parent_id)
+
+    row = query.first()
+    if row:
+        return row
+
+    row = model(name=' '.join(name.split()), normalized_name=normalized)
+    if parent_column is not None:
+        setattr(row, parent_column.key, parent_id)
+
+    # Another worker may insert the same name concurrently; the unique
+    # constraint catches that and we fall back to the existing row
+    try:
+        with db.session.begin_nested():
+            db.session.add(row)
+    except IntegrityError:
+        row = query.first()
+    return row
+
+
+def resolve_location(state, city, area):
+    """Return (state_id, city_id, area_id) for free-text values, creating lookup rows as needed"""
+    state_row = _get_or_create(State, None, None, state)
+    state_id = state_row.id if state_row else None
+
+    city_row = _get_or_create(City, City.state_id, state_id, city)
+    city_id = city_row.id if city_row else None
+
+    area_row = _get_or_create(Area, Area.city_id, city_id, area)
+    area_id = area_row.id if area_row else None
+
+    return state_id, city_id, area_id
+
+
+def assign_location(record):
+    """Point a User, CoachingAd or LiveMatch at the lookup rows for its state/city/area text"""
+    record.state_id, record.city_id, record.area_id = resolve_location(
+        record.state, record.city, record.area
+    )
+
+
+def location_filters(model, state='', city='', area=''):
+    """Build indexed prefix filters on model.state_id/city_id/area_id for search input"""
+    filters = []
+
+    state_ids = None
+    state_key = normalize_location(state)
+    if state_key:
+        state_ids = select(State.id).where(*_prefix_range(State.normalized_name, state_key))
+        filters.append(model.state_id.in_(state_ids))
+
+    city_ids = None
+    city_key = normalize_location(city)
+    if city_key:
+        city_ids = select(City.id).where(*_prefix_range(City.normalized_name, city_key))
+        if state_ids is not None:
+            city_ids = city_ids.where(City.state_id.in_(state_ids))
+        filters.append(model.city_id.in_(city_ids))
+
+    area_key = normalize_location(area)
+    if area_key:
+        area_ids = select(Area.id).where(*_prefix_range(Area.normalized_name, area_key))
+        if city_ids is not None:
+            area_ids = area_ids.where(Area.city_id.in_(city_ids))
+        filters.append(model.area_id.in_(area_ids))
+
+    return filters
+
+
+def any_location_filters(model, location):
+    """Like location_filters, for one search term matched against the state, city or area name"""
+    key = normalize_location(location)
+    if not key:
+        return []
+    return [or_(
+        model.state_id.in_(select(State.id).where(*_prefix_range(State.normalized_name, key))),
+        model.city_id.in_(select(City.id).where(*_prefix_range(City.normalized_name, key))),
+        model.area_id.in_(select(Area.id).where(*_prefix_range(Area.normalized_name, key))),
+    )]
+
+
+def backfill_locations(batch_size=500):
+    """Resolve lookup ids for every row whose free-text location has not been linked yet.
+
+    Rows are grouped by their distinct (state, city, area) triple so each
+    combination is resolved once and applied with a single UPDATE.
+    """
+    updated = 0
+    for model in LOCATED_MODELS:
+        model_updated = 0
+        triples = db.session.execute(
+            select(model.state, model.city, model.area)
+            .where(model.state_id.is_(None), model.city_id.is_(None), model.area_id.is_(None))
+            .distinct()
+        ).all()
+
+        for index, (state, city, area) in enumerate(triples, start=1):
+            state_id, city_id, area_id = resolve_location(state, city, area)
+            if state_id is None and city_id is None and area_id is None:
+                continue
+
+            result = db.session.execute(
+                db.update(model)
+                .where(
+                    model.state.is_(None) if state is None else model.state == state,
+                    model.city.is_(None) if city is None else model.city == city,
+                    model.area.is_(None) if area is None else model.area == area,
+                    model.state_id.is_(None),
+                    model.city_id.is_(None),
+                    model.area_id.is_(None),
+                )
+                .values(state_id=state_id, city_id=city_id, area_id=area_id)
+            )
+            model_updated += result.rowcount
+
+            if index % batch_size == 0:
+                db.session.commit()
+
+        if model_updated:
+            # Location filters on the public catalog now match these rows
+            bump_generations(db.session.connection(), model)
+        db.session.commit()
+        updated += model_updated
+
+    return updated
+
+
+@app.cli.command('backfill-locations')
+def backfill_locations_command():
+    """Link existing free-text locations to the state/city/area lookup tables"""
+    updated = backfill_locations()
+    print(f'Linked {updated} rows to the location hierarchy')
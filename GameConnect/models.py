@@ -1,8 +1,48 @@
 from .app import db
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from .passwords import password_hasher
 from datetime import datetime
 
+# Location hierarchy (state -> city -> area). The free-text state/city/area
+# columns on User, CoachingAd and LiveMatch are kept for display; searches go
+# through these lookup tables using the case-folded normalized_name.
+
+# Prefix searches (see locations.py) run as LIKE 'prefix%' on PostgreSQL,
+# which can only use a btree index in pattern order
+def _prefix_search_index(table):
+    return db.Index(f'ix_{table}_normalized_name_pattern', 'normalized_name',
+                    postgresql_ops={'normalized_name': 'text_pattern_ops'}).ddl_if(dialect='postgresql')
+
+class State(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False)
+    normalized_name = db.Column(db.String(50), unique=True, nullable=False, index=True)
+
+    __table_args__ = (_prefix_search_index('state'),)
+
+class City(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    state_id = db.Column(db.Integer, db.ForeignKey('state.id'), index=True)
+    name = db.Column(db.String(50), nullable=False)
+    normalized_name = db.Column(db.String(50), nullable=False, index=True)
+
+    # NULLs are distinct in a unique constraint, so cities without a state need their own index
+    __table_args__ = (db.UniqueConstraint('state_id', 'normalized_name', name='unique_city_per_state'),
+                      db.Index('unique_city_without_state', 'normalized_name', unique=True,
+                               sqlite_where=state_id.is_(None), postgresql_where=state_id.is_(None)),
+                      _prefix_search_index('city'))
+
+class Area(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    city_id = db.Column(db.Integer, db.ForeignKey('city.id'), index=True)
+    name = db.Column(db.String(100), nullable=False)
+    normalized_name = db.Column(db.String(100), nullable=False, index=True)
+
+    __table_args__ = (db.UniqueConstraint('city_id', 'normalized_name', name='unique_area_per_city'),
+                      db.Index('unique_area_without_city', 'normalized_name', unique=True,
+                               sqlite_where=city_id.is_(None), postgresql_where=city_id.is_(None)),
+                      _prefix_search_index('area'))
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -13,6 +53,9 @@ class User(UserMixin, db.Model):
     state = db.Column(db.String(50))
     city = db.Column(db.String(50))
     area = db.Column(db.String(100))
+    state_id = db.Column(db.Integer, db.ForeignKey('state.id'), index=True)
+    city_id = db.Column(db.Integer, db.ForeignKey('city.id'), index=True)
+    area_id = db.Column(db.Integer, db.ForeignKey('area.id'), index=True)
     cricket_role = db.Column(db.String(20))  # batsman, bowler, all-rounder
     availability = db.Column(db.String(200))
     phone = db.Column(db.String(15))
@@ -21,34 +64,50 @@ class User(UserMixin, db.Model):
     is_active = db.Column(db.Boolean, default=True)
     is_owner = db.Column(db.Boolean, default=False)  # Flag to identify the owner account
     
+    # Counter cache for the Follow table, maintained by follow()/unfollow()
+    # and recomputed by `flask reconcile-follow-counts`
+    followers_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    following_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
     # Relationships
     following = db.relationship('Follow', foreign_keys='Follow.follower_id', backref='follower', lazy='dynamic')
     followers = db.relationship('Follow', foreign_keys='Follow.followed_id', backref='followed', lazy='dynamic')
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        if not password_hasher.verify(self.password_hash, password):
+            return False
+        # Upgrade hashes made with older parameters; saved by the caller's next commit
+        if password_hasher.needs_rehash(self.password_hash):
+            self.password_hash = password_hasher.hash(password)
+        return True
     
     def follow(self, user):
         if not self.is_following(user):
             f = Follow(follower_id=self.id, followed_id=user.id)
             db.session.add(f)
+            # SQL-side increments so concurrent follows can't lose updates;
+            # they are flushed in the same transaction as the Follow row
+            self.following_count = User.following_count + 1
+            user.followers_count = User.followers_count + 1
     
     def unfollow(self, user):
         f = self.following.filter_by(followed_id=user.id).first()
         if f:
             db.session.delete(f)
+            self.following_count = User.following_count - 1
+            user.followers_count = User.followers_count - 1
     
     def is_following(self, user):
         return self.following.filter_by(followed_id=user.id).first() is not None
     
     def get_followers_count(self):
-        return self.followers.count()
+        return self.followers_count or 0
     
     def get_following_count(self):
-        return self.following.count()
+        return self.following_count or 0
 
 class Admin(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -60,15 +119,20 @@ class Admin(UserMixin, db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        if not password_hasher.verify(self.password_hash, password):
+            return False
+        # Upgrade hashes made with older parameters; saved by the caller's next commit
+        if password_hasher.needs_rehash(self.password_hash):
+            self.password_hash = password_hasher.hash(password)
+        return True
 
 class Follow(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     follower_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    followed_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    followed_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     __table_args__ = (db.UniqueConstraint('follower_id', 'followed_id', name='unique_follow'),)
@@ -81,6 +145,9 @@ class CoachingAd(db.Model):
     state = db.Column(db.String(50))
     city = db.Column(db.String(50))
     area = db.Column(db.String(100))
+    state_id = db.Column(db.Integer, db.ForeignKey('state.id'), index=True)
+    city_id = db.Column(db.Integer, db.ForeignKey('city.id'), index=True)
+    area_id = db.Column(db.Integer, db.ForeignKey('area.id'), index=True)
     contact_info = db.Column(db.String(200))
     coupon_code = db.Column(db.String(50))
     discount_percentage = db.Column(db.Integer)
@@ -100,6 +167,9 @@ class LiveMatch(db.Model):
     city = db.Column(db.String(50))
     area = db.Column(db.String(100))
     location = db.Column(db.String(200))
+    state_id = db.Column(db.Integer, db.ForeignKey('state.id'), index=True)
+    city_id = db.Column(db.Integer, db.ForeignKey('city.id'), index=True)
+    area_id = db.Column(db.Integer, db.ForeignKey('area.id'), index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     created_by = db.Column(db.Integer, db.ForeignKey('admin.id'))
 
@@ -124,3 +194,10 @@ class ProfileView(db.Model):
 
     # Create unique constraint for viewer-viewed pair
     __table_args__ = (db.UniqueConstraint('viewer_id', 'viewed_id', name='unique_profile_view'),)
+
+
+# Materialized counters for the dashboards (e.g. 'user.total',
+# 'coaching_ad.admin.3'), kept up to date by stats.py
+class PlatformStat(db.Model):
+    key = db.Column(db.String(100), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,169 @@
+import base64
+import datetime
+import json
+import os
+from flask import request, url_for
+from sqlalchemy import and_, or_
+from .app import app
+
+app.config.setdefault('SEARCH_PAGE_SIZE', int(os.environ.get('SEARCH_PAGE_SIZE', 24)))
+app.config.setdefault('SEARCH_MAX_PAGE_SIZE', int(os.environ.get('SEARCH_MAX_PAGE_SIZE', 100)))
+
+
+def _cursor_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f'Cannot store {type(value).__name__} in a cursor')
+
+
+def encode_cursor(values):
+    payload = json.dumps(list(values), separators=(',', ':'), default=_cursor_value)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    """Return the key tuple stored in a cursor, or None if it is missing or malformed"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    if not all(isinstance(value, (int, float, str)) for value in values):
+        return None
+    return tuple(values)
+
+
+def get_page_size():
+    """Page size from ?per_page=, clamped to SEARCH_MAX_PAGE_SIZE"""
+    per_page = request.args.get('per_page', app.config['SEARCH_PAGE_SIZE'], type=int)
+    return max(1, min(per_page, app.config['SEARCH_MAX_PAGE_SIZE']))
+
+
+def page_params():
+    """The request's paging arguments (cursors and page size), e.g. for cache keys"""
+    return {'after': request.args.get('after'), 'before': request.args.get('before'), 'per_page': get_page_size()}
+
+
+class KeysetPage:
+    """One page of results plus the cursors needed to move to its neighbours"""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def _restore_types(key_columns, values):
+    """Turn ISO strings back into dates for date/time key columns"""
+    restored = []
+    for column, value in zip(key_columns, values):
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            python_type = None
+        if isinstance(value, str) and python_type in (datetime.datetime, datetime.date):
+            try:
+                value = python_type.fromisoformat(value)
+            except ValueError:
+                return None
+        restored.append(value)
+    return tuple(restored)
+
+
+def _beyond(key_columns, values, descending):
+    """Row-value comparison (k1, k2, ...) < (v1, v2, ...) spelled out portably"""
+    clauses = []
+    for index, column in enumerate(key_columns):
+        equal_prefix = [key_columns[i] == values[i] for i in range(index)]
+        compare = column < values[index] if descending else column > values[index]
+        clauses.append(and_(*equal_prefix, compare))
+    return or_(*clauses)
+
+
+def keyset_paginate(query, key_columns, after=None, before=None, per_page=None, descending=True):
+    """Return a KeysetPage of query ordered by key_columns (descending unless told otherwise).
+
+    Items are entities, or tuples of values when the query selects several
+    columns. ``key_columns`` is a column or a tuple of columns whose
+    combined value is unique (end it with the primary key).
+    ``after``/``before`` are opaque cursors from a previous page. Each page
+    is a "key < cursor ORDER BY key LIMIT n" range scan, so the cost does
+    not grow with how deep the visitor pages (no OFFSET).
+    """
+    if not isinstance(key_columns, (list, tuple)):
+        key_columns = (key_columns,)
+    key_columns = list(key_columns)
+
+    per_page = per_page or get_page_size()
+    after_key = decode_cursor(after, len(key_columns))
+    before_key = decode_cursor(before, len(key_columns))
+    if after_key is not None:
+        after_key = _restore_types(key_columns, after_key)
+    if before_key is not None:
+        before_key = _restore_types(key_columns, before_key)
+
+    forward = [column.desc() if descending else column.asc() for column in key_columns]
+    backward = [column.asc() if descending else column.desc() for column in key_columns]
+
+    # Select the key values alongside the entity (or the selected columns)
+    # so cursors can include computed keys (e.g. a relevance rank) that are
+    # not model attributes
+    width = len(query.column_descriptions)
+    query = query.add_columns(*(column.label(f'_key{i}') for i, column in enumerate(key_columns)))
+
+    if before_key is not None:
+        # Walk backwards: fetch the rows just above the cursor, then restore order
+        rows = (query.filter(_beyond(key_columns, before_key, descending=not descending))
+                .order_by(*backward)
+                .limit(per_page + 1).all())
+        has_prev = len(rows) > per_page
+        rows = rows[:per_page][::-1]
+        has_next = True
+    else:
+        if after_key is not None:
+            query = query.filter(_beyond(key_columns, after_key, descending=descending))
+        rows = query.order_by(*forward).limit(per_page + 1).all()
+        has_next = len(rows) > per_page
+        rows = rows[:per_page]
+        has_prev = after_key is not None
+
+    if not rows:
+        return KeysetPage([])
+
+    items = [row[0] if width == 1 else tuple(row[:width]) for row in rows]
+    return KeysetPage(
+        items,
+        next_cursor=encode_cursor(rows[-1][width:]) if has_next else None,
+        prev_cursor=encode_cursor(rows[0][width:]) if has_prev else None,
+    )
+
+
+@app.template_global()
+def page_url(after=None, before=None):
+    """URL of the current view with the same filters and a different page cursor"""
+    args = request.args.to_dict()
+    args.pop('after', None)
+    args.pop('before', None)
+    if after:
+        args['after'] = after
+    if before:
+        args['before'] = before
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
@@ -0,0 +1,128 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import click
+from flask import flash, redirect, request
+from werkzeug.security import generate_password_hash, check_password_hash
+from .app import app
+
+logger = logging.getLogger(__name__)
+
+# Werkzeug method string: "scrypt:<n>:<r>:<p>" or "pbkdf2:<hash>:<iterations>".
+# Stored hashes made with other parameters are upgraded at the next login.
+app.config.setdefault('PASSWORD_HASH_METHOD', os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1'))
+# Hashes computed at the same time by one process; hashlib releases the GIL,
+# so these run in parallel while request threads keep serving other pages
+app.config.setdefault('PASSWORD_HASH_WORKERS', int(os.environ.get('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1))))
+# Hash requests allowed to wait for a worker before new ones are turned away
+app.config.setdefault('PASSWORD_HASH_QUEUE', int(os.environ.get('PASSWORD_HASH_QUEUE', 32)))
+# How long a request waits for a queue slot (seconds)
+app.config.setdefault('PASSWORD_HASH_WAIT', float(os.environ.get('PASSWORD_HASH_WAIT', 2.0)))
+
+
+def _executor_class():
+    # Under gevent workers threading is patched into greenlets, which would
+    # hash on the event loop; gevent's executor uses real threads
+    try:
+        from gevent import monkey
+    except ImportError:
+        return ThreadPoolExecutor
+    if monkey.is_module_patched('threading'):
+        from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+        return NativeThreadPoolExecutor
+    return ThreadPoolExecutor
+
+
+class PasswordHasherBusy(RuntimeError):
+    """Too many password hashes are queued; the request should be retried later"""
+
+
+class PasswordHasher:
+    """Hash and verify passwords on a bounded per-process worker pool.
+
+    At most PASSWORD_HASH_WORKERS hashes run at once and at most
+    PASSWORD_HASH_QUEUE more wait for a worker, so a burst of logins costs a
+    fixed number of cores instead of every request thread; callers beyond
+    that get PasswordHasherBusy after PASSWORD_HASH_WAIT seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+        self._pid = None
+        self._methods = {}
+
+    def _pool(self):
+        # Created lazily, and again in a forked worker (threads don't survive fork)
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                workers = app.config['PASSWORD_HASH_WORKERS']
+                self._executor = _executor_class()(max_workers=workers, thread_name_prefix='password-hash')
+                self._slots = threading.BoundedSemaphore(workers + app.config['PASSWORD_HASH_QUEUE'])
+                self._pid = os.getpid()
+            return self._executor, self._slots
+
+    def _run(self, function, *args):
+        executor, slots = self._pool()
+        if not slots.acquire(timeout=app.config['PASSWORD_HASH_WAIT']):
+            raise PasswordHasherBusy('Too many password checks in progress')
+        try:
+            return executor.submit(function, *args).result()
+        finally:
+            slots.release()
+
+    def hash(self, password, method=None):
+        return self._run(generate_password_hash, password, method or app.config['PASSWORD_HASH_METHOD'])
+
+    def verify(self, password_hash, password):
+        if not password_hash or password is None:
+            return False
+        return self._run(check_password_hash, password_hash, password)
+
+    def current_method(self):
+        """Configured method with defaults filled in, as it appears in stored hashes"""
+        method = app.config['PASSWORD_HASH_METHOD']
+        if method not in self._methods:
+            # Let Werkzeug expand e.g. "scrypt" to "scrypt:32768:8:1" once
+            self._methods[method] = generate_password_hash('', method).split('$', 1)[0]
+        return self._methods[method]
+
+    def needs_rehash(self, password_hash):
+        return password_hash.split('$', 1)[0] != self.current_method()
+
+
+password_hasher = PasswordHasher()
+
+
+@app.errorhandler(PasswordHasherBusy)
+def _password_hasher_busy(error):
+    logger.warning('Password hashing queue full (%s %s)', request.method, request.path)
+    flash('The server is busy right now. Please try again in a moment.')
+    return redirect(request.url)
+
+
+@app.cli.command('benchmark-password-hashing')
+@click.option('--method', 'methods', multiple=True,
+              help='Werkzeug hash method to measure (repeatable); defaults to a range of scrypt and pbkdf2 costs')
+@click.option('--seconds', type=float, default=2.0, help='Time spent measuring each method')
+def benchmark_password_hashing_command(methods, seconds):
+    """Report password verifications (logins) per second per worker at each cost setting"""
+    methods = methods or ('scrypt:16384:8:1', 'scrypt:32768:8:1', 'scrypt:65536:8:1',
+                          'pbkdf2:sha256:600000', 'pbkdf2:sha256:1000000')
+    configured = password_hasher.current_method()
+    print(f"{'method':<24} {'ms/login':>9} {'logins/s/worker':>16}")
+    for method in methods:
+        stored = generate_password_hash('benchmark-password', method)
+        count = 0
+        started = time.perf_counter()
+        while time.perf_counter() - started < seconds or count == 0:
+            check_password_hash(stored, 'benchmark-password')
+            count += 1
+        elapsed = time.perf_counter() - started
+        marker = '  (configured)' if stored.split('$', 1)[0] == configured else ''
+        print(f'{method:<24} {elapsed / count * 1000:>9.1f} {count / elapsed:>16.1f}{marker}')
+    print(f"Workers per process: {app.config['PASSWORD_HASH_WORKERS']} "
+          f'(CPU cores: {os.cpu_count()}); a process handles about workers x logins/s/worker')
@@ -0,0 +1,148 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+from collections import Counter
+from sqlalchemy.dialects import postgresql, sqlite
+from .app import app, db
+from .models import ProfileView
+from .stats import apply_stat_deltas
+
+logger = logging.getLogger(__name__)
+
+# Dialect-specific INSERT constructs that understand ON CONFLICT DO NOTHING
+# (SQLite renders it as INSERT ... ON CONFLICT DO NOTHING, same as PostgreSQL)
+_INSERT_BY_DIALECT = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert,
+}
+
+
+def record_profile_views(viewer_id, viewed_ids):
+    """Insert the missing (viewer, viewed) pairs in a single set-based statement.
+
+    Pairs that already exist are skipped by the unique_profile_view
+    constraint, so there is no per-player existence check. The
+    profile_view.total counter is bumped by the rows actually inserted, in
+    the same transaction. Does not commit.
+    """
+    viewed_ids = sorted({viewed_id for viewed_id in viewed_ids if viewed_id != viewer_id})
+    if not viewed_ids:
+        return
+
+    rows = [{'viewer_id': viewer_id, 'viewed_id': viewed_id} for viewed_id in viewed_ids]
+    insert = _INSERT_BY_DIALECT.get(db.engine.dialect.name)
+
+    if insert is not None:
+        statement = insert(ProfileView).on_conflict_do_nothing(
+            index_elements=['viewer_id', 'viewed_id']
+        ).returning(ProfileView.id)
+        inserted = len(db.session.execute(statement, rows).all())
+        _count_views(inserted)
+        return
+
+    # Other backends: fetch the existing pairs once and insert the rest
+    existing = {
+        viewed_id for (viewed_id,) in db.session.query(ProfileView.viewed_id).filter(
+            ProfileView.viewer_id == viewer_id,
+            ProfileView.viewed_id.in_(viewed_ids)
+        )
+    }
+    missing = [row for row in rows if row['viewed_id'] not in existing]
+    if missing:
+        db.session.execute(db.insert(ProfileView), missing)
+        _count_views(len(missing))
+
+
+def _count_views(inserted):
+    # Core inserts bypass the ORM events that keep the stats counters
+    if inserted:
+        apply_stat_deltas(db.session.connection(), Counter({'profile_view.total': inserted}))
+
+
+class ProfileViewRecorder:
+    """Write-behind queue that records profile views off the request thread.
+
+    When disabled, record() writes synchronously into the current session
+    and the caller's commit persists it. When enabled, batches are handed to
+    a background thread that flushes them with record_profile_views().
+    """
+
+    def __init__(self, enabled=False, max_pending=10000):
+        self.enabled = enabled
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def record(self, viewer_id, viewed_ids):
+        viewed_ids = list(viewed_ids)
+        if not self.enabled:
+            record_profile_views(viewer_id, viewed_ids)
+            return
+
+        self._ensure_worker()
+        with self._lock:
+            self._pending.update((viewer_id, viewed_id) for viewed_id in viewed_ids)
+        try:
+            self._queue.put_nowait((viewer_id, viewed_ids))
+        except queue.Full:
+            # Never drop views: fall back to writing inline under back-pressure
+            self._discard(viewer_id, viewed_ids)
+            record_profile_views(viewer_id, viewed_ids)
+
+    def is_pending(self, viewer_id, viewed_id):
+        """True if the view is queued but not yet written (same process only)"""
+        with self._lock:
+            return (viewer_id, viewed_id) in self._pending
+
+    def flush(self):
+        """Block until everything queued so far has been written"""
+        if self.enabled and self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def _discard(self, viewer_id, viewed_ids):
+        with self._lock:
+            self._pending.difference_update((viewer_id, viewed_id) for viewed_id in viewed_ids)
+
+    def _ensure_worker(self):
+        # The worker thread does not survive a fork, so start one per process
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='profile-view-recorder', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            batches = [self._queue.get()]
+            # Drain whatever else is waiting so bursts share one transaction
+            while True:
+                try:
+                    batches.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            with app.app_context():
+                try:
+                    for viewer_id, viewed_ids in batches:
+                        record_profile_views(viewer_id, viewed_ids)
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('Failed to record %d profile view batches', len(batches))
+
+            for viewer_id, viewed_ids in batches:
+                self._discard(viewer_id, viewed_ids)
+                self._queue.task_done()
+
+
+profile_view_recorder = ProfileViewRecorder(
+    enabled=os.environ.get('PROFILE_VIEW_WRITE_BEHIND', '').lower() in ('1', 'true', 'yes')
+)
+atexit.register(profile_view_recorder.flush)
@@ -0,0 +1,162 @@
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from .app import app
+from .models import CoachingAd, LiveMatch, StoreProduct
+from .pagination import KeysetPage
+from .http_caching import catalog_watermark
+
+app.config.setdefault('CATALOG_CACHE_SIZE', int(os.environ.get('CATALOG_CACHE_SIZE', 512)))
+app.config.setdefault('CATALOG_CACHE_MAX_BYTES', int(os.environ.get('CATALOG_CACHE_MAX_BYTES', 32 * 1024 * 1024)))
+app.config.setdefault('CATALOG_CACHE_TTL', float(os.environ.get('CATALOG_CACHE_TTL', 300)))
+
+CACHED_MODELS = (CoachingAd, LiveMatch, StoreProduct)
+
+# Cursor parameters are opaque and kept as they are; everything else is normalized
+_VERBATIM_PARAMS = ('after', 'before')
+
+
+def _normalize(name, value):
+    # Searches and filters are case-insensitive, so "Bat " and "bat" share an entry
+    if isinstance(value, str) and name not in _VERBATIM_PARAMS:
+        return ' '.join(value.split()).lower()
+    return value
+
+
+def _snapshot(model, result):
+    """Plain column values of a page (or list) of rows, and their approximate size in bytes"""
+    columns = [column.key for column in model.__table__.columns]
+    is_page = isinstance(result, KeysetPage)
+    rows = [{key: getattr(item, key) for key in columns} for item in result]
+    size = sys.getsizeof(rows) + sum(sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row.values())
+                                     for row in rows)
+    if is_page:
+        payload = ('page', rows, result.next_cursor, result.prev_cursor)
+    else:
+        payload = ('list', rows, None, None)
+    return payload, size
+
+
+def _rebuild(model, payload):
+    # Transient instances: templates only read their columns
+    kind, rows, next_cursor, prev_cursor = payload
+    items = [model(**row) for row in rows]
+    if kind == 'page':
+        return KeysetPage(items, next_cursor=next_cursor, prev_cursor=prev_cursor)
+    return items
+
+
+class CatalogResultCache:
+    """Per-process LRU + TTL cache of public catalog search results.
+
+    Keys are the table, its catalog watermark (see http_caching), the view
+    and the normalized query parameters. A change made by any worker moves
+    the watermark, so stale entries are never served; this process also
+    drops a table's entries as soon as it commits a change to it, and the
+    least recently used entries go once CATALOG_CACHE_SIZE entries or
+    CATALOG_CACHE_MAX_BYTES are exceeded.
+    """
+
+    name = 'Catalog searches'
+
+    def __init__(self, max_size, max_bytes, ttl):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def fetch(self, model, view, params, load):
+        """Result of load() for these parameters, from the cache when possible"""
+        table = model.__table__.name
+        key = (table, catalog_watermark((model,)), view,
+               tuple(sorted((name, _normalize(name, value)) for name, value in params.items())))
+        payload = self._get(key)
+        if payload is not None:
+            return _rebuild(model, payload)
+        result = load()
+        payload, size = _snapshot(model, result)
+        self._put(key, payload, size)
+        return result
+
+    def _get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def _put(self, key, payload, size):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, payload)
+            self.bytes += size
+            while self._entries and (len(self._entries) > self.max_size or self.bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        self.bytes -= self._entries.pop(key)[1]
+
+    def invalidate(self, *tables):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] in tables]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'name': self.name,
+                'entries': len(self._entries),
+                'capacity': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'memory_bytes': self.bytes,
+                'hit_rate': round(100.0 * self.hits / lookups, 1) if lookups else 0.0,
+            }
+
+
+catalog_results = CatalogResultCache(app.config['CATALOG_CACHE_SIZE'], app.config['CATALOG_CACHE_MAX_BYTES'],
+                                     app.config['CATALOG_CACHE_TTL'])
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_catalog_changes(session, flush_context):
+    touched = session.info.setdefault('catalog_tables', set())
+    for instance in list(session.new) + list(session.deleted) + list(session.dirty):
+        if isinstance(instance, CACHED_MODELS):
+            touched.add(instance.__table__.name)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed(session):
+    touched = session.info.pop('catalog_tables', None)
+    if touched:
+        catalog_results.invalidate(*touched)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back(session):
+    session.info.pop('catalog_tables', None)
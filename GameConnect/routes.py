@@ -1,10 +1,29 @@
-from flask import render_template, request, redirect, url_for, flash, session
+from flask import render_template, request, redirect, url_for, flash, session, jsonify
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.security import check_password_hash
 from .app import app, db
 from .models import User, Admin, Follow, CoachingAd, LiveMatch, StoreProduct, ProfileView
+from .locations import assign_location, location_filters
+from .profile_views import profile_view_recorder
+from .pagination import keyset_paginate, get_page_size, page_params
+from .follows import reset_follow_counts
+from .follow_graph import follow_graph
+from .user_cache import user_cache
+from .stats import platform_stats, reconcile_stats, bump_generations
+from .fulltext import search_ranked, substring_filter, install_fulltext_indexes, drop_fulltext_indexes
+from .storage import get_storage_report, invalidate_storage_report, format_bytes
+from .backup import RestoreError, mark_database_replaced, start_backup, backup_status, backup_file_path, stream_file, last_backup_info, save_upload, verify_backup, restore_from_file
+from .exports import EXPORT_FORMATS, export_chunks
+from .catalog_import import IMPORT_MODELS, import_csv
+from .table_browser import resolve_table, describe_columns, browse_table
+from .snapshots import safety_snapshot, list_snapshots, get_snapshot, iter_snapshot, store_size
+from .sqlite_profile import current_settings as sqlite_settings
+from .db_routing import use_primary
+from .http_caching import conditional_catalog
+from .result_cache import catalog_results
+from .schema import migrate_database
+from .live_feed import LiveFeedFull, event_stream, location_key, match_broadcaster
+from .searches import filter_players, filter_coaching, filter_store, filter_matches, run_search, search_response
 import urllib.parse
-from sqlalchemy import or_
 
 # Owner credentials are now stored in the database
 # The first user with is_owner=True will be the owner
@@ -57,6 +76,7 @@ def register():
             gender=gender
         )
         user.set_password(password)
+        assign_location(user)
         
         db.session.add(user)
         db.session.commit()
@@ -75,6 +95,10 @@ def login():
         # First check if it's a regular user or owner
         user = User.query.filter_by(username=username).first()
         if user and user.check_password(password):
+            # Save a hash that was upgraded to the current parameters
+            if db.session.is_modified(user):
+                db.session.commit()
+                user_cache.invalidate(user.id)
             # Check if user is the owner
             if user.is_owner:
                 session['is_owner'] = True
@@ -89,6 +113,8 @@ def login():
         # Then check if it's an admin
         admin = Admin.query.filter_by(username=username).first()
         if admin and admin.check_password(password) and admin.is_approved:
+            if db.session.is_modified(admin):
+                db.session.commit()
             session['is_admin'] = True
             session['admin_id'] = admin.id
             session['admin_username'] = admin.username
@@ -114,9 +140,61 @@ def profile():
     
     followers_count = current_user.get_followers_count()
     following_count = current_user.get_following_count()
+    suggested_players = get_suggested_players(current_user.id, limit=6)
     return render_template('profile.html', 
                          followers_count=followers_count,
-                         following_count=following_count)
+                         following_count=following_count,
+                         suggested_players=suggested_players)
+
+# Most recommendations a client can ask for; a suggested profile opened from
+# any of them counts as viewed
+MAX_SUGGESTED_PLAYERS = 50
+
+def get_suggested_players(user_id, limit=10):
+    """Return (User, recommendation) pairs from the in-memory follow graph"""
+    graph = follow_graph.get()
+    if graph is None:
+        return []
+    
+    recommendations = graph.recommendations(user_id, limit=limit)
+    users = {user.id: user for user in User.query.filter(
+        User.id.in_([rec['user_id'] for rec in recommendations])
+    )}
+    return [(users[rec['user_id']], rec) for rec in recommendations if rec['user_id'] in users]
+
+def is_suggested_player(user_id, player_id):
+    """Whether player_id is currently recommended to user_id"""
+    graph = follow_graph.get()
+    if graph is None:
+        return False
+    return any(rec['user_id'] == player_id
+               for rec in graph.recommendations(user_id, limit=MAX_SUGGESTED_PLAYERS))
+
+@app.route('/api/players/recommendations')
+@login_required
+def player_recommendations_api():
+    limit = max(1, min(request.args.get('limit', 10, type=int), MAX_SUGGESTED_PLAYERS))
+    graph = follow_graph.get()
+    if graph is None:
+        return jsonify({'recommendations': [], 'mutual_follows': [], 'graph': None})
+    
+    suggested = get_suggested_players(current_user.id, limit=limit)
+    return jsonify({
+        'recommendations': [{
+            'id': user.id,
+            'username': user.username,
+            'name': user.name,
+            'city': user.city,
+            'area': user.area,
+            'cricket_role': user.cricket_role,
+            'url': url_for('player_detail', player_id=user.id, via='suggested'),
+            'score': rec['score'],
+            'mutual_connections': rec['mutual_connections'],
+            'reasons': rec['reasons'],
+        } for user, rec in suggested],
+        'mutual_follows': graph.mutual_follows(current_user.id),
+        'graph': graph.stats(),
+    })
 
 @app.route('/edit_profile', methods=['POST'])
 @login_required
@@ -130,8 +208,10 @@ def edit_profile():
     current_user.availability = request.form.get('availability')
     current_user.phone = request.form.get('phone')
     current_user.gender = request.form.get('gender')
+    assign_location(current_user)
     
     db.session.commit()
+    user_cache.invalidate(current_user.id)
     flash('Profile updated successfully!')
     return redirect(url_for('profile'))
 
@@ -155,6 +235,7 @@ def reset_password():
     # Update password
     current_user.set_password(new_password)
     db.session.commit()
+    user_cache.invalidate(current_user.id)
     
     flash('Your password has been updated successfully!', 'success')
     return redirect(url_for('profile'))
@@ -173,47 +254,22 @@ def search_players():
     search_performed = any([state, city, area, role])
     
     if search_performed:
-        query = User.query.filter(User.id != current_user.id)
-        
-        if state:
-            query = query.filter(User.state.ilike(f'%{state}%'))
-        if city:
-            query = query.filter(User.city.ilike(f'%{city}%'))
-        if area:
-            query = query.filter(User.area.ilike(f'%{area}%'))
-        if role and role != 'all':
-            query = query.filter(User.cricket_role == role)
+        query, sort_key = filter_players(User.query, current_user.id, state, city, area, role)
+        players = keyset_paginate(query, sort_key, request.args.get('after'), request.args.get('before'))
         
-        players = query.all()
-        
-        # Record profile views for each player in search results
-        for player in players:
-            # Check if already viewed
-            existing_view = ProfileView.query.filter_by(
-                viewer_id=current_user.id,
-                viewed_id=player.id
-            ).first()
-            
-            # If not viewed before, create a new view record
-            if not existing_view:
-                view_record = ProfileView(
-                    viewer_id=current_user.id,
-                    viewed_id=player.id
-                )
-                db.session.add(view_record)
+        # Record profile views for all players in search results in one
+        # INSERT ... ON CONFLICT DO NOTHING (optionally written behind)
+        profile_view_recorder.record(current_user.id, [player.id for player in players])
         
         # Find coaching ads based on user's location search criteria
         coaching_query = CoachingAd.query
         
         # Use the same location filters as the player search
-        if state:
-            coaching_query = coaching_query.filter(CoachingAd.state.ilike(f'%{state}%'))
-        if city:
-            coaching_query = coaching_query.filter(CoachingAd.city.ilike(f'%{city}%'))
-        if area:
-            coaching_query = coaching_query.filter(CoachingAd.area.ilike(f'%{area}%'))
+        coaching_query = coaching_query.filter(*location_filters(CoachingAd, state, city, area))
             
-        coaching_ads = coaching_query.all()
+        coaching_ads = catalog_results.fetch(
+            CoachingAd, 'search_players', {'state': state, 'city': city, 'area': area, 'limit': get_page_size()},
+            lambda: coaching_query.order_by(CoachingAd.id.desc()).limit(get_page_size()).all())
         
         db.session.commit()
     
@@ -238,6 +294,16 @@ def player_detail(player_id):
     ).first()
     
     # Allow viewing own profile or if already viewed through search
+    # (including views still queued by the write-behind recorder)
+    if not has_viewed:
+        has_viewed = profile_view_recorder.is_pending(current_user.id, player_id)
+    
+    # Suggested players count as viewed once their profile is opened
+    if not has_viewed and request.args.get('via') == 'suggested' and is_suggested_player(current_user.id, player_id):
+        profile_view_recorder.record(current_user.id, [player_id])
+        db.session.commit()
+        has_viewed = True
+    
     if player_id != current_user.id and not has_viewed:
         flash('You must search for players to view their profiles.')
         return redirect(url_for('search_players'))
@@ -254,20 +320,33 @@ def player_detail(player_id):
 
 @app.route('/follow/<int:player_id>')
 @login_required
+@use_primary
 def follow_player(player_id):
     player = User.query.get_or_404(player_id)
+    # Followed from "Players You May Know": the profile stays viewable (checked
+    # before following, which drops the player from the recommendations)
+    suggested = request.args.get('via') == 'suggested' and is_suggested_player(current_user.id, player_id)
     if player != current_user:
         current_user.follow(player)
+        if suggested:
+            profile_view_recorder.record(current_user.id, [player_id])
         db.session.commit()
+        user_cache.invalidate(current_user.id, player.id)
+        follow_graph.note_follow(current_user.id, player.id)
         flash(f'You are now following {player.name}!')
+    if request.args.get('via') == 'suggested':
+        return redirect(url_for('profile'))
     return redirect(url_for('player_detail', player_id=player_id))
 
 @app.route('/unfollow/<int:player_id>')
 @login_required
+@use_primary
 def unfollow_player(player_id):
     player = User.query.get_or_404(player_id)
     current_user.unfollow(player)
     db.session.commit()
+    user_cache.invalidate(current_user.id, player.id)
+    follow_graph.note_unfollow(current_user.id, player.id)
     flash(f'You unfollowed {player.name}!')
     return redirect(url_for('player_detail', player_id=player_id))
 
@@ -327,10 +406,11 @@ def owner_dashboard():
     
     pending_admins = Admin.query.filter_by(is_approved=False).all()
     approved_admins = Admin.query.filter_by(is_approved=True).all()
-    total_users = User.query.count()
-    total_coaching_ads = CoachingAd.query.count()
-    total_matches = LiveMatch.query.count()
-    total_products = StoreProduct.query.count()
+    stats = platform_stats.get('user.total', 'coaching_ad.total', 'live_match.total', 'store_product.total')
+    total_users = stats['user.total']
+    total_coaching_ads = stats['coaching_ad.total']
+    total_matches = stats['live_match.total']
+    total_products = stats['store_product.total']
     
     return render_template('owner_dashboard.html',
                          pending_admins=pending_admins,
@@ -349,25 +429,13 @@ def database_management():
         return redirect(url_for('profile'))
     
     import os
-    import sqlite3
-    import datetime
     
-    # Get the path to the SQLite database file
-    db_path = os.path.join(app.root_path, '..', 'instance', 'cricket_community.db')
     backup_dir = os.path.join(app.root_path, 'backups')
     last_backup_file = os.path.join(backup_dir, 'last_backup.txt')
     
-    # Calculate database size
-    try:
-        db_size_bytes = os.path.getsize(db_path)
-        if db_size_bytes < 1024:
-            db_size = f"{db_size_bytes} bytes"
-        elif db_size_bytes < 1024 * 1024:
-            db_size = f"{db_size_bytes / 1024:.1f} KB"
-        else:
-            db_size = f"{db_size_bytes / (1024 * 1024):.1f} MB"
-    except Exception:
-        db_size = "Unknown"
+    # Measured page usage per table and index (cached briefly)
+    storage = get_storage_report()
+    db_size = format_bytes(storage['file_bytes']) if storage else 'Unknown'
     
     # Get last backup time
     try:
@@ -380,137 +448,110 @@ def database_management():
         last_backup = 'Never'
     
     # Get database statistics
-    total_tables = 7  # User, Admin, Follow, CoachingAd, LiveMatch, StoreProduct, ProfileView
-    total_records = User.query.count() + Admin.query.count() + Follow.query.count() + \
-                   CoachingAd.query.count() + LiveMatch.query.count() + \
-                   StoreProduct.query.count() + ProfileView.query.count()
+    model_map = {
+        'User': User,
+        'Admin': Admin,
+        'Follow': Follow,
+        'CoachingAd': CoachingAd,
+        'LiveMatch': LiveMatch,
+        'StoreProduct': StoreProduct,
+        'ProfileView': ProfileView
+    }
+    total_tables = len(model_map)
+    stats = platform_stats.get()
+    total_records = sum(stats[f'{model.__table__.name}.total'] for model in model_map.values())
     
-    # Get table information with actual sizes
     tables = []
+    for table_name, model in model_map.items():
+        usage = storage['tables'].get(model.__table__.name) if storage else None
+        tables.append({
+            'name': table_name,
+            'records': stats[f'{model.__table__.name}.total'],
+            'size': format_bytes(usage['total_bytes']) if usage else 'Unknown',
+            'usage': usage
+        })
     
-    # Connect to the database to get table sizes
-    try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # Get the page size and page count for each table
-        cursor.execute("PRAGMA page_size")
-        page_size = cursor.fetchone()[0]
-        
-        # Get table information
-        model_map = {
-            'User': User,
-            'Admin': Admin,
-            'Follow': Follow,
-            'CoachingAd': CoachingAd,
-            'LiveMatch': LiveMatch,
-            'StoreProduct': StoreProduct,
-            'ProfileView': ProfileView
-        }
-        
-        for table_name, model in model_map.items():
-            # Get record count
-            record_count = model.query.count()
-            
-            # Get table size (approximate)
-            cursor.execute(f"SELECT count(*) FROM sqlite_master WHERE name='{table_name.lower()}'")
-            if cursor.fetchone()[0] > 0:
-                cursor.execute(f"PRAGMA table_info({table_name.lower()})")
-                columns = cursor.fetchall()
-                
-                # Estimate size based on record count and column types
-                avg_row_size = 0
-                for col in columns:
-                    col_type = col[2].lower()
-                    if 'int' in col_type:
-                        avg_row_size += 8
-                    elif 'text' in col_type or 'varchar' in col_type:
-                        avg_row_size += 50  # Assume average text length
-                    elif 'bool' in col_type:
-                        avg_row_size += 1
-                    elif 'date' in col_type or 'time' in col_type:
-                        avg_row_size += 8
-                    else:
-                        avg_row_size += 8  # Default size
-                
-                estimated_size = record_count * avg_row_size
-                
-                if estimated_size < 1024:
-                    size_str = f"{estimated_size} bytes"
-                elif estimated_size < 1024 * 1024:
-                    size_str = f"{estimated_size / 1024:.1f} KB"
-                else:
-                    size_str = f"{estimated_size / (1024 * 1024):.1f} MB"
-            else:
-                size_str = "Unknown"
-            
-            tables.append({
-                'name': table_name,
-                'records': record_count,
-                'size': size_str
-            })
-        
-        conn.close()
-    except Exception as e:
-        # If there's an error, fall back to basic information
-        tables = [
-            {'name': 'User', 'records': User.query.count(), 'size': 'Unknown'},
-            {'name': 'Admin', 'records': Admin.query.count(), 'size': 'Unknown'},
-            {'name': 'Follow', 'records': Follow.query.count(), 'size': 'Unknown'},
-            {'name': 'CoachingAd', 'records': CoachingAd.query.count(), 'size': 'Unknown'},
-            {'name': 'LiveMatch', 'records': LiveMatch.query.count(), 'size': 'Unknown'},
-            {'name': 'StoreProduct', 'records': StoreProduct.query.count(), 'size': 'Unknown'},
-            {'name': 'ProfileView', 'records': ProfileView.query.count(), 'size': 'Unknown'}
-        ]
+    cache_stats = [user_cache.stats(), catalog_results.stats()]
     
     return render_template('database_management.html', 
                           total_tables=total_tables,
                           total_records=total_records,
                           db_size=db_size,
                           last_backup=last_backup,
-                          tables=tables)
+                          last_backup_info=last_backup_info(),
+                          backup_status=backup_status(),
+                          snapshots=list_snapshots(),
+                          snapshot_store_size=store_size(),
+                          tables=tables,
+                          storage=storage,
+                          sqlite=sqlite_settings(),
+                          cache_stats=cache_stats)
 
 @app.route('/backup_database')
 @login_required
 def backup_database():
+    """Start an online backup on a background thread; it is downloaded from
+    the Database Management page once it has finished."""
     # Only owner can access this functionality
     if not current_user.is_owner:
         flash('Only the owner can perform database backups.', 'danger')
         return redirect(url_for('profile'))
     
+    if start_backup():
+        flash('Backup started. Refresh this page to download it once it has finished.', 'info')
+    else:
+        flash('A backup is already running.', 'warning')
+    return redirect(url_for('database_management'))
+
+@app.route('/backups/<filename>')
+@login_required
+def download_backup(filename):
+    # Only owner can access this functionality
+    if not current_user.is_owner:
+        flash('Only the owner can download database backups.', 'danger')
+        return redirect(url_for('profile'))
+    
     import os
-    import datetime
-    import shutil
-    from flask import send_file
+    from flask import Response, stream_with_context
     
-    # Create backups directory if it doesn't exist
-    backup_dir = os.path.join(app.root_path, 'backups')
-    os.makedirs(backup_dir, exist_ok=True)
+    backup_path = backup_file_path(filename)
+    if backup_path is None:
+        flash('Backup not found.', 'danger')
+        return redirect(url_for('database_management'))
     
-    # Generate backup filename with timestamp
-    timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-    backup_filename = f'database_backup_{timestamp}.db'
-    backup_path = os.path.join(backup_dir, backup_filename)
+    # Stream the finished backup, compressing on the fly if requested
+    compress = request.args.get('compress') == 'gzip'
+    download_name = filename + ('.gz' if compress else '')
+    headers = {'Content-Disposition': f'attachment; filename={download_name}'}
+    if not compress:
+        headers['Content-Length'] = str(os.path.getsize(backup_path))
+    return Response(stream_with_context(stream_file(backup_path, compress=compress)),
+                    mimetype='application/gzip' if compress else 'application/octet-stream',
+                    headers=headers)
+
+@app.route('/database/snapshots/<snapshot_id>')
+@login_required
+def download_snapshot(snapshot_id):
+    # Only owner can access this functionality
+    if not current_user.is_owner:
+        flash('Only the owner can download database backups.', 'danger')
+        return redirect(url_for('profile'))
     
-    # Get the path to the SQLite database file
-    db_path = os.path.join(app.root_path, '..', 'instance', 'cricket_community.db')
+    from flask import Response, stream_with_context
     
-    try:
-        
-        # Create a copy of the database file
-        shutil.copy2(db_path, backup_path)
-        
-        # Update last backup time in a file for tracking
-        with open(os.path.join(backup_dir, 'last_backup.txt'), 'w') as f:
-            f.write(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-        
-        # Return the backup file as a download
-        return send_file(backup_path, as_attachment=True, download_name=backup_filename)
-    except Exception as e:
-        flash(f'Error creating backup: {str(e)}', 'danger')
+    manifest = get_snapshot(snapshot_id)
+    if manifest is None:
+        flash('Snapshot not found.', 'danger')
         return redirect(url_for('database_management'))
+    
+    # Reassemble the database from its chunks while streaming it
+    return Response(stream_with_context(iter_snapshot(manifest)),
+                    mimetype='application/octet-stream',
+                    headers={'Content-Disposition': f"attachment; filename={manifest['label']}_{manifest['id']}.db",
+                             'Content-Length': str(manifest['size_bytes'])})
 
 @app.route('/optimize_database')
+@use_primary
 def optimize_database():
     # Only owner can access this functionality
     if not session.get('is_owner'):
@@ -545,6 +586,7 @@ def optimize_database():
         
         conn.commit()
         conn.close()
+        invalidate_storage_report()
         
         flash('Database optimization completed successfully. Performance has been improved.', 'success')
     except Exception as e:
@@ -566,30 +608,21 @@ def reset_database():
     
     import os
     import sqlite3
-    import shutil
-    import datetime
-    
-    # Create a backup before resetting
-    backup_dir = os.path.join(app.root_path, 'backups')
-    if not os.path.exists(backup_dir):
-        os.makedirs(backup_dir)
-    
-    # Generate backup filename with timestamp
-    timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-    backup_filename = f'pre_reset_backup_{timestamp}.db'
-    backup_path = os.path.join(backup_dir, backup_filename)
     
     # Get the path to the SQLite database file
     db_path = os.path.join(app.root_path, '..', 'instance', 'cricket_community.db')
     
     try:
-        # Create a backup copy before resetting
-        shutil.copy2(db_path, backup_path)
+        # Snapshot into the deduplicated backup store before resetting
+        safety_snapshot('pre_reset')
         
         # Connect to the database
         conn = sqlite3.connect(db_path)
         cursor = conn.cursor()
         
+        # Drop the full-text indexes first; their shadow tables can't be dropped on their own
+        drop_fulltext_indexes(cursor)
+        
         # Get all tables
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
         tables = cursor.fetchall()
@@ -642,8 +675,12 @@ def reset_database():
         conn.commit()
         conn.close()
         
-        # Reinitialize the database with SQLAlchemy
-        db.create_all()
+        # Recreate the schema by running every migration again (their
+        # version records were dropped with the other tables)
+        migrate_database()
+        reconcile_stats()
+        # Like a restore: every worker drops its caches and catalog watermarks move
+        mark_database_replaced()
         
         flash('Database has been reset to its initial state. A backup was created before resetting.', 'success')
     except Exception as e:
@@ -669,62 +706,38 @@ def restore_database():
         return redirect(url_for('database_management'))
     
     import os
-    import shutil
-    import datetime
-    import sqlite3
-    
-    # Get the path to the SQLite database file
-    db_path = os.path.join(app.root_path, '..', 'instance', 'cricket_community.db')
+    import tempfile
     
     # Create a temporary directory for the uploaded file
     temp_dir = os.path.join(app.root_path, 'temp')
     if not os.path.exists(temp_dir):
         os.makedirs(temp_dir)
     
-    # Create a backup of the current database before restoring
-    backup_dir = os.path.join(app.root_path, 'backups')
-    if not os.path.exists(backup_dir):
-        os.makedirs(backup_dir)
-    
-    # Generate backup filename with timestamp
-    timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-    backup_filename = f'pre_restore_backup_{timestamp}.db'
-    backup_path = os.path.join(backup_dir, backup_filename)
-    
+    fd, temp_file_path = tempfile.mkstemp(dir=temp_dir, suffix='.db')
+    os.close(fd)
     try:
-        # Create a backup of the current database
-        shutil.copy2(db_path, backup_path)
-        
-        # Save the uploaded file to a temporary location
-        temp_file_path = os.path.join(temp_dir, 'temp_restore.db')
-        backup_file.save(temp_file_path)
+        # Stream the upload to disk and check it before touching the live database
+        save_upload(backup_file.stream, temp_file_path)
+        verify_backup(temp_file_path)
         
-        # Verify that the uploaded file is a valid SQLite database
-        try:
-            conn = sqlite3.connect(temp_file_path)
-            cursor = conn.cursor()
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-            tables = cursor.fetchall()
-            conn.close()
-            
-            if not tables:
-                flash('The uploaded file is not a valid database backup.', 'danger')
-                os.remove(temp_file_path)
-                return redirect(url_for('database_management'))
-        except sqlite3.Error:
-            flash('The uploaded file is not a valid SQLite database.', 'danger')
-            os.remove(temp_file_path)
-            return redirect(url_for('database_management'))
+        # Snapshot the current database into the deduplicated backup store
+        safety_snapshot('pre_restore')
         
-        # Replace the current database with the uploaded backup
-        shutil.copy2(temp_file_path, db_path)
-        
-        # Clean up the temporary file
-        os.remove(temp_file_path)
+        # Swap the contents in; other workers reset themselves on their next request
+        restore_from_file(temp_file_path)
+        # A backup taken before a later migration is brought up to date
+        migrate_database()
+        install_fulltext_indexes()
+        reconcile_stats()
         
         flash('Database restored successfully from backup. A backup of the previous state was created.', 'success')
+    except RestoreError as e:
+        flash(str(e), 'danger')
     except Exception as e:
         flash(f'Error restoring database: {str(e)}', 'danger')
+    finally:
+        # Clean up the temporary file
+        os.remove(temp_file_path)
     
     return redirect(url_for('database_management'))
 
@@ -735,68 +748,42 @@ def view_table(table_name):
         flash('Only the owner can view database tables.', 'danger')
         return redirect(url_for('login'))
     
-    import sqlite3
-    import os
-    
-    # Get the path to the SQLite database file
-    db_path = os.path.join(app.root_path, '..', 'instance', 'cricket_community.db')
-    
     # Validate table name to prevent SQL injection
-    valid_tables = ['user', 'admin', 'follow', 'coaching_ad', 'live_match', 'store_product', 'profile_view']
-    model_map = {
-        'user': User,
-        'admin': Admin,
-        'follow': Follow,
-        'coaching_ad': CoachingAd,
-        'live_match': LiveMatch,
-        'store_product': StoreProduct,
-        'profile_view': ProfileView
-    }
-    
-    # Convert CamelCase to snake_case for table name
-    import re
-    snake_case_table = re.sub(r'(?<!^)(?=[A-Z])', '_', table_name).lower()
-    
-    if snake_case_table not in valid_tables and table_name not in valid_tables:
+    model = resolve_table(table_name)
+    if model is None:
         flash(f'Invalid table name: {table_name}', 'danger')
         return redirect(url_for('database_management'))
     
+    # Rows are fetched page by page from table_rows by the page itself
+    table = model.__table__.name
+    return render_template('view_table.html',
+                          table_name=table_name,
+                          columns=describe_columns(model),
+                          record_count=platform_stats.get(f'{table}.total')[f'{table}.total'],
+                          page_size=app.config['TABLE_VIEW_PAGE_SIZE'])
+
+@app.route('/view_table/<table_name>/rows')
+def table_rows(table_name):
+    """JSON page of a table: ?sort=&dir=&after=&before=&per_page= and f.<column>= filters"""
+    if not session.get('is_owner'):
+        return jsonify({'error': 'Only the owner can view database tables.'}), 403
+    
+    model = resolve_table(table_name)
+    if model is None:
+        return jsonify({'error': f'Invalid table name: {table_name}'}), 404
+    
+    filters = {key[2:]: value for key, value in request.args.items() if key.startswith('f.')}
     try:
-        # Use SQLAlchemy to get table data
-        if table_name in model_map:
-            model = model_map[table_name]
-        else:
-            model = model_map[snake_case_table]
-        
-        # Get all records from the table
-        records = model.query.all()
-        
-        # Get column names
-        if records:
-            # Get the first record and extract its attributes
-            first_record = records[0]
-            columns = [column.name for column in model.__table__.columns]
-        else:
-            # If no records, get columns from the model's __table__ attribute
-            columns = [column.name for column in model.__table__.columns]
-        
-        # Prepare data for display
-        table_data = []
-        for record in records:
-            row_data = {}
-            for column in columns:
-                row_data[column] = getattr(record, column)
-            table_data.append(row_data)
-        
-        # Render a template to display the table data
-        return render_template('view_table.html', 
-                              table_name=table_name,
-                              columns=columns,
-                              records=table_data,
-                              record_count=len(records))
-    except Exception as e:
-        flash(f'Error viewing table {table_name}: {str(e)}', 'danger')
-        return redirect(url_for('database_management'))
+        data = browse_table(model,
+                            sort=request.args.get('sort'),
+                            direction=request.args.get('dir', 'asc'),
+                            filters=filters,
+                            after=request.args.get('after'),
+                            before=request.args.get('before'),
+                            per_page=request.args.get('per_page', type=int))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(data)
 
 @app.route('/export_table/<table_name>')
 def export_table(table_name):
@@ -805,140 +792,72 @@ def export_table(table_name):
         flash('Only the owner can export database tables.', 'danger')
         return redirect(url_for('login'))
     
-    import csv
-    import io
-    import os
-    import re
-    from flask import send_file
+    from flask import Response, stream_with_context
     from datetime import datetime
     
     # Validate table name to prevent SQL injection
-    valid_tables = ['user', 'admin', 'follow', 'coaching_ad', 'live_match', 'store_product', 'profile_view']
-    model_map = {
-        'user': User,
-        'admin': Admin,
-        'follow': Follow,
-        'coaching_ad': CoachingAd,
-        'live_match': LiveMatch,
-        'store_product': StoreProduct,
-        'profile_view': ProfileView
-    }
-    
-    # Convert CamelCase to snake_case for table name
-    snake_case_table = re.sub(r'(?<!^)(?=[A-Z])', '_', table_name).lower()
-    
-    if snake_case_table not in valid_tables and table_name not in valid_tables:
+    model = resolve_table(table_name)
+    if model is None:
         flash(f'Invalid table name: {table_name}', 'danger')
         return redirect(url_for('database_management'))
     
     try:
-        # Use SQLAlchemy to get table data
-        if table_name in model_map:
-            model = model_map[table_name]
-        else:
-            model = model_map[snake_case_table]
-        
-        # Get all records from the table
-        records = model.query.all()
-        
-        # Get column names
-        if records:
-            columns = [column.name for column in model.__table__.columns]
-        else:
-            columns = [column.name for column in model.__table__.columns]
-        
-        # Create a CSV in memory
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Write header row
-        writer.writerow(columns)
-        
-        # Write data rows
-        for record in records:
-            row = [getattr(record, column) for column in columns]
-            writer.writerow(row)
-        
-        # Prepare the CSV for download
-        output.seek(0)
+        export_format = request.args.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            flash(f'Unsupported export format: {export_format}', 'danger')
+            return redirect(url_for('database_management'))
+        compress = request.args.get('compress') == 'gzip'
+        mimetype, extension = EXPORT_FORMATS[export_format]
         
         # Generate filename with timestamp
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f'{table_name}_export_{timestamp}.csv'
+        filename = f'{table_name}_export_{timestamp}.{extension}' + ('.gz' if compress else '')
         
-        return send_file(
-            io.BytesIO(output.getvalue().encode('utf-8')),
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name=filename
+        # Rows are read in batches and sent as they are encoded
+        return Response(
+            stream_with_context(export_chunks(model, export_format, compress)),
+            mimetype='application/gzip' if compress else mimetype,
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
         )
     except Exception as e:
         flash(f'Error exporting table {table_name}: {str(e)}', 'danger')
         return redirect(url_for('database_management'))
 
 @app.route('/truncate_table/<table_name>')
+@use_primary
 def truncate_table(table_name):
     # Only owner can access this functionality
     if not session.get('is_owner'):
         flash('Only the owner can truncate database tables.', 'danger')
         return redirect(url_for('login'))
     
-    import re
-    import os
-    import sqlite3
-    import datetime
-    import shutil
-    
     # Validate table name to prevent SQL injection
-    valid_tables = ['user', 'admin', 'follow', 'coaching_ad', 'live_match', 'store_product', 'profile_view']
-    model_map = {
-        'user': User,
-        'admin': Admin,
-        'follow': Follow,
-        'coaching_ad': CoachingAd,
-        'live_match': LiveMatch,
-        'store_product': StoreProduct,
-        'profile_view': ProfileView
-    }
-    
-    # Convert CamelCase to snake_case for table name
-    snake_case_table = re.sub(r'(?<!^)(?=[A-Z])', '_', table_name).lower()
-    
-    if snake_case_table not in valid_tables and table_name not in valid_tables:
+    model = resolve_table(table_name)
+    if model is None:
         flash(f'Invalid table name: {table_name}', 'danger')
         return redirect(url_for('database_management'))
     
     # Protect the admin table if the owner is trying to truncate it
-    if table_name == 'admin' or snake_case_table == 'admin':
+    if model is Admin:
         flash('Cannot truncate the admin table for security reasons.', 'danger')
         return redirect(url_for('database_management'))
     
-    # Get the path to the SQLite database file
-    db_path = os.path.join(app.root_path, '..', 'instance', 'cricket_community.db')
-    
-    # Create a backup before truncating
-    backup_dir = os.path.join(app.root_path, 'backups')
-    if not os.path.exists(backup_dir):
-        os.makedirs(backup_dir)
-    
-    # Generate backup filename with timestamp
-    timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-    backup_filename = f'pre_truncate_{table_name}_{timestamp}.db'
-    backup_path = os.path.join(backup_dir, backup_filename)
-    
     try:
-        # Create a backup copy before truncating
-        shutil.copy2(db_path, backup_path)
-        
-        # Use SQLAlchemy to truncate the table
-        if table_name in model_map:
-            model = model_map[table_name]
-        else:
-            model = model_map[snake_case_table]
+        # Snapshot into the deduplicated backup store before truncating
+        safety_snapshot(f'pre_truncate_{table_name}')
         
         # Delete all records from the table
         model.query.delete()
+        # Bulk deletes bypass the ORM events that move the catalog watermark
+        bump_generations(db.session.connection(), model)
+        if model is Follow:
+            # Keep the cached follower/following counts consistent in the same transaction
+            reset_follow_counts()
         db.session.commit()
+        user_cache.clear()
+        catalog_results.invalidate(model.__table__.name)
+        reconcile_stats()
+        invalidate_storage_report()
         
         flash(f'Table {table_name} has been truncated successfully. A backup was created before truncating.', 'success')
     except Exception as e:
@@ -948,6 +867,7 @@ def truncate_table(table_name):
     return redirect(url_for('view_table', table_name=table_name))
 
 @app.route('/owner/approve_admin/<int:admin_id>')
+@use_primary
 def approve_admin(admin_id):
     if not session.get('is_owner'):
         return redirect(url_for('admin_login'))
@@ -964,9 +884,11 @@ def admin_dashboard():
         return redirect(url_for('admin_login'))
     
     admin_id = session.get('admin_id')
-    coaching_ads = CoachingAd.query.filter_by(created_by=admin_id).count()
-    live_matches = LiveMatch.query.filter_by(created_by=admin_id).count()
-    store_products = StoreProduct.query.filter_by(created_by=admin_id).count()
+    stats = platform_stats.get(f'coaching_ad.admin.{admin_id}', f'live_match.admin.{admin_id}',
+                               f'store_product.admin.{admin_id}')
+    coaching_ads = stats[f'coaching_ad.admin.{admin_id}']
+    live_matches = stats[f'live_match.admin.{admin_id}']
+    store_products = stats[f'store_product.admin.{admin_id}']
     
     return render_template('admin_dashboard.html',
                          coaching_ads=coaching_ads,
@@ -987,15 +909,10 @@ def manage_coaching():
         query = CoachingAd.query.filter_by(created_by=admin_id)
     
     if search:
-        query = query.filter(
-            or_(
-                CoachingAd.title.ilike(f'%{search}%'),
-                CoachingAd.description.ilike(f'%{search}%'),
-                CoachingAd.city.ilike(f'%{search}%'),
-                CoachingAd.state.ilike(f'%{search}%'),
-                CoachingAd.area.ilike(f'%{search}%')
-            )
-        )
+        query, rank = search_ranked(query, CoachingAd, search)
+        if rank is not None:
+            query = query.order_by(rank.desc())
+        query = query.order_by(CoachingAd.id.desc())
     
     coaching_ads = query.all()
     
@@ -1021,6 +938,7 @@ def add_coaching_ad():
         price=float(request.form.get('price')) if request.form.get('price') else None,
         created_by=admin_id
     )
+    assign_location(coaching_ad)
     
     db.session.add(coaching_ad)
     db.session.commit()
@@ -1082,6 +1000,7 @@ def add_live_match():
         location=request.form.get('location'),
         created_by=admin_id
     )
+    assign_location(live_match)
     
     db.session.add(live_match)
     db.session.commit()
@@ -1126,12 +1045,10 @@ def manage_store():
         query = StoreProduct.query.filter_by(created_by=admin_id)
     
     if search:
-        query = query.filter(
-            or_(
-                StoreProduct.name.ilike(f'%{search}%'),
-                StoreProduct.description.ilike(f'%{search}%')
-            )
-        )
+        query, rank = search_ranked(query, StoreProduct, search)
+        if rank is not None:
+            query = query.order_by(rank.desc())
+        query = query.order_by(StoreProduct.id.desc())
     
     if category:
         query = query.filter(StoreProduct.category.ilike(f'%{category}%'))
@@ -1163,6 +1080,46 @@ def add_store_product():
     flash('Store product added successfully!')
     return redirect(url_for('manage_store'))
 
+@app.route('/admin/<section>/import', methods=['POST'])
+def import_catalog(section):
+    if not session.get('is_admin') and not session.get('is_owner'):
+        return redirect(url_for('admin_login'))
+    
+    if section not in IMPORT_MODELS:
+        flash(f'Unknown import type: {section}', 'danger')
+        return redirect(url_for('admin_dashboard'))
+    
+    wants_json = request.accept_mimetypes.best == 'application/json'
+    csv_file = request.files.get('csv_file')
+    if csv_file is None or csv_file.filename == '':
+        if wants_json:
+            return jsonify({'error': 'No CSV file uploaded'}), 400
+        flash('No CSV file selected.', 'danger')
+        return redirect(url_for(f'manage_{section}'))
+    
+    try:
+        # The upload is read row by row and inserted in chunks
+        report = import_csv(IMPORT_MODELS[section], csv_file.stream, session.get('admin_id'))
+    except ValueError as e:
+        if wants_json:
+            return jsonify({'error': str(e)}), 400
+        flash(f'Import failed: {str(e)}', 'danger')
+        return redirect(url_for(f'manage_{section}'))
+    
+    # Rows are inserted with Core, which the result cache's commit hook doesn't see
+    catalog_results.invalidate(IMPORT_MODELS[section].__table__.name)
+    
+    if wants_json:
+        return jsonify(report.to_dict())
+    
+    flash(f'Imported {report.inserted} of {report.rows} rows in {report.seconds:.1f}s.',
+          'success' if not report.error_count else 'warning')
+    for error in report.errors[:10]:
+        flash(f"Line {error['line']}: {error['error']}", 'danger')
+    if report.error_count > 10:
+        flash(f'{report.error_count - 10} more rows were rejected.', 'danger')
+    return redirect(url_for(f'manage_{section}'))
+
 @app.route('/admin/store/delete/<int:product_id>', methods=['POST'])
 def delete_store_product(product_id):
     if not session.get('is_admin') and not session.get('is_owner'):
@@ -1187,6 +1144,7 @@ def delete_store_product(product_id):
     return redirect(url_for('manage_store'))
 
 @app.route('/coaching')
+@conditional_catalog(CoachingAd)
 def public_coaching():
     search = request.args.get('search', '')
     location = request.args.get('location', '')
@@ -1197,30 +1155,17 @@ def public_coaching():
     
     if search or location:
         search_performed = True
-        query = CoachingAd.query
-        
-        if search:
-            query = query.filter(
-                or_(
-                    CoachingAd.title.ilike(f'%{search}%'),
-                    CoachingAd.description.ilike(f'%{search}%')
-                )
-            )
-        
-        if location:
-            query = query.filter(
-                or_(
-                    CoachingAd.city.ilike(f'%{location}%'),
-                    CoachingAd.state.ilike(f'%{location}%'),
-                    CoachingAd.area.ilike(f'%{location}%')
-                )
-            )
+        query, sort_key = filter_coaching(CoachingAd.query, search, location)
         
-        coaching_ads = query.all()
+        # Repeated searches are served from the result cache
+        coaching_ads = catalog_results.fetch(
+            CoachingAd, 'public_coaching', dict(search=search, location=location, **page_params()),
+            lambda: keyset_paginate(query, sort_key, request.args.get('after'), request.args.get('before')))
     
     return render_template('public_coaching.html', coaching_ads=coaching_ads, search=search, location=location, search_performed=search_performed)
 
 @app.route('/store')
+@conditional_catalog(StoreProduct)
 def public_store():
     search = request.args.get('search', '')
     category = request.args.get('category', '')
@@ -1231,20 +1176,12 @@ def public_store():
     
     if search or category:
         search_performed = True
-        query = StoreProduct.query.filter_by(in_stock=True)
+        query, sort_key = filter_store(StoreProduct.query, search, category)
         
-        if search:
-            query = query.filter(
-                or_(
-                    StoreProduct.name.ilike(f'%{search}%'),
-                    StoreProduct.description.ilike(f'%{search}%')
-                )
-            )
-        
-        if category:
-            query = query.filter(StoreProduct.category.ilike(f'%{category}%'))
-        
-        store_products = query.all()
+        # Repeated searches are served from the result cache
+        store_products = catalog_results.fetch(
+            StoreProduct, 'public_store', dict(search=search, category=category, **page_params()),
+            lambda: keyset_paginate(query, sort_key, request.args.get('after'), request.args.get('before')))
     
     return render_template('public_store.html', store_products=store_products, search=search, category=category, search_performed=search_performed)
 
@@ -1261,15 +1198,7 @@ def manage_users():
     query = User.query
     
     if search:
-        query = query.filter(
-            or_(
-                User.name.ilike(f'%{search}%'),
-                User.username.ilike(f'%{search}%'),
-                User.email.ilike(f'%{search}%'),
-                User.city.ilike(f'%{search}%'),
-                User.state.ilike(f'%{search}%')
-            )
-        )
+        query = query.filter(substring_filter(User, search))
     
     if gender_filter:
         query = query.filter(User.gender == gender_filter)
@@ -1281,10 +1210,11 @@ def manage_users():
         page=page, per_page=20, error_out=False
     )
     
-    total_users = User.query.count()
-    active_users = User.query.filter_by(is_active=True).count()
-    male_users = User.query.filter_by(gender='male').count()
-    female_users = User.query.filter_by(gender='female').count()
+    stats = platform_stats.get('user.total', 'user.active', 'user.gender.male', 'user.gender.female')
+    total_users = stats['user.total']
+    active_users = stats['user.active']
+    male_users = stats['user.gender.male']
+    female_users = stats['user.gender.female']
     
     return render_template('manage_users.html', 
                          users=users,
@@ -1311,6 +1241,7 @@ def view_user_detail(user_id):
                          following_count=following_count)
 
 @app.route('/owner/user/<int:user_id>/toggle_status')
+@use_primary
 def toggle_user_status(user_id):
     if not session.get('is_owner'):
         return redirect(url_for('admin_login'))
@@ -1318,6 +1249,7 @@ def toggle_user_status(user_id):
     user = User.query.get_or_404(user_id)
     user.is_active = not user.is_active
     db.session.commit()
+    user_cache.invalidate(user.id)
     
     status = 'activated' if user.is_active else 'deactivated'
     flash(f'User {user.username} has been {status}!')
@@ -1353,6 +1285,7 @@ def whatsapp_url_filter(phone, message=""):
     return f"https://wa.me/{clean_phone}?text={encoded_message}"
 
 @app.route('/matches')
+@conditional_catalog(LiveMatch)
 def public_matches():
     search = request.args.get('search', '')
     state = request.args.get('state', '')
@@ -1362,30 +1295,73 @@ def public_matches():
     # Only show results if search, state, city, or area is provided
     live_matches = []
     search_performed = False
+    feed_cursor = None
+    feed_url = None
     
     if search or state or city or area:
         search_performed = True
-        query = LiveMatch.query.filter_by(is_live=True)
-        
-        if search:
-            query = query.filter(
-                or_(
-                    LiveMatch.title.ilike(f'%{search}%'),
-                    LiveMatch.description.ilike(f'%{search}%'),
-                    LiveMatch.teams.ilike(f'%{search}%'),
-                    LiveMatch.location.ilike(f'%{search}%')
-                )
-            )
-        
-        if state:
-            query = query.filter(LiveMatch.state.ilike(f'%{state}%'))
-        
-        if city:
-            query = query.filter(LiveMatch.city.ilike(f'%{city}%'))
-        
-        if area:
-            query = query.filter(LiveMatch.area.ilike(f'%{area}%'))
-        
-        live_matches = query.order_by(LiveMatch.created_at.desc()).all()
+        # Taken before the query so the live feed resumes from here
+        feed_cursor = match_broadcaster.cursor()
+        feed_url = app.config['LIVE_FEED_URL'] + url_for('live_match_stream', state=state, city=city, area=area,
+                                                         since=feed_cursor)
+        query, sort_key = filter_matches(LiveMatch.query, search, state, city, area)
+        
+        # Repeated searches are served from the result cache
+        live_matches = catalog_results.fetch(
+            LiveMatch, 'public_matches', dict(search=search, state=state, city=city, area=area, **page_params()),
+            lambda: keyset_paginate(query, sort_key, request.args.get('after'), request.args.get('before')))
+    
+    return render_template('public_matches.html', live_matches=live_matches, search=search, state=state, city=city, area=area, search_performed=search_performed, feed_cursor=feed_cursor, feed_url=feed_url)
+
+# Server-sent events for the match list: cards to add or replace and ids to
+# remove as matches go live, stop or are deleted (see live_feed.py). Pages may
+# open it on the live feed service's origin (LIVE_FEED_URL); the feed is
+# public, so any origin may read it
+LIVE_FEED_CORS_HEADERS = {'Access-Control-Allow-Origin': '*', 'Access-Control-Allow-Headers': 'Last-Event-ID'}
+
+@app.route('/matches/stream', methods=['GET', 'OPTIONS'])
+def live_match_stream():
+    if request.method == 'OPTIONS':
+        return app.response_class(status=204, headers=LIVE_FEED_CORS_HEADERS)
+    key = location_key(request.args.get('state', ''), request.args.get('city', ''), request.args.get('area', ''))
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        body = event_stream(key, last_event_id)
+    except LiveFeedFull:
+        return app.response_class('retry: 30000\n\n', status=503, mimetype='text/event-stream',
+                                  headers={'Retry-After': '30', **LIVE_FEED_CORS_HEADERS})
+    return app.response_class(body, mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no',
+                                       **LIVE_FEED_CORS_HEADERS})
+
+# Versioned JSON search API: ?fields=a,b picks the columns, ?after=/?before=
+# page like the HTML views, and rows come back as arrays in field order
+
+@app.route('/api/v1/players')
+@login_required
+def api_search_players():
+    try:
+        result = run_search('players', request.args, viewer_id=current_user.id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    return render_template('public_matches.html', live_matches=live_matches, search=search, state=state, city=city, area=area, search_performed=search_performed)
+    # As on the search page, players in the results can then be opened with /player/<id>
+    if result['rows']:
+        profile_view_recorder.record(current_user.id, [row[0] for row in result['rows']])
+        db.session.commit()
+    return jsonify(result)
+
+@app.route('/api/v1/coaching')
+@conditional_catalog(CoachingAd)
+def api_search_coaching():
+    return search_response('coaching', request.args)
+
+@app.route('/api/v1/matches')
+@conditional_catalog(LiveMatch)
+def api_search_matches():
+    return search_response('matches', request.args)
+
+@app.route('/api/v1/store')
+@conditional_catalog(StoreProduct)
+def api_search_store():
+    return search_response('store', request.args)
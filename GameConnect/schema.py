@@ -0,0 +1,258 @@
+import datetime
+import hashlib
+import importlib.util
+import logging
+import os
+import re
+import sys
+import time
+from collections import namedtuple
+import click
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+from .app import app, db
+
+logger = logging.getLogger(__name__)
+
+# Ordered migration files named NNNN_description.py, each defining upgrade(conn)
+app.config.setdefault('MIGRATIONS_DIR', os.environ.get(
+    'MIGRATIONS_DIR', os.path.join(os.path.dirname(app.root_path), 'migrations')))
+
+# Kept out of db.metadata so create_all(), backups' schema checks and the
+# table browser only ever see the application's own tables
+SCHEMA_MIGRATIONS = Table(
+    'schema_migration', MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('name', String(200), nullable=False),
+    Column('checksum', String(64), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+    Column('duration_ms', Integer),
+)
+
+# Held while migrating on PostgreSQL so two deploys can't interleave
+_ADVISORY_LOCK_KEY = 0x6761_6d65
+
+_FILE_RE = re.compile(r'^(\d{4})_(\w+)\.py$')
+
+Migration = namedtuple('Migration', 'version name path checksum')
+
+
+class MigrationError(RuntimeError):
+    """The migration files or the recorded schema version are inconsistent"""
+
+
+def discover_migrations():
+    """Migration files in version order"""
+    directory = app.config['MIGRATIONS_DIR']
+    migrations = {}
+    for filename in sorted(os.listdir(directory)):
+        match = _FILE_RE.match(filename)
+        if not match:
+            continue
+        version = int(match.group(1))
+        if version in migrations:
+            raise MigrationError(f'Two migrations share version {version:04d}: '
+                                 f'{os.path.basename(migrations[version].path)} and {filename}')
+        path = os.path.join(directory, filename)
+        with open(path, 'rb') as f:
+            checksum = hashlib.sha256(f.read()).hexdigest()
+        migrations[version] = Migration(version, match.group(2), path, checksum)
+    return [migrations[version] for version in sorted(migrations)]
+
+
+def _load(migration):
+    spec = importlib.util.spec_from_file_location(f'_migration_{migration.version:04d}', migration.path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def applied_migrations(conn):
+    """{version: row} of the migrations recorded in the database (empty before the first run)"""
+    if not inspect(conn).has_table(SCHEMA_MIGRATIONS.name):
+        return {}
+    return {row.version: row for row in conn.execute(select(SCHEMA_MIGRATIONS))}
+
+
+def migrate_database(target=None, log=logger.info):
+    """Apply the pending migrations up to target (all by default), each recorded as it completes.
+
+    A migration runs in one transaction together with its version row,
+    unless it sets ``transactional = False`` (needed for CREATE INDEX
+    CONCURRENTLY on PostgreSQL); those run in autocommit mode and must be
+    safe to re-run if they fail half way. Returns the migrations applied.
+    """
+    migrations = discover_migrations()
+    applied = []
+    with db.engine.connect() as lock_conn:
+        if lock_conn.dialect.name == 'postgresql':
+            lock_conn.execute(text('SELECT pg_advisory_lock(:key)'), {'key': _ADVISORY_LOCK_KEY})
+            lock_conn.commit()
+        try:
+            with db.engine.begin() as conn:
+                SCHEMA_MIGRATIONS.create(conn, checkfirst=True)
+                done = applied_migrations(conn)
+
+            for migration in migrations:
+                if migration.version in done:
+                    continue
+                if target is not None and migration.version > target:
+                    break
+                _apply(migration, log)
+                applied.append(migration)
+        finally:
+            if lock_conn.dialect.name == 'postgresql':
+                lock_conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': _ADVISORY_LOCK_KEY})
+                lock_conn.commit()
+    return applied
+
+
+def _apply(migration, log):
+    module = _load(migration)
+    log(f'Applying {migration.version:04d}_{migration.name}...')
+    started = time.perf_counter()
+    if getattr(module, 'transactional', True):
+        with db.engine.begin() as conn:
+            module.upgrade(conn)
+            _record(conn, migration, started)
+    else:
+        with db.engine.connect() as conn:
+            conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+            module.upgrade(conn)
+            _record(conn, migration, started)
+    # Backfills in a migration may have used the ORM session
+    db.session.remove()
+
+
+def _record(conn, migration, started):
+    conn.execute(SCHEMA_MIGRATIONS.insert().values(
+        version=migration.version,
+        name=migration.name,
+        checksum=migration.checksum,
+        applied_at=datetime.datetime.utcnow(),
+        duration_ms=int((time.perf_counter() - started) * 1000),
+    ))
+
+
+def verify_database():
+    """Problems with the schema: pending, edited or unknown migrations and model columns missing from the database"""
+    problems = []
+    migrations = {migration.version: migration for migration in discover_migrations()}
+    with db.engine.connect() as conn:
+        applied = applied_migrations(conn)
+        inspector = inspect(conn)
+        for version, migration in migrations.items():
+            row = applied.get(version)
+            if row is None:
+                problems.append(f'{version:04d}_{migration.name} has not been applied')
+            elif row.checksum != migration.checksum:
+                problems.append(f'{version:04d}_{migration.name} was edited after it was applied')
+        for version in sorted(set(applied) - set(migrations)):
+            problems.append(f'{version:04d}_{applied[version].name} is recorded but its file is missing')
+
+        tables = set(inspector.get_table_names())
+        for table in db.metadata.sorted_tables:
+            if table.name not in tables:
+                problems.append(f'Table {table.name} is missing')
+                continue
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            problems.extend(f'Column {table.name}.{column.name} is missing'
+                            for column in table.columns if column.name not in columns)
+    return problems
+
+
+# Helpers for migration files. They check before they change anything, so a
+# migration also works against a database created by an earlier create_all()
+# or one of the old one-off scripts.
+
+def column_names(conn, table):
+    return {column['name'] for column in inspect(conn).get_columns(table)}
+
+
+def add_column(conn, table, column, ddl):
+    """ALTER TABLE ... ADD COLUMN unless the column already exists; returns True if it was added"""
+    if column in column_names(conn, table):
+        return False
+    conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}'))
+    return True
+
+
+def create_index(conn, name, table, columns, unique=False, using=None, where=None):
+    """CREATE INDEX IF NOT EXISTS, built CONCURRENTLY on PostgreSQL so writes to the table continue.
+
+    ``where`` makes it a partial index. On PostgreSQL the migration must set
+    ``transactional = False``.
+    """
+    column_list = ', '.join(columns)
+    kind = 'UNIQUE INDEX' if unique else 'INDEX'
+    where_clause = f' WHERE {where}' if where else ''
+    if conn.dialect.name == 'postgresql':
+        # An interrupted concurrent build leaves an invalid index with this
+        # name, which IF NOT EXISTS would keep; drop it and build again
+        invalid = conn.execute(text(
+            'SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid '
+            'WHERE c.relname = :name AND NOT i.indisvalid'
+        ), {'name': name}).first()
+        if invalid:
+            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {name}'))
+        using_clause = f' USING {using}' if using else ''
+        conn.execute(text(f'CREATE {kind} CONCURRENTLY IF NOT EXISTS {name} ON "{table}"{using_clause} '
+                          f'({column_list}){where_clause}'))
+    else:
+        conn.execute(text(f'CREATE {kind} IF NOT EXISTS {name} ON "{table}" ({column_list}){where_clause}'))
+
+
+@app.cli.command('migrate-database')
+@click.option('--to', 'target', type=int, help='Stop after this migration version')
+def migrate_database_command(target):
+    """Apply pending schema migrations (run once per deploy, before the workers start)"""
+    applied = migrate_database(target, log=print)
+    if applied:
+        print(f'Applied {len(applied)} migration(s); schema is at version {applied[-1].version:04d}')
+    else:
+        print('Schema is up to date')
+
+
+@app.cli.command('verify-database')
+def verify_database_command():
+    """Check that every migration is applied unchanged and the models match the database"""
+    with db.engine.connect() as conn:
+        applied = applied_migrations(conn)
+    for migration in discover_migrations():
+        row = applied.get(migration.version)
+        status = f"applied {row.applied_at:%Y-%m-%d %H:%M} ({row.duration_ms} ms)" if row else 'pending'
+        print(f'{migration.version:04d}_{migration.name:<32} {status}')
+    problems = verify_database()
+    for problem in problems:
+        print(f'  ! {problem}')
+    if problems:
+        sys.exit(1)
+    print('Schema is up to date')
+
+
+@app.cli.command('create-owner')
+def create_owner_command():
+    """Create the owner account, or make an existing user the owner"""
+    from .models import User
+    owner = User.query.filter_by(is_owner=True).first()
+    if owner:
+        print(f'Owner account already exists with username: {owner.username}')
+        return
+
+    username = click.prompt('Owner username')
+    existing_user = User.query.filter_by(username=username).first()
+    if existing_user:
+        existing_user.is_owner = True
+        db.session.commit()
+        print(f'User {username} has been set as the owner')
+        return
+
+    owner = User(
+        username=username,
+        email=click.prompt('Owner email'),
+        name=click.prompt('Owner name'),
+        is_owner=True,
+    )
+    owner.set_password(click.prompt('Owner password', hide_input=True, confirmation_prompt=True))
+    db.session.add(owner)
+    db.session.commit()
+    print(f'Owner account created with username: {username}')
@@ -0,0 +1,137 @@
+import datetime
+from flask import jsonify
+from .app import db
+from .models import User, CoachingAd, LiveMatch, StoreProduct
+from .fulltext import search_ranked
+from .locations import any_location_filters, location_filters
+from .pagination import keyset_paginate
+
+
+def filter_players(query, viewer_id, state='', city='', area='', role=''):
+    query = query.filter(User.id != viewer_id)
+    query = query.filter(*location_filters(User, state, city, area))
+    if role and role != 'all':
+        query = query.filter(User.cricket_role == role)
+    return query, User.id
+
+
+def _search_sort_key(query, model, search):
+    if not search:
+        return query, model.id
+    query, rank = search_ranked(query, model, search)
+    # Unranked (no search index): page on id alone
+    return query, model.id if rank is None else (rank, model.id)
+
+
+def filter_coaching(query, search='', location=''):
+    query, sort_key = _search_sort_key(query, CoachingAd, search)
+    query = query.filter(*any_location_filters(CoachingAd, location))
+    return query, sort_key
+
+
+def filter_store(query, search='', category=''):
+    query = query.filter(StoreProduct.in_stock.is_(True))
+    query, sort_key = _search_sort_key(query, StoreProduct, search)
+    if category:
+        query = query.filter(StoreProduct.category.ilike(f'%{category}%'))
+    return query, sort_key
+
+
+def filter_matches(query, search='', state='', city='', area=''):
+    query = query.filter(LiveMatch.is_live.is_(True))
+    query, sort_key = _search_sort_key(query, LiveMatch, search)
+    query = query.filter(*location_filters(LiveMatch, state, city, area))
+    return query, sort_key
+
+
+# JSON search API (/api/v1/<resource>): model, filter function, accepted
+# query parameters, fields a client may ask for and fields sent by default.
+# Player searches need at least one filter, like the HTML page.
+SEARCH_RESOURCES = {
+    'players': {
+        'model': User,
+        'filter': filter_players,
+        'params': ('state', 'city', 'area', 'role'),
+        'fields': ('id', 'username', 'name', 'age', 'gender', 'state', 'city', 'area',
+                   'cricket_role', 'availability', 'phone'),
+        'default_fields': ('id', 'name', 'cricket_role', 'city', 'area'),
+        'requires_filter': True,
+    },
+    'coaching': {
+        'model': CoachingAd,
+        'filter': filter_coaching,
+        'params': ('search', 'location'),
+        'fields': ('id', 'title', 'description', 'location', 'state', 'city', 'area', 'contact_info',
+                   'coupon_code', 'discount_percentage', 'price', 'created_at'),
+        'default_fields': ('id', 'title', 'city', 'price', 'discount_percentage'),
+    },
+    'matches': {
+        'model': LiveMatch,
+        'filter': filter_matches,
+        'params': ('search', 'state', 'city', 'area'),
+        'fields': ('id', 'title', 'description', 'youtube_url', 'match_date', 'teams', 'state', 'city',
+                   'area', 'location', 'created_at'),
+        'default_fields': ('id', 'title', 'teams', 'youtube_url', 'match_date'),
+    },
+    'store': {
+        'model': StoreProduct,
+        'filter': filter_store,
+        'params': ('search', 'category'),
+        'fields': ('id', 'name', 'description', 'price', 'category', 'image_url', 'product_url', 'created_at'),
+        'default_fields': ('id', 'name', 'price', 'category', 'image_url'),
+    },
+}
+
+
+def parse_fields(resource, fields_param):
+    """Field names from ?fields=a,b (id always first); raises ValueError for unknown names"""
+    spec = SEARCH_RESOURCES[resource]
+    if not fields_param:
+        return list(spec['default_fields'])
+    requested = [name.strip() for name in fields_param.split(',') if name.strip()]
+    unknown = [name for name in requested if name not in spec['fields']]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(spec['fields'])}")
+    return ['id'] + [name for name in dict.fromkeys(requested) if name != 'id']
+
+
+def _json_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+def run_search(resource, args, viewer_id=None):
+    """One page of a JSON API search as a compact dict: a field list plus one array per row.
+
+    Only the requested columns are selected, so no ORM objects are built and
+    no template is rendered; pages use the same keyset cursors as the HTML
+    views.
+    """
+    spec = SEARCH_RESOURCES[resource]
+    fields = parse_fields(resource, args.get('fields'))
+    params = {name: args.get(name, '').strip() for name in spec['params']}
+    result = {'version': 1, 'resource': resource, 'fields': fields, 'rows': [], 'next': None, 'prev': None}
+    if spec.get('requires_filter') and not any(params.values()):
+        return result
+
+    model = spec['model']
+    query = db.session.query(*(getattr(model, name) for name in fields))
+    if viewer_id is not None:
+        query, sort_key = spec['filter'](query, viewer_id, **params)
+    else:
+        query, sort_key = spec['filter'](query, **params)
+    page = keyset_paginate(query, sort_key, args.get('after'), args.get('before'))
+
+    rows = [item if isinstance(item, tuple) else (item,) for item in page]
+    result['rows'] = [[_json_value(value) for value in row] for row in rows]
+    result['next'] = page.next_cursor
+    result['prev'] = page.prev_cursor
+    return result
+
+
+def search_response(resource, args, viewer_id=None):
+    try:
+        return jsonify(run_search(resource, args, viewer_id))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
@@ -0,0 +1,249 @@
+import datetime
+import hashlib
+import json
+import logging
+import os
+import secrets
+import time
+import zlib
+import click
+from .app import app
+from .backup import BACKUP_DIR, online_backup
+
+logger = logging.getLogger(__name__)
+
+# Chunk size of the store; a multiple of the SQLite page size so a changed
+# page only dirties the chunk it lives in
+app.config.setdefault('SNAPSHOT_CHUNK_SIZE', int(os.environ.get('SNAPSHOT_CHUNK_SIZE', 64 * 1024)))
+# Retention: the newest N snapshots, plus the newest one of each of the last
+# N days and N ISO weeks
+app.config.setdefault('SNAPSHOT_KEEP_LAST', int(os.environ.get('SNAPSHOT_KEEP_LAST', 10)))
+app.config.setdefault('SNAPSHOT_KEEP_DAILY', int(os.environ.get('SNAPSHOT_KEEP_DAILY', 7)))
+app.config.setdefault('SNAPSHOT_KEEP_WEEKLY', int(os.environ.get('SNAPSHOT_KEEP_WEEKLY', 4)))
+
+STORE_DIR = os.path.join(BACKUP_DIR, 'store')
+CHUNK_DIR = os.path.join(STORE_DIR, 'chunks')
+MANIFEST_DIR = os.path.join(STORE_DIR, 'snapshots')
+
+# Unreferenced chunks younger than this are left alone by garbage collection,
+# so a snapshot being written concurrently never loses a chunk it just reused
+GC_GRACE_SECONDS = 3600
+
+
+def _chunk_path(digest):
+    return os.path.join(CHUNK_DIR, digest[:2], digest)
+
+
+def _write_atomically(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.{secrets.token_hex(4)}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def _store_chunk(chunk):
+    """Store a chunk under its SHA-256; returns (digest, bytes written)"""
+    digest = hashlib.sha256(chunk).hexdigest()
+    path = _chunk_path(digest)
+    if os.path.exists(path):
+        # Refresh the mtime so a concurrent garbage collection keeps it
+        os.utime(path)
+        return digest, 0
+    data = zlib.compress(chunk)
+    _write_atomically(path, data)
+    return digest, len(data)
+
+
+def take_snapshot(label):
+    """Store a consistent snapshot of the database; only chunks not already in the store are written"""
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+    now = datetime.datetime.now()
+    snapshot_id = f"{now.strftime('%Y%m%d_%H%M%S')}_{secrets.token_hex(3)}"
+    chunk_size = app.config['SNAPSHOT_CHUNK_SIZE']
+
+    # The page-stepped backup API keeps the page layout of the source, so
+    # unchanged pages produce identical chunks (VACUUM INTO would not)
+    temp_path = os.path.join(STORE_DIR, f'.{snapshot_id}.db')
+    try:
+        info = online_backup(temp_path, method='backup')
+        chunks, new_chunks, stored_bytes = [], 0, 0
+        with open(temp_path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                digest, written = _store_chunk(chunk)
+                chunks.append(digest)
+                if written:
+                    new_chunks += 1
+                    stored_bytes += written
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    manifest = {
+        'id': snapshot_id,
+        'label': label,
+        'created_at': now.isoformat(timespec='seconds'),
+        'chunk_size': chunk_size,
+        'size_bytes': info['size_bytes'],
+        'chunks': chunks,
+        'new_chunks': new_chunks,
+        'stored_bytes': stored_bytes,
+    }
+    _write_atomically(os.path.join(MANIFEST_DIR, f'{snapshot_id}.json'), json.dumps(manifest).encode())
+    logger.info('Snapshot %s (%s): %d of %d chunks new, %d bytes stored',
+                snapshot_id, label, new_chunks, len(chunks), stored_bytes)
+    return manifest
+
+
+def list_snapshots():
+    """Manifests of all snapshots, newest first"""
+    if not os.path.isdir(MANIFEST_DIR):
+        return []
+    manifests = []
+    for filename in os.listdir(MANIFEST_DIR):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(MANIFEST_DIR, filename)) as f:
+                manifests.append(json.load(f))
+        except (OSError, ValueError):
+            logger.warning('Skipping unreadable snapshot manifest %s', filename)
+    manifests.sort(key=lambda manifest: manifest['id'], reverse=True)
+    return manifests
+
+
+def get_snapshot(snapshot_id):
+    for manifest in list_snapshots():
+        if manifest['id'] == snapshot_id:
+            return manifest
+    return None
+
+
+def iter_snapshot(manifest):
+    """Yield the database file of a snapshot chunk by chunk, verifying every chunk"""
+    for digest in manifest['chunks']:
+        with open(_chunk_path(digest), 'rb') as f:
+            chunk = zlib.decompress(f.read())
+        if hashlib.sha256(chunk).hexdigest() != digest:
+            raise ValueError(f"Snapshot {manifest['id']}: chunk {digest} is corrupt")
+        yield chunk
+
+
+def export_snapshot(manifest, dest_path):
+    """Reconstruct a snapshot into a standalone database file"""
+    temp_path = f'{dest_path}.tmp'
+    with open(temp_path, 'wb') as f:
+        for chunk in iter_snapshot(manifest):
+            f.write(chunk)
+    os.replace(temp_path, dest_path)
+    return dest_path
+
+
+def _retained_ids(manifests):
+    keep_last = app.config['SNAPSHOT_KEEP_LAST']
+    keep_daily = app.config['SNAPSHOT_KEEP_DAILY']
+    keep_weekly = app.config['SNAPSHOT_KEEP_WEEKLY']
+
+    retained = {manifest['id'] for manifest in manifests[:keep_last]}
+    days, weeks = set(), set()
+    for manifest in manifests:
+        created = datetime.datetime.fromisoformat(manifest['created_at'])
+        day, week = created.date(), created.isocalendar()[:2]
+        if day not in days and len(days) < keep_daily:
+            days.add(day)
+            retained.add(manifest['id'])
+        if week not in weeks and len(weeks) < keep_weekly:
+            weeks.add(week)
+            retained.add(manifest['id'])
+    return retained
+
+
+def prune_snapshots():
+    """Apply the retention policy, then delete chunks no remaining snapshot uses.
+
+    Returns (snapshots removed, chunks removed, bytes freed).
+    """
+    manifests = list_snapshots()
+    retained = _retained_ids(manifests)
+    removed = 0
+    referenced = set()
+    for manifest in manifests:
+        if manifest['id'] in retained:
+            referenced.update(manifest['chunks'])
+        else:
+            os.remove(os.path.join(MANIFEST_DIR, f"{manifest['id']}.json"))
+            removed += 1
+
+    chunks_removed = bytes_freed = 0
+    cutoff = time.time() - GC_GRACE_SECONDS
+    if os.path.isdir(CHUNK_DIR):
+        for prefix in os.listdir(CHUNK_DIR):
+            prefix_dir = os.path.join(CHUNK_DIR, prefix)
+            for filename in os.listdir(prefix_dir):
+                path = os.path.join(prefix_dir, filename)
+                if filename in referenced or os.path.getmtime(path) > cutoff:
+                    continue
+                bytes_freed += os.path.getsize(path)
+                os.remove(path)
+                chunks_removed += 1
+    return removed, chunks_removed, bytes_freed
+
+
+def store_size():
+    """Bytes used by the chunk store on disk"""
+    total = 0
+    if os.path.isdir(CHUNK_DIR):
+        for prefix in os.listdir(CHUNK_DIR):
+            prefix_dir = os.path.join(CHUNK_DIR, prefix)
+            total += sum(os.path.getsize(os.path.join(prefix_dir, name)) for name in os.listdir(prefix_dir))
+    return total
+
+
+def safety_snapshot(label):
+    """Snapshot taken before a destructive action, followed by retention"""
+    manifest = take_snapshot(label)
+    try:
+        prune_snapshots()
+    except OSError:
+        logger.exception('Snapshot pruning failed')
+    return manifest
+
+
+@app.cli.command('snapshot-database')
+@click.argument('label', default='manual')
+def snapshot_database_command(label):
+    """Add a deduplicated snapshot of the database to the backup store"""
+    manifest = safety_snapshot(label)
+    print(f"{manifest['id']}: {len(manifest['chunks'])} chunks, {manifest['new_chunks']} new, "
+          f"{manifest['stored_bytes']} bytes stored")
+
+
+@app.cli.command('list-snapshots')
+def list_snapshots_command():
+    """List the snapshots in the backup store"""
+    for manifest in list_snapshots():
+        print(f"{manifest['id']}  {manifest['created_at']}  {manifest['label']:<24} "
+              f"{manifest['size_bytes']:>12} bytes  {manifest['new_chunks']} new chunks")
+    print(f'Store size: {store_size()} bytes')
+
+
+@app.cli.command('export-snapshot')
+@click.argument('snapshot_id')
+@click.argument('dest_path')
+def export_snapshot_command(snapshot_id, dest_path):
+    """Reconstruct a snapshot into a standalone database file"""
+    manifest = get_snapshot(snapshot_id)
+    if manifest is None:
+        raise click.ClickException(f'No snapshot {snapshot_id}')
+    export_snapshot(manifest, dest_path)
+    print(f'Wrote {dest_path}')
+
+
+@app.cli.command('prune-snapshots')
+def prune_snapshots_command():
+    """Apply the snapshot retention policy and garbage-collect unused chunks"""
+    removed, chunks_removed, bytes_freed = prune_snapshots()
+    print(f'Removed {removed} snapshots and {chunks_removed} chunks ({bytes_freed} bytes)')
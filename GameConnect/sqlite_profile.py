@@ -0,0 +1,114 @@
+import functools
+import logging
+import os
+import re
+import sqlite3
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from .app import app, db
+
+logger = logging.getLogger(__name__)
+
+# Named PRAGMA sets applied to every new SQLite connection. WAL lets readers
+# carry on while a writer commits (the rollback journal blocks them), and
+# synchronous=NORMAL is durable against application crashes in WAL mode.
+# foreign_keys stays off outside "strict": existing rows and truncate_table
+# rely on it not being enforced.
+SQLITE_PROFILES = {
+    # SQLite's own defaults (rollback journal)
+    'default': {},
+    'balanced': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -32000,          # KiB, i.e. 32 MB per connection
+        'mmap_size': 134217728,        # 128 MB
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+        'foreign_keys': 'OFF',
+    },
+    'throughput': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -131072,         # 128 MB
+        'mmap_size': 1073741824,       # 1 GB
+        'temp_store': 'MEMORY',
+        'busy_timeout': 10000,
+        'foreign_keys': 'OFF',
+        'wal_autocheckpoint': 4000,
+    },
+    'strict': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'cache_size': -32000,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+        'foreign_keys': 'ON',
+    },
+}
+
+app.config.setdefault('SQLITE_PROFILE', os.environ.get('SQLITE_PROFILE', 'balanced'))
+# Individual overrides on top of the profile, e.g. "cache_size=-64000,mmap_size=0"
+app.config.setdefault('SQLITE_PRAGMAS', os.environ.get('SQLITE_PRAGMAS', ''))
+
+# Settings shown on the database management page
+REPORTED_PRAGMAS = ('journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store',
+                    'busy_timeout', 'foreign_keys', 'wal_autocheckpoint')
+
+_ALLOWED_PRAGMAS = set(REPORTED_PRAGMAS)
+_VALUE_PATTERN = re.compile(r'^-?\w+$')
+
+_SYNCHRONOUS_NAMES = {0: 'OFF', 1: 'NORMAL', 2: 'FULL', 3: 'EXTRA'}
+_TEMP_STORE_NAMES = {0: 'DEFAULT', 1: 'FILE', 2: 'MEMORY'}
+
+
+def profile_pragmas():
+    """(name, value) pairs for the configured profile plus overrides; journal_mode first"""
+    return _resolve_pragmas(app.config['SQLITE_PROFILE'], app.config['SQLITE_PRAGMAS'])
+
+
+@functools.lru_cache(maxsize=8)
+def _resolve_pragmas(name, overrides):
+    if name not in SQLITE_PROFILES:
+        logger.warning('Unknown SQLITE_PROFILE %r; using "default"', name)
+        name = 'default'
+    pragmas = dict(SQLITE_PROFILES[name])
+
+    for item in filter(None, (part.strip() for part in overrides.split(','))):
+        key, _, value = item.partition('=')
+        key, value = key.strip().lower(), value.strip()
+        # Values are interpolated into PRAGMA statements, so only accept known names and plain tokens
+        if key not in _ALLOWED_PRAGMAS or not _VALUE_PATTERN.match(value):
+            logger.warning('Ignoring SQLITE_PRAGMAS entry %r', item)
+            continue
+        pragmas[key] = value
+
+    return tuple(sorted(pragmas.items(), key=lambda item: item[0] != 'journal_mode'))
+
+
+@event.listens_for(Engine, 'connect')
+def _apply_profile(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in profile_pragmas():
+            cursor.execute(f'PRAGMA {name}={value}')
+    finally:
+        cursor.close()
+
+
+def current_settings():
+    """Profile name and the effective PRAGMA values of a pooled connection, or None if not SQLite"""
+    with db.engine.connect() as conn:
+        if conn.dialect.name != 'sqlite':
+            return None
+        values = {name: conn.exec_driver_sql(f'PRAGMA {name}').scalar() for name in REPORTED_PRAGMAS}
+
+    values['synchronous'] = _SYNCHRONOUS_NAMES.get(values['synchronous'], values['synchronous'])
+    values['temp_store'] = _TEMP_STORE_NAMES.get(values['temp_store'], values['temp_store'])
+    values['foreign_keys'] = 'ON' if values['foreign_keys'] else 'OFF'
+    cache_size = values['cache_size']
+    values['cache_size'] = f'{-cache_size} KiB' if cache_size < 0 else f'{cache_size} pages'
+    values['mmap_size'] = f"{values['mmap_size'] // (1024 * 1024)} MB" if values['mmap_size'] else 'off'
+    values['busy_timeout'] = f"{values['busy_timeout']} ms"
+    return {'profile': app.config['SQLITE_PROFILE'], 'settings': values}
@@ -0,0 +1,113 @@
+/**
+ * Live match updates for the public matches page.
+ *
+ * Listens to the server-sent event feed (/matches/stream) for the page's
+ * state/city/area filter and patches the list in place:
+ *   match    - a card to add, or to replace when it is already shown
+ *   removed  - a match that was deleted or is no longer live
+ *   snapshot - every visible live match, sent when the events since the
+ *              page was rendered can't be replayed
+ * Cards are listed newest (highest id) first. New cards are only inserted
+ * on the first page of a search without search text; elsewhere, and for
+ * matches older than the page, a notice offers a refresh instead.
+ */
+
+document.addEventListener('DOMContentLoaded', function() {
+    const list = document.getElementById('live-matches');
+    if (!list || !list.dataset.feedUrl || !window.EventSource) {
+        return;
+    }
+
+    const canInsert = list.dataset.insert === 'true';
+    const notice = document.getElementById('live-match-notice');
+    const count = document.getElementById('live-match-count');
+
+    function cards() {
+        return Array.from(list.querySelectorAll('[data-match-id]'));
+    }
+
+    function findCard(id) {
+        return list.querySelector('[data-match-id="' + id + '"]');
+    }
+
+    function buildCard(html) {
+        const template = document.createElement('template');
+        template.innerHTML = html.trim();
+        return template.content.firstElementChild;
+    }
+
+    function updateCount() {
+        const shown = cards().length;
+        if (count) {
+            count.textContent = shown;
+        }
+        const empty = list.querySelector('[data-empty-state]');
+        if (empty) {
+            empty.classList.toggle('d-none', shown > 0);
+        }
+    }
+
+    function showNotice() {
+        if (notice) {
+            notice.classList.remove('d-none');
+        }
+    }
+
+    function upsert(match) {
+        const existing = findCard(match.id);
+        if (existing) {
+            existing.replaceWith(buildCard(match.html));
+            return;
+        }
+        const shown = cards();
+        const lastId = shown.length ? Number(shown[shown.length - 1].dataset.matchId) : 0;
+        if (!canInsert || match.id < lastId) {
+            // Older than the oldest card shown: it belongs on a later page
+            showNotice();
+            return;
+        }
+        const card = buildCard(match.html);
+        const older = shown.find(function(existing) {
+            return Number(existing.dataset.matchId) < match.id;
+        });
+        if (older) {
+            older.before(card);
+        } else {
+            list.prepend(card);
+        }
+    }
+
+    function remove(id) {
+        const card = findCard(id);
+        if (card) {
+            card.remove();
+        }
+    }
+
+    const source = new EventSource(list.dataset.feedUrl);
+
+    source.addEventListener('match', function(event) {
+        upsert(JSON.parse(event.data));
+        updateCount();
+    });
+
+    source.addEventListener('removed', function(event) {
+        remove(JSON.parse(event.data).id);
+        updateCount();
+    });
+
+    source.addEventListener('snapshot', function(event) {
+        const data = JSON.parse(event.data);
+        const live = new Set(data.matches.map(function(match) { return match.id; }));
+        const oldest = data.matches.length ? data.matches[0].id : Infinity;
+        cards().forEach(function(card) {
+            const id = Number(card.dataset.matchId);
+            // An incomplete snapshot only covers the newest matches
+            if (!live.has(id) && (data.complete || id >= oldest)) {
+                card.remove();
+            }
+        });
+        data.matches.forEach(upsert);
+        updateCount();
+    });
+});
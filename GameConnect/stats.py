@@ -0,0 +1,261 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from sqlalchemy import case, delete, event, func, inspect, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, object_session
+from .app import app, db
+from .models import User, Admin, Follow, CoachingAd, LiveMatch, StoreProduct, ProfileView, PlatformStat
+
+logger = logging.getLogger(__name__)
+
+app.config.setdefault('STATS_RECONCILE_INTERVAL', int(os.environ.get('STATS_RECONCILE_INTERVAL', 600)))
+
+# Catalog tables that are also counted per creating admin
+CATALOG_MODELS = (CoachingAd, LiveMatch, StoreProduct)
+
+# Attributes each model's counters depend on (see _stat_keys)
+TRACKED_ATTRIBUTES = {
+    User: ('is_active', 'gender'),
+    Admin: ('is_approved',),
+    Follow: (),
+    ProfileView: (),
+    CoachingAd: ('created_by',),
+    LiveMatch: ('created_by',),
+    StoreProduct: ('created_by',),
+}
+
+# Holds the unix time of the last full reconciliation
+RECONCILED_AT_KEY = '_reconciled_at'
+
+# Per catalog table: bumped by every insert, update and delete (see generation_key)
+GENERATION_SUFFIX = '.generation'
+
+_UPSERT_BY_DIALECT = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert,
+}
+
+
+def _stat_keys(model, values):
+    """Counter keys a row with the given attribute values contributes +1 to"""
+    table = model.__table__.name
+    keys = [f'{table}.total']
+    if model is User:
+        if values['is_active'] is True:
+            keys.append('user.active')
+        keys.append(f"user.gender.{values['gender'] or 'unspecified'}")
+    elif model is Admin:
+        keys.append('admin.approved' if values['is_approved'] else 'admin.pending')
+    elif model in CATALOG_MODELS and values['created_by'] is not None:
+        keys.append(f"{table}.admin.{values['created_by']}")
+    return keys
+
+
+def generation_key(model):
+    """Counter that changes whenever a row of a catalog model is written; never reconciled"""
+    return f'{model.__table__.name}{GENERATION_SUFFIX}'
+
+
+def _current_values(model, target):
+    return {attribute: getattr(target, attribute) for attribute in TRACKED_ATTRIBUTES[model]}
+
+
+def _previous_values(model, target):
+    state = inspect(target)
+    values = {}
+    for attribute in TRACKED_ATTRIBUTES[model]:
+        history = state.attrs[attribute].history
+        values[attribute] = history.deleted[0] if history.deleted else getattr(target, attribute)
+    return values
+
+
+def _record_delta(target, keys, amount):
+    session = object_session(target)
+    if session is None:
+        return
+    deltas = session.info.setdefault('stat_deltas', Counter())
+    for key in keys:
+        deltas[key] += amount
+
+
+def _on_insert(mapper, connection, target):
+    model = mapper.class_
+    _record_delta(target, _stat_keys(model, _current_values(model, target)), 1)
+    if model in CATALOG_MODELS:
+        _record_delta(target, [generation_key(model)], 1)
+
+
+def _on_delete(mapper, connection, target):
+    model = mapper.class_
+    _record_delta(target, _stat_keys(model, _previous_values(model, target)), -1)
+    if model in CATALOG_MODELS:
+        _record_delta(target, [generation_key(model)], 1)
+
+
+def _on_update(mapper, connection, target):
+    model = mapper.class_
+    # Any edit (a match going live, a price change) changes what the catalog shows
+    if model in CATALOG_MODELS and object_session(target).is_modified(target, include_collections=False):
+        _record_delta(target, [generation_key(model)], 1)
+    if not TRACKED_ATTRIBUTES[model]:
+        return
+    before = _stat_keys(model, _previous_values(model, target))
+    after = _stat_keys(model, _current_values(model, target))
+    if before != after:
+        _record_delta(target, before, -1)
+        _record_delta(target, after, 1)
+
+
+for _model in TRACKED_ATTRIBUTES:
+    event.listen(_model, 'after_insert', _on_insert)
+    event.listen(_model, 'after_delete', _on_delete)
+    event.listen(_model, 'after_update', _on_update)
+
+
+def apply_stat_deltas(connection, deltas):
+    """Add a Counter of changes to the stored counters, one upsert per key"""
+    rows = [{'key': key, 'value': amount} for key, amount in deltas.items() if amount]
+    if not rows:
+        return
+
+    insert = _UPSERT_BY_DIALECT.get(connection.dialect.name)
+    if insert is not None:
+        statement = insert(PlatformStat)
+        statement = statement.on_conflict_do_update(
+            index_elements=['key'],
+            set_={'value': PlatformStat.value + statement.excluded.value},
+        )
+        connection.execute(statement, rows)
+        return
+
+    for row in rows:
+        result = connection.execute(
+            update(PlatformStat).where(PlatformStat.key == row['key'])
+            .values(value=PlatformStat.value + row['value'])
+        )
+        if result.rowcount == 0:
+            connection.execute(PlatformStat.__table__.insert().values(**row))
+
+
+@event.listens_for(Session, 'after_flush')
+def _apply_flush_deltas(session, flush_context):
+    """Apply the flush's counter changes in the same transaction"""
+    deltas = session.info.pop('stat_deltas', None)
+    if deltas:
+        apply_stat_deltas(session.connection(), deltas)
+
+
+def count_bulk_inserts(model, rows):
+    """Counter changes for rows inserted with Core, which mapper events don't see"""
+    deltas = Counter()
+    for row in rows:
+        for key in _stat_keys(model, {attribute: row.get(attribute) for attribute in TRACKED_ATTRIBUTES[model]}):
+            deltas[key] += 1
+    if rows and model in CATALOG_MODELS:
+        deltas[generation_key(model)] += 1
+    return deltas
+
+
+def bump_generations(connection, *models):
+    """Record a bulk UPDATE or DELETE of catalog models, which mapper events don't see"""
+    apply_stat_deltas(connection, Counter(generation_key(model) for model in models if model in CATALOG_MODELS))
+
+
+def compute_stats():
+    """Count everything from scratch with one grouped query per table"""
+    values = Counter()
+
+    total, active = db.session.query(
+        func.count(User.id), func.sum(case((User.is_active.is_(True), 1), else_=0))
+    ).one()
+    values['user.total'] = total
+    values['user.active'] = active or 0
+    for gender, count in db.session.query(User.gender, func.count(User.id)).group_by(User.gender):
+        values[f"user.gender.{gender or 'unspecified'}"] += count
+
+    for is_approved, count in db.session.query(Admin.is_approved, func.count(Admin.id)).group_by(Admin.is_approved):
+        values['admin.total'] += count
+        values['admin.approved' if is_approved else 'admin.pending'] += count
+
+    values['follow.total'] = db.session.query(func.count(Follow.id)).scalar()
+    values['profile_view.total'] = db.session.query(func.count(ProfileView.id)).scalar()
+
+    for model in CATALOG_MODELS:
+        table = model.__table__.name
+        values[f'{table}.total'] = 0
+        for created_by, count in db.session.query(model.created_by, func.count(model.id)).group_by(model.created_by):
+            values[f'{table}.total'] += count
+            if created_by is not None:
+                values[f'{table}.admin.{created_by}'] = count
+
+    return values
+
+
+def reconcile_stats():
+    """Replace every counter with freshly computed values in one transaction (generations are kept)"""
+    values = compute_stats()
+    values[RECONCILED_AT_KEY] = int(time.time())
+    db.session.execute(delete(PlatformStat).where(PlatformStat.key.not_like(f'%{GENERATION_SUFFIX}')))
+    db.session.execute(PlatformStat.__table__.insert(), [
+        {'key': key, 'value': value} for key, value in values.items()
+    ])
+    db.session.commit()
+    return values
+
+
+class PlatformStats:
+    """Read side: one SELECT of the counter table, reconciled in the background when stale"""
+
+    def __init__(self):
+        self._reconciling = False
+        self._lock = threading.Lock()
+
+    def _after_fork(self):
+        # A reconcile thread running in the parent doesn't exist in a forked worker
+        self._reconciling = False
+        self._lock = threading.Lock()
+
+    def get(self, *keys):
+        """Return a Counter of the requested keys (all keys if none given); missing keys read as 0"""
+        query = select(PlatformStat.key, PlatformStat.value)
+        if keys:
+            query = query.where(PlatformStat.key.in_(keys + (RECONCILED_AT_KEY,)))
+        values = Counter(dict(db.session.execute(query).all()))
+
+        reconciled_at = values.pop(RECONCILED_AT_KEY, 0)
+        # Migrations take the first reconciliation (0010), so a missing one is
+        # caught up in the background like a stale one, against the primary
+        if time.time() - reconciled_at > app.config['STATS_RECONCILE_INTERVAL']:
+            self._reconcile_in_background()
+        return values
+
+    def _reconcile_in_background(self):
+        with self._lock:
+            if self._reconciling:
+                return
+            self._reconciling = True
+
+        def run():
+            try:
+                with app.app_context():
+                    reconcile_stats()
+            except Exception:
+                logger.exception('Statistics reconciliation failed')
+            finally:
+                self._reconciling = False
+
+        threading.Thread(target=run, name='stats-reconcile', daemon=True).start()
+
+
+platform_stats = PlatformStats()
+os.register_at_fork(after_in_child=platform_stats._after_fork)
+
+
+@app.cli.command('reconcile-stats')
+def reconcile_stats_command():
+    """Recompute the materialized dashboard counters"""
+    values = reconcile_stats()
+    print(f'Reconciled {len(values) - 1} counters')
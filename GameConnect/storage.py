@@ -0,0 +1,199 @@
+import logging
+import os
+import threading
+import time
+from .app import app, db
+
+logger = logging.getLogger(__name__)
+
+app.config.setdefault('STORAGE_STATS_TTL', int(os.environ.get('STORAGE_STATS_TTL', 60)))
+
+# Suffixes of the search index tables created by fulltext.py; their pages are
+# reported as index space of the table they index
+_SEARCH_INDEX_SUFFIXES = ('_fts', '_trigram')
+
+# Free pages or slack inside pages above these ratios make VACUUM worthwhile,
+# provided there is enough space to reclaim at all
+FREE_PAGE_THRESHOLD = 0.10
+UNUSED_SPACE_THRESHOLD = 0.25
+MIN_RECLAIMABLE_BYTES = 1024 * 1024
+
+_cache = {'report': None, 'expires': 0.0}
+_cache_lock = threading.Lock()
+
+
+@app.template_filter('filesize')
+def format_bytes(size):
+    """Human readable byte count, e.g. 12.3 KB"""
+    if size is None:
+        return 'Unknown'
+    if size < 1024:
+        return f"{size} bytes"
+    if size < 1024 * 1024:
+        return f"{size / 1024:.1f} KB"
+    if size < 1024 * 1024 * 1024:
+        return f"{size / (1024 * 1024):.1f} MB"
+    return f"{size / (1024 * 1024 * 1024):.2f} GB"
+
+
+def _search_index_owner(name, tables):
+    for suffix in _SEARCH_INDEX_SUFFIXES:
+        marker = suffix + '_'
+        base = name[:name.index(marker)] if marker in name else (name[:-len(suffix)] if name.endswith(suffix) else None)
+        if base in tables:
+            return base
+    return None
+
+
+def _new_table_entry(name):
+    return {'name': name, 'data_bytes': 0, 'index_bytes': 0, 'unused_bytes': 0, 'indexes': []}
+
+
+def _sqlite_report(conn):
+    page_size = conn.exec_driver_sql('PRAGMA page_size').scalar()
+    page_count = conn.exec_driver_sql('PRAGMA page_count').scalar()
+    freelist_count = conn.exec_driver_sql('PRAGMA freelist_count').scalar()
+
+    objects = conn.exec_driver_sql(
+        "SELECT name, type, tbl_name FROM sqlite_master WHERE type IN ('table', 'index')"
+    ).all()
+    owners = {name: tbl_name for name, _, tbl_name in objects}
+    kinds = {name: kind for name, kind, _ in objects}
+    tables = {name: _new_table_entry(name) for name, kind, _ in objects
+              if kind == 'table' and not name.startswith('sqlite_')}
+
+    # One aggregated pass over every b-tree in the file
+    usage = conn.exec_driver_sql(
+        'SELECT name, pgsize, unused FROM dbstat WHERE aggregate = TRUE'
+    ).all()
+
+    for name, size, unused in usage:
+        search_owner = _search_index_owner(name, tables)
+        if search_owner and search_owner != name:
+            entry = tables[search_owner]
+            entry['index_bytes'] += size
+            entry['indexes'].append({'name': name, 'bytes': size})
+        elif kinds.get(name) == 'index' and owners.get(name) in tables:
+            entry = tables[owners[name]]
+            entry['index_bytes'] += size
+            entry['indexes'].append({'name': name, 'bytes': size})
+        elif name in tables:
+            entry = tables[name]
+            entry['data_bytes'] += size
+        else:
+            continue
+        entry['unused_bytes'] += unused or 0
+
+    # Search index tables are folded into their owners
+    for name in [name for name in tables if _search_index_owner(name, tables) not in (None, name)]:
+        del tables[name]
+
+    file_bytes = page_size * page_count
+    used_bytes = sum(entry['data_bytes'] + entry['index_bytes'] for entry in tables.values())
+    unused_bytes = sum(entry['unused_bytes'] for entry in tables.values())
+    return {
+        'dialect': 'sqlite',
+        'page_size': page_size,
+        'page_count': page_count,
+        'free_pages': freelist_count,
+        'file_bytes': file_bytes,
+        'free_bytes': freelist_count * page_size,
+        'reclaimable_bytes': freelist_count * page_size + unused_bytes,
+        'free_ratio': freelist_count / page_count if page_count else 0.0,
+        'unused_ratio': unused_bytes / used_bytes if used_bytes else 0.0,
+        'tables': tables,
+    }
+
+
+def _postgresql_report(conn):
+    rows = conn.exec_driver_sql(
+        "SELECT c.relname, pg_table_size(c.oid), pg_indexes_size(c.oid), "
+        "coalesce(s.n_dead_tup, 0), coalesce(s.n_live_tup, 0) "
+        "FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid "
+        "WHERE c.relkind = 'r' AND n.nspname = current_schema()"
+    ).all()
+    tables = {}
+    dead_tuples = live_tuples = 0
+    for name, data_bytes, index_bytes, dead, live in rows:
+        entry = _new_table_entry(name)
+        entry['data_bytes'], entry['index_bytes'] = data_bytes, index_bytes
+        tables[name] = entry
+        dead_tuples += dead
+        live_tuples += live
+
+    indexes = conn.exec_driver_sql(
+        "SELECT t.relname, i.relname, pg_relation_size(i.oid) "
+        "FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid "
+        "JOIN pg_class t ON t.oid = x.indrelid "
+        "JOIN pg_namespace n ON n.oid = t.relnamespace WHERE n.nspname = current_schema()"
+    ).all()
+    for table, index, size in indexes:
+        if table in tables:
+            tables[table]['indexes'].append({'name': index, 'bytes': size})
+
+    file_bytes = conn.exec_driver_sql('SELECT pg_database_size(current_database())').scalar()
+    total_tuples = dead_tuples + live_tuples
+    return {
+        'dialect': 'postgresql',
+        'page_size': 8192,
+        'page_count': None,
+        'free_pages': None,
+        'file_bytes': file_bytes,
+        'free_bytes': None,
+        'reclaimable_bytes': None,
+        # Dead tuples are PostgreSQL's equivalent of reclaimable space
+        'free_ratio': dead_tuples / total_tuples if total_tuples else 0.0,
+        'unused_ratio': 0.0,
+        'tables': tables,
+    }
+
+
+def collect_storage_report():
+    """Measure real per-table and per-index sizes plus free space, in one pass"""
+    with db.engine.connect() as conn:
+        dialect = conn.dialect.name
+        if dialect == 'sqlite':
+            report = _sqlite_report(conn)
+        elif dialect == 'postgresql':
+            report = _postgresql_report(conn)
+        else:
+            return None
+
+    for entry in report['tables'].values():
+        entry['total_bytes'] = entry['data_bytes'] + entry['index_bytes']
+        entry['index_ratio'] = entry['index_bytes'] / entry['data_bytes'] if entry['data_bytes'] else None
+        entry['indexes'].sort(key=lambda index: -index['bytes'])
+
+    fragmented = report['free_ratio'] > FREE_PAGE_THRESHOLD or report['unused_ratio'] > UNUSED_SPACE_THRESHOLD
+    report['optimize_recommended'] = fragmented and (
+        report['reclaimable_bytes'] is None or report['reclaimable_bytes'] >= MIN_RECLAIMABLE_BYTES
+    )
+    report['collected_at'] = time.time()
+    return report
+
+
+def get_storage_report():
+    """Storage report cached for STORAGE_STATS_TTL seconds; None if it can't be gathered"""
+    now = time.monotonic()
+    with _cache_lock:
+        if _cache['expires'] > now:
+            return _cache['report']
+
+    try:
+        report = collect_storage_report()
+    except Exception as e:
+        # e.g. SQLite compiled without the dbstat virtual table
+        logger.warning('Storage statistics unavailable: %s', e)
+        report = None
+
+    with _cache_lock:
+        _cache['report'] = report
+        _cache['expires'] = now + app.config['STORAGE_STATS_TTL']
+    return report
+
+
+def invalidate_storage_report():
+    with _cache_lock:
+        _cache['report'] = None
+        _cache['expires'] = 0.0
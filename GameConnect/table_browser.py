@@ -0,0 +1,141 @@
+import datetime
+import os
+import re
+from sqlalchemy import Boolean, DateTime, Float, Integer, UniqueConstraint, func, select
+from .app import app, db
+from .models import User, Admin, Follow, CoachingAd, LiveMatch, StoreProduct, ProfileView
+from .pagination import keyset_paginate
+from .stats import platform_stats
+
+app.config.setdefault('TABLE_VIEW_PAGE_SIZE', int(os.environ.get('TABLE_VIEW_PAGE_SIZE', 50)))
+app.config.setdefault('TABLE_VIEW_MAX_PAGE_SIZE', int(os.environ.get('TABLE_VIEW_MAX_PAGE_SIZE', 500)))
+
+# Tables the owner can browse on the database management page
+BROWSABLE_MODELS = {
+    'user': User,
+    'admin': Admin,
+    'follow': Follow,
+    'coaching_ad': CoachingAd,
+    'live_match': LiveMatch,
+    'store_product': StoreProduct,
+    'profile_view': ProfileView,
+}
+
+# Filtered result counts stop here and are reported as "at least"
+COUNT_CAP = 1000
+
+def resolve_table(table_name):
+    """Model for a table name given as snake_case or CamelCase, or None"""
+    snake_case = re.sub(r'(?<!^)(?=[A-Z])', '_', table_name).lower()
+    return BROWSABLE_MODELS.get(table_name) or BROWSABLE_MODELS.get(snake_case)
+
+
+def sortable_columns(model):
+    """Names of NOT NULL columns with an index that can serve ORDER BY ... LIMIT without a full sort.
+
+    Nullable columns are left out: a keyset page can't seek past a NULL
+    cursor value, so paging through the NULLs would scan them.
+    """
+    table = model.__table__
+    names = {column.name for column in table.primary_key.columns}
+    names.update(column.name for column in table.columns if column.index or column.unique)
+    unique_constraints = [constraint for constraint in table.constraints if isinstance(constraint, UniqueConstraint)]
+    for index in list(table.indexes) + unique_constraints:
+        # A composite index can serve ordering by its leading column
+        columns = list(index.columns)
+        if columns:
+            names.add(columns[0].name)
+    return {name for name in names if not table.columns[name].nullable}
+
+
+def describe_columns(model):
+    sortable = sortable_columns(model)
+    return [{
+        'name': column.name,
+        'type': type(column.type).__name__.lower(),
+        'sortable': column.name in sortable,
+    } for column in model.__table__.columns]
+
+
+def _column_filter(column, value):
+    """WHERE clause for a per-column filter box; raises ValueError for unusable input"""
+    column_type = column.type
+    if isinstance(column_type, Boolean):
+        lowered = value.lower()
+        if lowered not in ('true', 'false', '1', '0', 'yes', 'no'):
+            raise ValueError(f'{column.name}: use true or false')
+        return column.is_(lowered in ('true', '1', 'yes'))
+    if isinstance(column_type, Integer):
+        try:
+            return column == int(value)
+        except ValueError:
+            raise ValueError(f'{column.name}: expected a whole number')
+    if isinstance(column_type, Float):
+        try:
+            return column == float(value)
+        except ValueError:
+            raise ValueError(f'{column.name}: expected a number')
+    if isinstance(column_type, DateTime):
+        # A date (or date and time) prefix selects everything within it
+        try:
+            start = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            raise ValueError(f'{column.name}: expected a date like 2024-05-01')
+        span = datetime.timedelta(days=1) if len(value) <= 10 else datetime.timedelta(minutes=1)
+        return column.between(start, start + span - datetime.timedelta(microseconds=1))
+    return column.ilike(f'%{value}%')
+
+
+def _serialize(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat(sep=' ')
+    return value
+
+
+def browse_table(model, sort=None, direction='asc', filters=None, after=None, before=None, per_page=None):
+    """One page of a table as JSON-ready data.
+
+    Pages are keyset ranges over (sort column, primary key) and only indexed
+    columns can be sorted on, so fetching a page costs the same at row 10 and
+    at row 10 million. The total comes from the materialized counters when
+    unfiltered and from a count capped at COUNT_CAP otherwise.
+    """
+    table = model.__table__
+    primary_key = list(table.primary_key.columns)[0]
+    sort = sort or primary_key.name
+    if sort not in table.columns or sort not in sortable_columns(model):
+        raise ValueError(f'Cannot sort by {sort}')
+
+    conditions = []
+    for name, value in (filters or {}).items():
+        if name not in table.columns:
+            raise ValueError(f'Unknown column: {name}')
+        if value.strip():
+            conditions.append(_column_filter(table.columns[name], value.strip()))
+
+    key_columns = [primary_key] if sort == primary_key.name else [table.columns[sort], primary_key]
+    per_page = max(1, min(per_page or app.config['TABLE_VIEW_PAGE_SIZE'], app.config['TABLE_VIEW_MAX_PAGE_SIZE']))
+    page = keyset_paginate(model.query.filter(*conditions), key_columns, after=after, before=before,
+                           per_page=per_page, descending=direction == 'desc')
+
+    if conditions:
+        capped = select(primary_key).where(*conditions).limit(COUNT_CAP + 1).subquery()
+        total = db.session.execute(select(func.count()).select_from(capped)).scalar()
+        total_exact = total <= COUNT_CAP
+        total = min(total, COUNT_CAP)
+    else:
+        total = platform_stats.get(f'{table.name}.total')[f'{table.name}.total']
+        total_exact = True
+
+    names = [column.name for column in table.columns]
+    return {
+        'table': table.name,
+        'columns': describe_columns(model),
+        'rows': [[_serialize(getattr(record, name)) for name in names] for record in page.items],
+        'sort': sort,
+        'direction': 'desc' if direction == 'desc' else 'asc',
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor,
+        'total': total,
+        'total_exact': total_exact,
+    }
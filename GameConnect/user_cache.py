@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+from .app import app, db
+from .models import User
+
+app.config.setdefault('USER_CACHE_SIZE', int(os.environ.get('USER_CACHE_SIZE', 1024)))
+app.config.setdefault('USER_CACHE_TTL', float(os.environ.get('USER_CACHE_TTL', 60)))
+
+
+class UserIdentityCache:
+    """Per-process LRU + TTL cache for the Flask-Login user loader.
+
+    Entries are plain column snapshots rather than ORM instances, so nothing
+    is shared between requests or threads; each hit is turned back into a
+    User attached to the current session without a SELECT. Invalidation is
+    local to the process, so other workers can serve a stale entry for at
+    most the TTL.
+    """
+
+    name = 'User loader'
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[user_id]
+            self.misses += 1
+            return None
+
+    def put(self, user_id, snapshot):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, snapshot)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'name': self.name,
+                'entries': len(self._entries),
+                'capacity': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(100.0 * self.hits / lookups, 1) if lookups else 0.0,
+            }
+
+
+user_cache = UserIdentityCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+
+_USER_COLUMNS = [attribute.key for attribute in inspect(User).column_attrs]
+
+
+def load_cached_user(user_id):
+    """Return the active User for user_id, from the cache when possible"""
+    snapshot = user_cache.get(user_id)
+    if snapshot is None:
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        snapshot = {key: getattr(user, key) for key in _USER_COLUMNS}
+        user_cache.put(user_id, snapshot)
+    else:
+        # Rebuild the instance from the snapshot and attach it to this
+        # request's session without loading it again
+        user = User(**snapshot)
+        make_transient_to_detached(user)
+        user = db.session.merge(user, load=False)
+
+    # Deactivated accounts are logged out at the latest once the entry expires
+    if user.is_active is False:
+        return None
+    return user
@@ -0,0 +1,21 @@
+# Gunicorn settings (see Procfile and the Deployment section of README.md).
+#
+# The web process uses the default sync workers, forked from a master that
+# has preloaded the app. Worker count: WEB_CONCURRENCY.
+#
+# With LIVE_FEED_SERVICE=1 the same app runs as the live match feed service
+# instead: gevent workers hold the /matches/stream connections as greenlets,
+# so thousands of open browsers cost no worker threads. Only the streams are
+# meant to be sent there; the master is patched before it preloads the app,
+# so the locks and events created at import are gevent-aware in every worker.
+import os
+
+preload_app = True
+
+if os.environ.get('LIVE_FEED_SERVICE'):
+    from gevent import monkey
+
+    monkey.patch_all()
+
+    worker_class = 'gevent'
+    worker_connections = int(os.environ.get('LIVE_FEED_WORKER_CONNECTIONS', 5000))
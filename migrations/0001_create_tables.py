@@ -0,0 +1,11 @@
+"""Create the tables that don't exist yet.
+
+On an empty database this is the whole current schema, which is why the
+later migrations check before they add a column or an index.
+"""
+from GameConnect.app import db
+from GameConnect import models  # noqa: F401  (registers the tables)
+
+
+def upgrade(conn):
+    db.metadata.create_all(conn)
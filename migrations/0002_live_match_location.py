@@ -0,0 +1,9 @@
+"""Add the free-text location columns to live_match (was migrate_live_match.py)"""
+from GameConnect.schema import add_column
+
+
+def upgrade(conn):
+    add_column(conn, 'live_match', 'state', 'VARCHAR(50)')
+    add_column(conn, 'live_match', 'city', 'VARCHAR(50)')
+    add_column(conn, 'live_match', 'area', 'VARCHAR(100)')
+    add_column(conn, 'live_match', 'location', 'VARCHAR(200)')
@@ -0,0 +1,7 @@
+"""Add user.is_owner (was migrations/add_owner_field.py; the owner account itself
+is now created with `flask create-owner`)"""
+from GameConnect.schema import add_column
+
+
+def upgrade(conn):
+    add_column(conn, 'user', 'is_owner', 'BOOLEAN DEFAULT FALSE')
@@ -0,0 +1,14 @@
+"""Cache follower/following counts on user and index follow.followed_id"""
+from GameConnect.follows import reconcile_follow_counts
+from GameConnect.schema import add_column, create_index
+
+# The index is built CONCURRENTLY on PostgreSQL, which can't run in a transaction
+transactional = False
+
+
+def upgrade(conn):
+    added = add_column(conn, 'user', 'followers_count', 'INTEGER NOT NULL DEFAULT 0')
+    added = add_column(conn, 'user', 'following_count', 'INTEGER NOT NULL DEFAULT 0') or added
+    create_index(conn, 'ix_follow_followed_id', 'follow', ['followed_id'])
+    if added:
+        reconcile_follow_counts()
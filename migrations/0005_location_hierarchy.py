@@ -0,0 +1,21 @@
+"""Link user, coaching_ad and live_match to the state/city/area lookup tables and backfill them.
+
+The lookup tables themselves are created by 0001.
+"""
+from GameConnect.locations import backfill_locations
+from GameConnect.schema import add_column, create_index
+
+transactional = False
+
+LOCATED_TABLES = ('user', 'coaching_ad', 'live_match')
+LOOKUP_TABLES = {'state_id': 'state', 'city_id': 'city', 'area_id': 'area'}
+
+
+def upgrade(conn):
+    added = False
+    for table in LOCATED_TABLES:
+        for column, lookup in LOOKUP_TABLES.items():
+            added = add_column(conn, table, column, f'INTEGER REFERENCES {lookup} (id)') or added
+            create_index(conn, f'ix_{table}_{column}', table, [column])
+    if added:
+        backfill_locations()
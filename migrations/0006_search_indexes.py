@@ -0,0 +1,8 @@
+"""Full-text (FTS5 / tsvector) and trigram substring search indexes, see fulltext.py"""
+from GameConnect.fulltext import install_fulltext_indexes
+
+transactional = False
+
+
+def upgrade(conn):
+    install_fulltext_indexes()
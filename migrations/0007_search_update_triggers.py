@@ -0,0 +1,8 @@
+"""Fire the SQLite search index update triggers only for the indexed columns, see fulltext.py"""
+from GameConnect.fulltext import install_fulltext_indexes
+
+transactional = False
+
+
+def upgrade(conn):
+    install_fulltext_indexes()
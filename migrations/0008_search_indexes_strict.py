@@ -0,0 +1,82 @@
+"""Make sure the search indexes from 0006/0007 really exist, failing the migration if they can't be built.
+
+0006 and 0007 went through install_fulltext_indexes(), which only logs a
+failed build so searches can fall back to ILIKE; a database without them was
+still recorded as migrated. The DDL is spelled out here so it stays as
+applied, and any error propagates. On SQLite the update triggers fire only for
+the indexed columns.
+"""
+from sqlalchemy import inspect, text
+from GameConnect.schema import create_index
+
+# CREATE INDEX CONCURRENTLY on PostgreSQL can't run in a transaction
+transactional = False
+
+# Index table: (content table, indexed columns, FTS5 tokenizer)
+SQLITE_INDEXES = {
+    'coaching_ad_fts': ('coaching_ad', ('title', 'description', 'location', 'state', 'city', 'area'),
+                        'unicode61 remove_diacritics 2'),
+    'store_product_fts': ('store_product', ('name', 'description', 'category'),
+                          'unicode61 remove_diacritics 2'),
+    'live_match_fts': ('live_match', ('title', 'description', 'teams', 'location'),
+                       'unicode61 remove_diacritics 2'),
+    'user_trigram': ('user', ('name', 'username', 'email', 'city', 'state'), 'trigram'),
+}
+
+# Table: columns of its generated tsvector search_vector column
+POSTGRESQL_FULLTEXT = {
+    'coaching_ad': ('title', 'description', 'location', 'state', 'city', 'area'),
+    'store_product': ('name', 'description', 'category'),
+    'live_match': ('title', 'description', 'teams', 'location'),
+}
+
+POSTGRESQL_TRIGRAM = {
+    'user': ('name', 'username', 'email', 'city', 'state'),
+}
+
+
+def upgrade(conn):
+    if conn.dialect.name == 'sqlite':
+        upgrade_sqlite(conn)
+    elif conn.dialect.name == 'postgresql':
+        upgrade_postgresql(conn)
+
+
+def upgrade_sqlite(conn):
+    for fts, (table, columns, tokenize) in SQLITE_INDEXES.items():
+        column_list = ', '.join(columns)
+        new_values = ', '.join(f'new.{column}' for column in columns)
+        old_values = ', '.join(f'old.{column}' for column in columns)
+        # One transaction per index, so a half-built one is rolled back and
+        # built again (and populated) when the migration is re-run
+        with conn.engine.begin() as tx:
+            created = not inspect(tx).has_table(fts)
+            tx.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+                f"{column_list}, content='{table}', content_rowid='id', tokenize='{tokenize}')"))
+            tx.execute(text(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON \"{table}\" BEGIN "
+                f"INSERT INTO {fts}(rowid, {column_list}) VALUES (new.id, {new_values}); END"))
+            tx.execute(text(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON \"{table}\" BEGIN "
+                f"INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values}); END"))
+            tx.execute(text(f"DROP TRIGGER IF EXISTS {fts}_au"))
+            tx.execute(text(
+                f"CREATE TRIGGER {fts}_au AFTER UPDATE OF {column_list} ON \"{table}\" BEGIN "
+                f"INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values}); "
+                f"INSERT INTO {fts}(rowid, {column_list}) VALUES (new.id, {new_values}); END"))
+            if created:
+                tx.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+
+
+def upgrade_postgresql(conn):
+    for table, columns in POSTGRESQL_FULLTEXT.items():
+        document = " || ' ' || ".join(f"coalesce({column}, '')" for column in columns)
+        conn.execute(text(
+            f'ALTER TABLE "{table}" ADD COLUMN IF NOT EXISTS search_vector tsvector '
+            f"GENERATED ALWAYS AS (to_tsvector('simple', {document})) STORED"))
+        create_index(conn, f'ix_{table}_search_vector', table, ['search_vector'], using='GIN')
+    conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+    for table, columns in POSTGRESQL_TRIGRAM.items():
+        for column in columns:
+            create_index(conn, f'ix_{table}_{column}_trgm', table, [f'{column} gin_trgm_ops'], using='GIN')
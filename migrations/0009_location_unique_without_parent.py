@@ -0,0 +1,66 @@
+"""Unique city names among cities without a state (and areas without a city), plus pattern indexes for prefix searches on PostgreSQL.
+
+unique_city_per_state and unique_area_per_city treat every NULL parent as
+distinct, so concurrent inserts could create the same parentless city or
+area twice. Existing duplicates are merged into the oldest row before the
+partial unique indexes are built.
+"""
+from sqlalchemy import text
+from GameConnect.schema import create_index
+
+# The indexes are built CONCURRENTLY on PostgreSQL, which can't run in a transaction
+transactional = False
+
+LOCATED_TABLES = ('user', 'coaching_ad', 'live_match')
+LOOKUP_TABLES = ('state', 'city', 'area')
+
+
+def _duplicates(tx, table, parent):
+    return tx.execute(text(
+        f'SELECT id, (SELECT MIN(k.id) FROM {table} k WHERE k.{parent} IS NULL '
+        f'AND k.normalized_name = d.normalized_name) FROM {table} d WHERE d.{parent} IS NULL'
+    )).all()
+
+
+def _repoint(tx, column, old_id, new_id):
+    for table in LOCATED_TABLES:
+        tx.execute(text(f'UPDATE "{table}" SET {column} = :new WHERE {column} = :old'),
+                   {'new': new_id, 'old': old_id})
+
+
+def _merge_area(tx, area_id, keep_id):
+    _repoint(tx, 'area_id', area_id, keep_id)
+    tx.execute(text('DELETE FROM area WHERE id = :id'), {'id': area_id})
+
+
+def _merge_city(tx, city_id, keep_id):
+    # Its areas move to the kept city, or merge into one of the same name there
+    areas = tx.execute(text('SELECT id, normalized_name FROM area WHERE city_id = :id'), {'id': city_id}).all()
+    for area_id, normalized_name in areas:
+        existing = tx.execute(text('SELECT id FROM area WHERE city_id = :city AND normalized_name = :name'),
+                              {'city': keep_id, 'name': normalized_name}).scalar()
+        if existing is None:
+            tx.execute(text('UPDATE area SET city_id = :city WHERE id = :id'), {'city': keep_id, 'id': area_id})
+        else:
+            _merge_area(tx, area_id, existing)
+    _repoint(tx, 'city_id', city_id, keep_id)
+    tx.execute(text('DELETE FROM city WHERE id = :id'), {'id': city_id})
+
+
+def upgrade(conn):
+    # Merging is safe to repeat, so it can run as its own transaction
+    with conn.engine.begin() as tx:
+        for city_id, keep_id in _duplicates(tx, 'city', 'state_id'):
+            if city_id != keep_id:
+                _merge_city(tx, city_id, keep_id)
+        for area_id, keep_id in _duplicates(tx, 'area', 'city_id'):
+            if area_id != keep_id:
+                _merge_area(tx, area_id, keep_id)
+
+    create_index(conn, 'unique_city_without_state', 'city', ['normalized_name'], unique=True,
+                 where='state_id IS NULL')
+    create_index(conn, 'unique_area_without_city', 'area', ['normalized_name'], unique=True,
+                 where='city_id IS NULL')
+    if conn.dialect.name == 'postgresql':
+        for table in LOOKUP_TABLES:
+            create_index(conn, f'ix_{table}_normalized_name_pattern', table, ['normalized_name text_pattern_ops'])
@@ -0,0 +1,9 @@
+"""Compute the materialized dashboard counters on the primary before the workers start, see stats.py"""
+from GameConnect.stats import reconcile_stats
+
+# reconcile_stats() commits through the ORM session
+transactional = False
+
+
+def upgrade(conn):
+    reconcile_stats()
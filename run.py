@@ -1,4 +1,15 @@
-from GameConnect.app import app
+import os
+
+os.environ.setdefault('APP_ENV', 'development')
+
+from GameConnect.app import create_app
+from GameConnect.schema import migrate_database
+
+app = create_app()
 
 if __name__ == '__main__':
+    # The development server brings its own database up to date; deployments
+    # run `flask migrate-database` once before starting the workers
+    with app.app_context():
+        migrate_database(log=print)
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -1,4 +1,6 @@
-from GameConnect.app import app
+from GameConnect.app import create_app
+
+app = create_app()
 
 if __name__ == '__main__':
     app.run()
\ No newline at end of file